@@ -48,34 +48,106 @@ mkdir -p "$INSTALL_DIR" "$CONFIG_DIR" "$STATE_DIR"
 cat > "$INSTALL_DIR/siem_agent.py" <<'PYEOF'
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import argparse
+import ctypes
+import fnmatch
+import functools
+import glob
+import gzip
+import http.client
 import json
 import os
+import random
+import re
+import select
+import signal
 import socket
+import ssl
+import subprocess
 import sys
+import threading
 import time
-import urllib.request
+import urllib.parse
+import uuid
 from datetime import datetime, timezone
 
 DEFAULT_CONFIG_PATH = "/etc/siem-agent/config.json"
 DEFAULT_STATE_PATH = "/var/lib/siem-agent/state.json"
+SEQ_BLOCK = 100000
 
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def read_text_file_safe(path: str, max_bytes: int = 1024 * 128) -> str:
+    try:
+        with open(path, "rb") as f:
+            data = f.read(max_bytes)
+        return data.decode("utf-8", errors="replace")
+    except Exception:
+        return ""
+
+
 def load_json(path: str) -> dict:
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
 
-def save_json(path: str, data: dict) -> None:
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    tmp = f"{path}.tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-    os.replace(tmp, path)
+class StateCheckpointer:
+    """Writes the agent state file only when its content changed.
+
+    The state is compact JSON (one [dev, inode, offset] triple per input plus
+    the sequence counters). Writes are spaced by min_interval seconds and
+    fsynced at most every fsync_interval seconds; durable saves (sequence
+    reservations, shutdown) are written and fsynced at once. A crash rolls
+    the offsets back to the last save, so the lines read since then (up to
+    min_interval seconds of input, more if that save was not yet fsynced)
+    are read again and shipped as duplicates: they get new sequence
+    numbers, which the server cannot tell from fresh lines.
+    """
+
+    def __init__(self, path: str, min_interval: float = 5.0, fsync_interval: float = 60.0) -> None:
+        self.path = path
+        self.min_interval = min_interval
+        self.fsync_interval = fsync_interval
+        self.stats = {"writes": 0, "fsyncs": 0}
+        self._written = b""
+        self._written_at = 0.0
+        self._synced_at = 0.0
+
+    def save(self, state: dict, durable: bool = False) -> bool:
+        now = time.monotonic()
+        if not durable and now - self._written_at < self.min_interval:
+            return False
+        data = json.dumps(state, separators=(",", ":"), sort_keys=True).encode("utf-8")
+        if data == self._written and (not durable or self._synced_at >= self._written_at):
+            return False
+        sync = durable or now - self._synced_at >= self.fsync_interval
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        if sync:
+            # The rename itself is only durable once the directory is synced
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._synced_at = now
+            self.stats["fsyncs"] += 1
+        self._written = data
+        self._written_at = now
+        self.stats["writes"] += 1
+        return True
 
 
 def get_hostname() -> str:
@@ -86,6 +158,7 @@ def get_hostname() -> str:
 
 
 def get_primary_ip() -> str:
+    # Best-effort: determine outbound IP without sending packets
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
@@ -124,6 +197,7 @@ def read_cpu_stat() -> list[int]:
             for line in f:
                 if line.startswith("cpu "):
                     parts = line.split()
+                    # cpu user nice system idle iowait irq softirq steal guest guest_nice
                     nums = [int(p) for p in parts[1:8]]
                     return nums
     except Exception:
@@ -136,8 +210,10 @@ def cpu_usage_percent(prev: list[int], cur: list[int]) -> float:
         return 0.0
     prev_idle = prev[3] + (prev[4] if len(prev) > 4 else 0)
     cur_idle = cur[3] + (cur[4] if len(cur) > 4 else 0)
+
     prev_total = sum(prev)
     cur_total = sum(cur)
+
     total_delta = cur_total - prev_total
     idle_delta = cur_idle - prev_idle
     if total_delta <= 0:
@@ -146,53 +222,1396 @@ def cpu_usage_percent(prev: list[int], cur: list[int]) -> float:
 
 
 def build_event(source: str, raw_data: dict) -> dict:
-    return {"source": source, "raw_data": raw_data, "timestamp": utc_now_iso()}
-
-
-def post_json(url: str, token: str, payload: dict, timeout_seconds: int = 10) -> None:
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Content-Type", "application/json")
-    req.add_header("Authorization", f"Bearer {token}")
-    with urllib.request.urlopen(req, timeout=timeout_seconds) as resp:
-        _ = resp.read(1024)
+    return {
+        "source": source,
+        "raw_data": raw_data,
+        "timestamp": utc_now_iso(),
+    }
+
+
+def line_event(
+    source: str,
+    path: str,
+    line: str,
+    hostname: str,
+    ip: str,
+    parse_auth: bool = False,
+    repeat_count: int = 1,
+) -> dict:
+    raw_data = {
+        "host": hostname,
+        "ip": ip,
+        "file": path,
+        "message": line,
+    }
+    if parse_auth:
+        # An empty event_kind tells the server the line matched no pattern
+        raw_data.update(parse_auth_line(line) or {"event_kind": ""})
+    if repeat_count > 1:
+        raw_data["repeat_count"] = repeat_count
+    return build_event(source=source, raw_data=raw_data)
 
 
 def normalize_base_url(base_url: str) -> str:
     base = (base_url or "").strip()
     if not base:
         return ""
+    # Accept raw IP/domain by defaulting to http://
     if "://" not in base:
         base = f"http://{base}"
     return base.rstrip("/")
 
 
-def ingest_url(base_url: str) -> str:
+def ndjson_url(base_url: str) -> str:
     base = normalize_base_url(base_url)
-    return f"{base}/api/v1/events/ingest"
+    return f"{base}/api/v1/events/ingest/ndjson"
+
+
+# Mirror of AUTH_PATTERNS in susdr360/api/auth_patterns.py (the agent ships
+# as a single stdlib file): keep both tables and their order in sync.
+# Rows: (event_kind, programs, literal, regex, auth_method)
+_IP = r"(?P<src_ip>\d+\.\d+\.\d+\.\d+)"
+_SSHD = ("sshd", "sshd-session")
+AUTH_PATTERNS = [
+    ("ssh_auth_failed", _SSHD, "Failed password for ",
+     re.compile(r"Failed password for (invalid user )?(?P<user>\S+) from " + _IP), "password"),
+    ("ssh_auth_failed", _SSHD, "Failed publickey for ",
+     re.compile(r"Failed publickey for (invalid user )?(?P<user>\S+) from " + _IP), "publickey"),
+    ("ssh_auth_success", _SSHD, "Accepted ",
+     re.compile(r"Accepted (?P<method>password|publickey) for (?P<user>\S+) from " + _IP), ""),
+    ("ssh_invalid_user", _SSHD, "Invalid user ",
+     re.compile(r"Invalid user (?P<user>\S+) from " + _IP), ""),
+    ("ssh_max_auth_attempts", _SSHD, "maximum authentication attempts exceeded",
+     re.compile(r"maximum authentication attempts exceeded for (invalid user )?(?P<user>\S+) from " + _IP), ""),
+    ("sudo_command", ("sudo",), "COMMAND=",
+     re.compile(r"sudo(?:\[\d+\])?: +(?P<user>\S+) : .*COMMAND=(?P<cmd>.+)$"), ""),
+    ("su_failed", ("su",), "FAILED SU",
+     re.compile(r"FAILED SU \(to \S+\) (?P<user>\S+)"), ""),
+    ("su_success", ("su",), "Successful su for ",
+     re.compile(r"Successful su for \S+ by (?P<user>\S+)"), ""),
+    ("pam_auth_failure", (), "authentication failure;",
+     re.compile(r"pam_unix\([^)]*:auth\): authentication failure;.*?rhost=(?:" + _IP + r")?(?:.*\buser=(?P<user>\S+))?"),
+     "pam"),
+    ("logind_new_session", ("systemd-logind",), "New session ",
+     re.compile(r"New session \S+ of user (?P<user>[^\s.]+)"), ""),
+]
+
+def _auth_any_in(needles) -> str:
+    return " or ".join(f"{needle!r} in msg" for needle in dict.fromkeys(needles))
+
+
+def _auth_row_source(index: int, row: tuple, programs: list, indent: str, tagged: bool, known: str = "") -> list:
+    """Source trying one row, `known` being a literal already found in the line"""
+    event_kind, row_programs, literal, regex, auth_method = row
+    groups = regex.groupindex
+
+    def group(name: str, default: str) -> str:
+        return f"(m[{groups[name]}] or {default!r})" if name in groups else repr(default)
+
+    command = f"{group('cmd', '')}.strip()" if "cmd" in groups else "''"
+    fields = (
+        f"{{'event_kind': {event_kind!r}, 'src_ip': {group('src_ip', '')}, "
+        f"'username': {group('user', '')}, 'auth_method': {group('method', auth_method)}, 'command': {command}}}"
+    )
+    source = [f"{indent}m = search_{index}(msg)"]
+    if row_programs:
+        # The line's program is its first known syslog tag; a line naming no
+        # other known program needs no regex scan to settle it
+        own = [f" {name}{sep}" for name in row_programs for sep in "[:"]
+        others = [
+            needle
+            for name in programs if name not in row_programs
+            for needle in ([f" {name}{sep}" for sep in "[:"] if any(f" {name}" in tag for tag in own) else [f" {name}"])
+        ]
+        others = [o for o in others if not any(n != o and n in o for n in others)]
+        fast = f"({_auth_any_in(own)})" + (f" and not ({_auth_any_in(others)})" if others else "")
+        allowed = row_programs if tagged else row_programs + (None,)
+        source.append(f"{indent}if m is not None and ({fast} or program(msg) in {allowed!r}):")
+    else:
+        source.append(f"{indent}if m is not None:")
+    source.append(f"{indent}    return {fields}")
+    if literal == known:
+        return source
+    return [f"{indent}if {literal!r} in msg:"] + ["    " + line for line in source]
+
+
+def _compile_auth_parser():
+    """Same generated parser as the server's _compile_parser()"""
+    rows = list(enumerate(AUTH_PATTERNS))
+    programs = sorted({name for row in AUTH_PATTERNS for name in row[1]}, key=len, reverse=True)
+    tag = re.compile(r"(" + "|".join(re.escape(name) for name in programs) + r")[\[:]")
+    find_program, match_program = re.compile(" " + tag.pattern).search, tag.match
+
+    def program(msg: str) -> str | None:
+        found = find_program(msg) or match_program(msg)
+        return found[1] if found else None
+
+    namespace = {"program": program}
+    namespace.update((f"search_{i}", row[3].search) for i, row in rows)
+    source = ["def parse(msg):", "    if ']: ' in msg:"]
+    groups = list(dict.fromkeys(row[1] for row in AUTH_PATTERNS if row[1]))
+    for position, names in enumerate(groups):
+        gates = [n for n in names if not any(o != n and o in n for o in names)]
+        source.append(f"        if {_auth_any_in(gates)}:")
+        candidates = [(i, row) for i, row in rows if not row[1] or row[1] in groups[position:]]
+        literals = list(dict.fromkeys(row[2] for row in AUTH_PATTERNS if row[1] == names))
+        for tested, literal in enumerate(literals):
+            source.append(f"            if {literal!r} in msg:")
+            for i, row in candidates:
+                if row[2] not in literals[:tested]:
+                    source += _auth_row_source(i, row, programs, " " * 16, True, literal)
+            source.append("                return None")
+    for i, row in rows:
+        if not row[1]:
+            source += _auth_row_source(i, row, programs, " " * 8, True)
+    source.append("        return None")
+    for i, row in rows:
+        source += _auth_row_source(i, row, programs, " " * 4, False)
+    source.append("    return None")
+    exec("\n".join(source), namespace)
+    return namespace["parse"]
+
+
+_auth_parse = _compile_auth_parser()
+
+
+def parse_auth_line(message: str) -> dict | None:
+    """Same result as the server's parse_auth_line()"""
+    return _auth_parse(message or "")
+
+
+_SYSLOG_TIMESTAMP = re.compile(r"^(?:[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d|\d{4}-\d\d-\d\dT\S+) ")
+
+
+class RepeatCollapser:
+    """Collapses runs of identical log lines, timestamps aside.
+
+    The first line of a run passes through at once; its repeats within
+    window_seconds are only counted and come out as a single line with the
+    repeat count when the run ends or the window expires (drain()).
+    """
+
+    def __init__(self, window_seconds: float = 2.0) -> None:
+        self.window_seconds = window_seconds
+        self._key: str | None = None
+        self._last = ""
+        self._count = 0
+        self._since = 0.0
+
+    def feed(self, line: str) -> list[tuple[str, int]]:
+        if not self.window_seconds:
+            return [(line, 1)]
+        key = _SYSLOG_TIMESTAMP.sub("", line, count=1)
+        now = time.monotonic()
+        if key == self._key and now - self._since < self.window_seconds:
+            self._count += 1
+            self._last = line
+            return []
+        out = self.drain()
+        self._key = key
+        self._since = now
+        out.append((line, 1))
+        return out
+
+    def drain(self, expired_only: bool = False) -> list[tuple[str, int]]:
+        if not self._count:
+            return []
+        if expired_only and time.monotonic() - self._since < self.window_seconds:
+            return []
+        out = [(self._last, self._count)]
+        self._key = None
+        self._count = 0
+        return out
+
+
+class Spool:
+    """Append-only NDJSON segment files for events the server could not take yet.
+
+    Segments are named after the sequence number of their first event and a
+    new one is started past segment_bytes; beyond max_bytes the oldest
+    segments are evicted whole. Events are read back oldest first and
+    acknowledged once shipped; acked_seq (persisted by the caller) lets a
+    restarted agent skip what was already delivered.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 128 * 1024 * 1024,
+        segment_bytes: int = 8 * 1024 * 1024,
+        acked_seq: int = 0,
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = max(4096, min(segment_bytes, max_bytes // 2 or segment_bytes))
+        self.acked_seq = acked_seq
+        self.events = 0
+        self.bytes = 0
+        self.evicted = 0
+        # [path, first_seq, file size, unread events], oldest first; bytes and
+        # events count what is left to ship, _read_pos applies to the first
+        self._segments: list[list] = []
+        self._read_pos = 0
+        self._writer = None
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".ndjson") or not name[:-7].isdigit():
+                continue
+            path = os.path.join(self.directory, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            if data and not data.endswith(b"\n"):
+                # Torn write from a crash: drop the partial last record
+                data = data[: data.rfind(b"\n") + 1]
+                with open(path, "r+b") as f:
+                    f.truncate(len(data))
+            self._segments.append([path, int(name[:-7]), len(data), data.count(b"\n")])
+            self.events += data.count(b"\n")
+            self.bytes += len(data)
+        # Whole segments followed by one starting at or before acked_seq + 1 were delivered
+        while len(self._segments) > 1 and self._segments[1][1] <= self.acked_seq + 1:
+            self._remove_oldest()
+        if self._segments:
+            with open(self._segments[0][0], "rb") as f:
+                for line in f:
+                    try:
+                        seq = int(json.loads(line).get("seq", 0))
+                    except (ValueError, AttributeError):
+                        seq = 0
+                    if seq > self.acked_seq:
+                        break
+                    self._read_pos += len(line)
+                    self._segments[0][3] -= 1
+                    self.events -= 1
+                    self.bytes -= len(line)
+            if not self._segments[0][3]:
+                self._remove_oldest()
+
+    def _remove_oldest(self) -> None:
+        path, _, size, events = self._segments.pop(0)
+        if self._writer is not None and not self._segments:
+            self._writer.close()
+            self._writer = None
+        self.bytes -= size - self._read_pos
+        self.events -= events
+        self._read_pos = 0
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
 
+    def append(self, lines: list[bytes], seqs: list[int]) -> None:
+        for line, seq in zip(lines, seqs):
+            if self._writer is None or self._segments[-1][2] >= self.segment_bytes:
+                if self._writer is not None:
+                    self._writer.close()
+                path = os.path.join(self.directory, f"{seq:020d}.ndjson")
+                self._writer = open(path, "ab")
+                self._segments.append([path, seq, 0, 0])
+            self._writer.write(line)
+            self._segments[-1][2] += len(line)
+            self._segments[-1][3] += 1
+            self.events += 1
+            self.bytes += len(line)
+        if self._writer is not None:
+            # Durable before the caller commits the file offsets of these lines
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+        while self.bytes > self.max_bytes and len(self._segments) > 1:
+            self.evicted += self._segments[0][3]
+            self._remove_oldest()
+
+    def read(self, max_events: int, max_bytes: int) -> tuple[list[bytes], int]:
+        """Oldest unacknowledged events (at least one) and the seq of the last"""
+        if not self._segments:
+            return [], self.acked_seq
+        lines: list[bytes] = []
+        size = 0
+        with open(self._segments[0][0], "rb") as f:
+            f.seek(self._read_pos)
+            for line in f:
+                if lines and (len(lines) >= max_events or size + len(line) > max_bytes):
+                    break
+                lines.append(line)
+                size += len(line)
+        last_seq = self.acked_seq
+        if lines:
+            try:
+                last_seq = int(json.loads(lines[-1]).get("seq", last_seq))
+            except (ValueError, AttributeError):
+                pass
+        return lines, last_seq
+
+    def ack(self, lines: list[bytes], last_seq: int) -> None:
+        size = sum(len(ln) for ln in lines)
+        self._read_pos += size
+        self._segments[0][3] -= len(lines)
+        self.bytes -= size
+        self.events -= len(lines)
+        self.acked_seq = max(self.acked_seq, last_seq)
+        if self._segments[0][3] <= 0:
+            # Fully shipped (the current write segment too: the next append starts a new one)
+            self._segments[0][3] = 0
+            self._remove_oldest()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class Shipper:
+    """Batches events and POSTs them as (gzipped) NDJSON over one kept-alive
+    HTTP/1.1 connection.
+
+    A batch is sent when it reaches max_events or max_bytes, or max_delay
+    seconds after its first event. add() may be called from any thread;
+    sending happens in the thread calling poll()/flush(). Failed sends are retried with exponential
+    backoff (plus jitter, or the server's Retry-After). With a spool, pending
+    events are moved to disk while the server is unreachable and drained
+    first once it is back; without one they accumulate up to max_pending,
+    beyond which the oldest are dropped (readers are expected to pause
+    before that, see has_room()).
+
+    Every event carries the shipper's stream id and a sequence number, so
+    the server can drop the resends of at-least-once delivery. add() takes
+    an optional on_sent callback, run once the event has been delivered,
+    permanently refused or spooled: this is how file offsets are only
+    committed for lines that cannot be lost anymore.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        max_events: int = 500,
+        max_bytes: int = 512 * 1024,
+        max_delay: float = 1.0,
+        compress: bool = True,
+        timeout_seconds: float = 10.0,
+        backoff_initial: float = 1.0,
+        backoff_max: float = 60.0,
+        max_pending: int = 50000,
+        spool: Spool | None = None,
+        stream: str = "",
+        next_seq: int = 1,
+    ) -> None:
+        parts = urllib.parse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname or ""
+        self.port = parts.port
+        self.path = parts.path or "/"
+        self.token = token
+        self.max_events = max(1, max_events)
+        self.max_bytes = max(1024, max_bytes)
+        self.max_delay = max_delay
+        self.compress = compress
+        self.timeout_seconds = timeout_seconds
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_pending = max(self.max_events, max_pending)
+        self.spool = spool
+        self.stream = stream
+        self.next_seq = next_seq
+
+        self._conn: http.client.HTTPConnection | None = None
+        # Readers add from their own threads; the events at the head of the
+        # queue being sent (_inflight) are left alone until the send ends
+        self._lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self._inflight = 0
+        self._lines: list[bytes] = []
+        self._callbacks: list = []
+        self._seqs: list[int] = []
+        self._bytes = 0
+        self._first_at = 0.0
+        self._retry_at = 0.0
+        self._backoff = 0.0
+        self.stats = {"events_sent": 0, "requests": 0, "bytes_sent": 0, "send_errors": 0, "events_dropped": 0}
+
+    def add(self, event: dict, on_sent=None) -> None:
+        with self._lock:
+            event["stream"] = self.stream
+            event["seq"] = self.next_seq
+            line = json.dumps(event, separators=(",", ":")).encode("utf-8") + b"\n"
+            if not self._lines:
+                self._first_at = time.monotonic()
+            self._lines.append(line)
+            self._callbacks.append(on_sent)
+            self._seqs.append(self.next_seq)
+            self.next_seq += 1
+            self._bytes += len(line)
+            if len(self._lines) > self.max_pending:
+                # Oldest first, but never the batch being sent
+                start = self._inflight
+                dropped = min(len(self._lines) - self.max_pending, len(self._lines) - 1 - start)
+                self._bytes -= sum(len(ln) for ln in self._lines[start:start + dropped])
+                del self._lines[start:start + dropped]
+                del self._callbacks[start:start + dropped]
+                del self._seqs[start:start + dropped]
+                self.stats["events_dropped"] += dropped
+            if len(self._lines) >= self.max_events or self._bytes >= self.max_bytes:
+                self.wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._lines)
+
+    def has_room(self, count: int) -> bool:
+        return len(self._lines) + count <= self.max_pending
+
+    def after_pending(self, callback) -> None:
+        """Runs callback once every event added so far is shipped (now if none is pending)"""
+        with self._lock:
+            if self._lines:
+                previous = self._callbacks[-1]
+                if previous is None:
+                    self._callbacks[-1] = callback
+                else:
+                    self._callbacks[-1] = lambda: (previous(), callback())
+                return
+        callback()
+
+    def spooled(self) -> int:
+        return self.spool.events if self.spool is not None else 0
+
+    def due(self) -> bool:
+        if time.monotonic() < self._retry_at:
+            return False
+        if self.spooled():
+            return True
+        if not self._lines:
+            return False
+        return (
+            len(self._lines) >= self.max_events
+            or self._bytes >= self.max_bytes
+            or time.monotonic() - self._first_at >= self.max_delay
+        )
+
+    def wait(self, timeout: float) -> None:
+        """Sleeps up to timeout, less when a batch fills up or falls due"""
+        if self._lines and not self._retry_at:
+            timeout = min(timeout, max(0.0, self._first_at + self.max_delay - time.monotonic()))
+        self.wakeup.wait(timeout)
+        self.wakeup.clear()
+
+    def poll(self) -> None:
+        if self.due():
+            self.flush()
+        elif self._retry_at and self._lines:
+            # Server unreachable: keep memory small and let readers go on
+            self._spill()
+
+    def _pop(self, count: int) -> None:
+        with self._lock:
+            callbacks = [cb for cb in self._callbacks[:count] if cb is not None]
+            self._bytes -= sum(len(ln) for ln in self._lines[:count])
+            del self._lines[:count]
+            del self._callbacks[:count]
+            del self._seqs[:count]
+            self._inflight = 0
+        for callback in callbacks:
+            callback()
+
+    def _spill(self) -> None:
+        if self.spool is None:
+            return
+        with self._lock:
+            lines, seqs = self._lines[:], self._seqs[:]
+            self._inflight = len(lines)
+        if not lines:
+            return
+        try:
+            self.spool.append(lines, seqs)
+        except OSError as e:
+            self._inflight = 0
+            print(f"Cannot write spool {self.spool.directory}: {e}", file=sys.stderr)
+            return
+        self._pop(len(lines))
+
+    def flush(self) -> bool:
+        """Sends everything pending; only one thread (the supervisor) may call it"""
+        while self.spooled():
+            lines, last_seq = self.spool.read(self.max_events, self.max_bytes)
+            if not lines:
+                break
+            if not self._send(b"".join(lines), len(lines)):
+                self._spill()
+                return False
+            self.spool.ack(lines, last_seq)
+        while self._lines:
+            count = 0
+            size = 0
+            with self._lock:
+                for line in self._lines:
+                    if count and (count >= self.max_events or size + len(line) > self.max_bytes):
+                        break
+                    count += 1
+                    size += len(line)
+                body = b"".join(self._lines[:count])
+                self._inflight = count
+            if not self._send(body, count):
+                self._inflight = 0
+                self._spill()
+                return False
+            self._pop(count)
+            self._first_at = time.monotonic()
+        return True
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self._conn is None:
+            if self.scheme == "https":
+                self._conn = http.client.HTTPSConnection(
+                    self.host, self.port, timeout=self.timeout_seconds, context=ssl.create_default_context()
+                )
+            else:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout_seconds)
+        return self._conn
 
-def tail_file_lines(path: str, start_offset: int) -> tuple[int, list[str]]:
-    try:
-        with open(path, "rb") as f:
-            f.seek(0, os.SEEK_END)
-            end = f.tell()
-            if start_offset > end:
-                start_offset = end
-            f.seek(start_offset)
-            data = f.read()
-            new_offset = f.tell()
+    def _close_connection(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _send(self, body: bytes, count: int) -> bool:
+        headers = {
+            "Content-Type": "application/x-ndjson",
+            "Authorization": f"Bearer {self.token}",
+            "Connection": "keep-alive",
+        }
+        if self.compress:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+
+        retry_after = None
+        try:
+            conn = self._connection()
+            conn.request("POST", self.path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            status = resp.status
+            retry_after = resp.getheader("Retry-After")
+            if resp.getheader("Connection", "").lower() == "close":
+                self._close_connection()
+        except (OSError, http.client.HTTPException) as e:
+            # Stale keep-alive connection, refused, timeout...: reconnect next time
+            self._close_connection()
+            status = 0
+            error = str(e)
+        else:
+            error = f"HTTP {status}"
+
+        self.stats["requests"] += 1
+        if 200 <= status < 300:
+            self.stats["events_sent"] += count
+            self.stats["bytes_sent"] += len(body)
+            self._backoff = 0.0
+            self._retry_at = 0.0
+            return True
+
+        self.stats["send_errors"] += 1
+        if 400 <= status < 500 and status not in (401, 403, 408, 429):
+            # The server will never accept this batch: drop it instead of looping
+            # (the lines still count as shipped for the file offsets)
+            print(f"Batch of {count} events rejected by server ({error}), dropped", file=sys.stderr)
+            self.stats["events_dropped"] += count
+            return True
+
+        self._backoff = min(self.backoff_max, self._backoff * 2 if self._backoff else self.backoff_initial)
+        delay = self._backoff * (0.5 + random.random() / 2)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        self._retry_at = time.monotonic() + delay
+        print(f"Send failed ({error}), retrying in {delay:.1f}s", file=sys.stderr)
+        return False
+
+    def close(self) -> None:
+        # Possibly interrupted mid-request (SIGTERM): start over on a fresh connection
+        self._close_connection()
+        self._inflight = 0
+        self._retry_at = 0.0
+        self.flush()
+        if self.spool is not None:
+            self.spool.close()
+        self._close_connection()
+
+
+class RateBudget:
+    """Token bucket capping lines/s and bytes/s read from the inputs (0: no cap).
+
+    Holds up to one second of budget, so catching up on a backlog is smooth
+    rather than bursty; the bucket holds at least one unit, so rates below 1/s
+    (e.g. 0.5 lines/s) still let a line through every 1/rate seconds.
+    """
+
+    def __init__(self, lines_per_second: float = 0, bytes_per_second: float = 0) -> None:
+        self.lines_per_second = lines_per_second
+        self.bytes_per_second = bytes_per_second
+        self._lines = max(1.0, lines_per_second)
+        self._bytes = max(1.0, bytes_per_second)
+        self._at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._at
+        self._at = now
+        if self.lines_per_second:
+            self._lines = min(max(1.0, self.lines_per_second), self._lines + elapsed * self.lines_per_second)
+        if self.bytes_per_second:
+            self._bytes = min(max(1.0, self.bytes_per_second), self._bytes + elapsed * self.bytes_per_second)
+
+    def exhausted(self) -> bool:
+        self._refill()
+        return bool(
+            (self.lines_per_second and self._lines < 1) or (self.bytes_per_second and self._bytes < 1)
+        )
+
+    def available(self) -> tuple[int, int]:
+        """(lines, bytes) that may be read now, 0 for an uncapped one; call after exhausted()"""
+        lines = int(self._lines) if self.lines_per_second else 0
+        nbytes = int(self._bytes) if self.bytes_per_second else 0
+        return lines, nbytes
+
+    def consume(self, lines: int, nbytes: int) -> None:
+        if self.lines_per_second:
+            self._lines -= lines
+        if self.bytes_per_second:
+            self._bytes -= nbytes
+
+    def wait_seconds(self) -> float:
+        """Time until at least one line and one byte are available again"""
+        self._refill()
+        wait = 0.0
+        if self.lines_per_second and self._lines < 1:
+            wait = max(wait, (1 - self._lines) / self.lines_per_second)
+        if self.bytes_per_second and self._bytes < 1:
+            wait = max(wait, (1 - self._bytes) / self.bytes_per_second)
+        return wait
+
+
+class DirWatcher:
+    """Wakes the agent when files change in the watched directories.
+
+    Uses inotify through ctypes when the kernel/libc provide it; otherwise
+    (or for directories that cannot be watched) wait() is a plain sleep and
+    the tailers fall back to polling.
+    """
+
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, use_inotify: bool = True) -> None:
+        self._fd = -1
+        self._libc = None
+        self._watched: dict[str, int] = {}
+        if not use_inotify:
+            return
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd >= 0:
+            self._fd = fd
+            self._libc = libc
+
+    @property
+    def active(self) -> bool:
+        return self._fd >= 0
+
+    def watch(self, path: str) -> bool:
+        directory = os.path.dirname(os.path.abspath(path)) or "/"
+        if directory in self._watched:
+            return True
+        if not self.active:
+            return False
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            return False
+        self._watched[directory] = wd
+        return True
+
+    def wait(self, timeout: float) -> bool:
+        if not self.active or not self._watched:
+            time.sleep(timeout)
+            return False
+        try:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+        except InterruptedError:
+            return False
+        if not readable:
+            return False
+        # Only "something changed" matters: the tailers stat their files
+        while True:
+            try:
+                if not os.read(self._fd, 64 * 1024):
+                    break
+            except BlockingIOError:
+                break
+            except OSError:
+                break
+        return True
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class FileTailer:
+    """Follows one log file across rotations, identified by (dev, inode).
+
+    The file handle stays open between reads, so after a rename rotation the
+    rest of the old file is read before switching to the new one; a file
+    that shrank in place (copytruncate) is re-read from the start. Data is
+    read in chunk_size pieces with a carry buffer for the trailing partial
+    line, so memory stays bounded whatever the backlog. `offset` is the end
+    of the last complete line returned; the persisted position is the
+    separate committed one, advanced by commit() once lines are shipped.
+    A restored position whose file was rotated while the agent was stopped
+    is looked up by (dev, inode) next to the path ("auth.log.1") and read to
+    its end before the new file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dev: int = 0,
+        ino: int = 0,
+        offset: int = 0,
+        chunk_size: int = 64 * 1024,
+        max_line_bytes: int = 64 * 1024,
+    ) -> None:
+        self.path = path
+        self.dev = dev
+        self.ino = ino
+        self.offset = offset
+        self.chunk_size = chunk_size
+        self.max_line_bytes = max_line_bytes
+        self.committed = (dev, ino, offset)
+        self._fh = None
+        self._carry = b""
+        # Only the first open may resume a file rotated during downtime
+        self._resume_rotated = bool(ino)
+
+    def state(self) -> list[int]:
+        return list(self.committed)
+
+    def position(self) -> tuple[int, int, int]:
+        return (self.dev, self.ino, self.offset)
+
+    def commit(self, position: tuple[int, int, int]) -> None:
+        self.committed = position
+
+    def backlog_bytes(self) -> int:
+        """Bytes of the current file not read yet (rotated leftovers excluded)"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return 0
+        if (st.st_dev, st.st_ino) != (self.dev, self.ino):
+            return st.st_size
+        return max(0, st.st_size - self.offset - len(self._carry))
+
+    def _open_rotated(self):
+        """Handle on the recorded file under its rotated name, or None"""
+        directory = os.path.dirname(self.path) or "."
+        base = os.path.basename(self.path)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return None
+        for name in names:
+            if name == base or not name.startswith(base):
+                continue
+            candidate = os.path.join(directory, name)
+            try:
+                st = os.stat(candidate)
+                if (st.st_dev, st.st_ino) != (self.dev, self.ino) or st.st_size < self.offset:
+                    continue
+                return open(candidate, "rb")
+            except OSError:
+                continue
+        return None
+
+    def _open(self) -> bool:
+        try:
+            fh = open(self.path, "rb")
+        except OSError:
+            return False
+        st = os.fstat(fh.fileno())
+        if self._resume_rotated and (st.st_dev, st.st_ino) != (self.dev, self.ino):
+            rotated = self._open_rotated()
+            if rotated is not None:
+                # Finish the old file first; EOF there switches to self.path
+                fh.close()
+                fh, st = rotated, os.fstat(rotated.fileno())
+            else:
+                print(
+                    f"{self.path} was rotated while the agent was stopped and the previous file "
+                    f"was not found: lines written to it after offset {self.offset} may be lost",
+                    file=sys.stderr,
+                )
+        self._resume_rotated = False
+        if (st.st_dev, st.st_ino) != (self.dev, self.ino) or st.st_size < self.offset:
+            # Another file than the one recorded (or truncated): start over
+            self.dev, self.ino, self.offset = st.st_dev, st.st_ino, 0
+        fh.seek(self.offset)
+        self._fh = fh
+        self._carry = b""
+        return True
+
+    def _close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        self._carry = b""
+
+    def _check_file(self) -> str:
+        """At EOF: "same" file, "truncated" in place, or "rotated" away"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            # Renamed away and not re-created yet: keep the old handle
+            return "same"
+        if (st.st_dev, st.st_ino) != (self.dev, self.ino):
+            return "rotated"
+        if st.st_size < self.offset:
+            # copytruncate: same inode, shrunk under us
+            self.offset = 0
+            self._fh.seek(0)
+            self._carry = b""
+            return "truncated"
+        return "same"
+
+    def read_lines(self, max_lines: int = 0, max_bytes: int = 1024 * 1024) -> list[str]:
+        """Up to max_lines complete lines (0: no limit) from at most max_bytes"""
+        lines: list[str] = []
+        if self._fh is None and not self._open():
+            return lines
+        budget = max_bytes
+        while budget > 0 and (not max_lines or len(lines) < max_lines):
+            chunk = self._fh.read(min(self.chunk_size, budget))
+            if not chunk:
+                status = self._check_file()
+                if status == "truncated":
+                    continue
+                if status == "same":
+                    break
+                # Old file fully read: a partial last line will not be completed
+                if self._carry.strip():
+                    lines.append(self._carry.decode("utf-8", errors="replace"))
+                self._close()
+                if not self._open():
+                    break
+                continue
+            budget -= len(chunk)
+            self._split(chunk, lines, max_lines)
+        return lines
+
+    def _split(self, chunk: bytes, lines: list[str], max_lines: int = 0) -> None:
+        data = self._carry + chunk if self._carry else chunk
+        start = 0
+        while True:
+            if max_lines and len(lines) >= max_lines:
+                # Line budget reached: the rest is read again next time
+                self.offset += start
+                self._fh.seek(self.offset)
+                self._carry = b""
+                return
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            line = data[start:end]
+            if line.strip():
+                lines.append(line.decode("utf-8", errors="replace"))
+            start = end + 1
+        self.offset += start
+        self._carry = data[start:]
+        if len(self._carry) > self.max_line_bytes:
+            # Overlong line: ship it in pieces rather than buffering it whole
+            lines.append(self._carry.decode("utf-8", errors="replace"))
+            self.offset += len(self._carry)
+            self._carry = b""
+
+    def close(self) -> None:
+        self._close()
+
+
+def restore_tailer(path: str, state: dict, chunk_size: int = 64 * 1024) -> FileTailer:
+    saved = state.get("files", {}).get(path)
+    if isinstance(saved, dict):
+        # Pre-compact state files
+        saved = [saved.get("dev", 0), saved.get("ino", 0), saved.get("offset", 0)]
+    if saved:
+        dev, ino, offset = (int(v) for v in saved)
+        return FileTailer(path, dev=dev, ino=ino, offset=offset, chunk_size=chunk_size)
+    return FileTailer(path, chunk_size=chunk_size)
+
+
+def migrate_legacy_offsets(state: dict, paths: dict) -> None:
+    """Older state files only kept {"syslog_offset": n}: assume the current file"""
+    for key, path in paths.items():
+        offset = int(state.pop(key, 0) or 0)
+        if not offset or path in state.setdefault("files", {}):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        state["files"][path] = [st.st_dev, st.st_ino, offset]
+
+
+INPUT_PARSERS = ("raw", "syslog", "auth")
+DEFAULT_EXCLUDE = ("*.gz", "*.xz", "*.bz2", "*.zst", "*.[0-9]", "*.old")
+
+
+def input_specs(config: dict) -> list[dict]:
+    """Inputs as a list of {"path", "source", "parser", ...}
+
+    The former {"syslog": path, "authlog": path} layout is still accepted.
+    Journal inputs ({"type": "journal", ...}) get "journal:<source>" as path,
+    the key of their cursor in the agent state.
+    """
+    inputs = config.get("inputs", {})
+    if isinstance(inputs, dict):
+        return [
+            {"path": inputs.get("syslog", "/var/log/syslog"), "source": "linux_syslog", "parser": "syslog"},
+            {"path": inputs.get("authlog", "/var/log/auth.log"), "source": "linux_auth", "parser": "auth"},
+        ]
+    specs = []
+    for spec in inputs:
+        if spec.get("type") == "journal":
+            spec = dict(spec, path=spec.get("path") or f"journal:{spec.get('source', '')}")
+        if not spec.get("path") or not spec.get("source"):
+            print(f"Input without path or source ignored: {spec}", file=sys.stderr)
+            continue
+        if spec.get("parser", "raw") not in INPUT_PARSERS:
+            print(f"Unknown parser {spec['parser']!r} for {spec['path']}, using raw", file=sys.stderr)
+            spec = dict(spec, parser="raw")
+        specs.append(spec)
+    return specs
+
+
+class InputWorker(threading.Thread):
+    """Tails every file matching one input's path (a glob is allowed) in its
+    own thread.
+
+    Each worker has its own rate budget and change watcher, so a busy or
+    huge input cannot starve the others; the files of one input are read in
+    turn, one bounded batch each per cycle. Glob matches are re-scanned
+    every rescan_seconds; a matched file that disappears is dropped once
+    fully read. Parsers: "auth" adds the auth pattern fields, "syslog"
+    collapses repeated lines, "raw" ships lines as they are.
+    """
+
+    def __init__(
+        self,
+        spec: dict,
+        shipper: Shipper,
+        saved_files: dict,
+        hostname: str,
+        ip: str,
+        defaults: dict,
+    ) -> None:
+        super().__init__(name=f"input:{spec['path']}", daemon=True)
+        self.spec = spec
+        self.pattern = spec["path"]
+        self.source = spec["source"]
+        self.parser = spec.get("parser", "raw")
+        self.exclude = tuple(spec.get("exclude", DEFAULT_EXCLUDE))
+        self.shipper = shipper
+        self.hostname = hostname
+        self.ip = ip
+        self.defaults = defaults
+        self.parse_auth = self.parser == "auth" and defaults.get("parse_auth", True)
+        self.collapse_seconds = float(
+            spec.get("collapse_repeats_seconds", defaults.get("collapse_repeats_seconds", 2.0) if self.parser == "syslog" else 0)
+        )
+        self.poll_seconds = float(defaults.get("poll_seconds", 2))
+        self.read_chunk_bytes = int(defaults.get("read_chunk_bytes", 64 * 1024))
+        self.read_batch_bytes = int(spec.get("read_batch_bytes", defaults.get("read_batch_bytes", 1024 * 1024)))
+        self.rescan_seconds = float(spec.get("rescan_seconds", defaults.get("rescan_seconds", 10)))
+        self.budget = RateBudget(
+            lines_per_second=float(spec.get("max_lines_per_second", defaults.get("max_lines_per_second", 0))),
+            bytes_per_second=float(spec.get("max_bytes_per_second", defaults.get("max_bytes_per_second", 0))),
+        )
+        self.watcher = DirWatcher(bool(defaults.get("inotify", True)))
+        self.stopping = threading.Event()
+        self._saved = {"files": dict(saved_files)}
+        self._lock = threading.Lock()
+        self._tailers: dict[str, FileTailer] = {}
+        self._collapsers: dict[str, RepeatCollapser] = {}
+        self._scanned_at = 0.0
+        self._discover()
+
+    def restarted(self) -> "InputWorker":
+        return InputWorker(self.spec, self.shipper, self.states(), self.hostname, self.ip, self.defaults)
+
+    def states(self) -> dict:
+        with self._lock:
+            return {path: tailer.state() for path, tailer in self._tailers.items()}
+
+    def cursors(self) -> dict:
+        return {}
+
+    def backlog_bytes(self) -> int:
+        with self._lock:
+            tailers = list(self._tailers.values())
+        return sum(t.backlog_bytes() for t in tailers)
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def _matches(self) -> list[str]:
+        if not glob.has_magic(self.pattern):
+            return [self.pattern]
+        return [
+            path
+            for path in sorted(glob.glob(self.pattern))
+            if os.path.isfile(path) and not any(fnmatch.fnmatch(os.path.basename(path), ex) for ex in self.exclude)
+        ]
+
+    def _discover(self) -> None:
+        self._scanned_at = time.monotonic()
+        for path in self._matches():
+            if path in self._tailers:
+                continue
+            tailer = restore_tailer(path, self._saved, self.read_chunk_bytes)
+            with self._lock:
+                self._tailers[path] = tailer
+            if self.collapse_seconds:
+                self._collapsers[path] = RepeatCollapser(self.collapse_seconds)
+            self.watcher.watch(path)
+
+    def _forget(self, path: str) -> None:
+        with self._lock:
+            tailer = self._tailers.pop(path)
+        tailer.close()
+        for line, count in self._collapsers.pop(path, RepeatCollapser(0)).drain():
+            self._ship(path, line, count)
+
+    def _ship(self, path: str, line: str, count: int = 1) -> None:
+        self.shipper.add(line_event(self.source, path, line, self.hostname, self.ip, self.parse_auth, count))
+
+    def cycle(self) -> bool:
+        """Reads one batch per file; True while a backlog remains"""
+        if time.monotonic() - self._scanned_at >= self.rescan_seconds:
+            self._discover()
+        backlog = False
+        for path, tailer in list(self._tailers.items()):
+            collapser = self._collapsers.get(path)
+            if collapser is not None:
+                for line, count in collapser.drain(expired_only=True):
+                    self._ship(path, line, count)
+            room = self.shipper.max_pending - self.shipper.pending()
+            if room <= 0 or self.budget.exhausted():
+                return True
+            max_lines, max_bytes = self.budget.available()
+            lines = tailer.read_lines(
+                max_lines=min(room, max_lines) if max_lines else room,
+                max_bytes=min(self.read_batch_bytes, max_bytes) if max_bytes else self.read_batch_bytes,
+            )
+            if lines:
+                self.budget.consume(len(lines), sum(len(ln) + 1 for ln in lines))
+                for ln in lines:
+                    for line, count in collapser.feed(ln) if collapser is not None else ((ln, 1),):
+                        self._ship(path, line, count)
+                # The offset is committed once everything read so far is shipped
+                # (a repeat count still being accumulated is lost on a crash)
+                self.shipper.after_pending(functools.partial(tailer.commit, tailer.position()))
+            elif path != self.pattern and not os.path.exists(path):
+                # Matched by the glob, then deleted: nothing more will come
+                self._forget(path)
+                continue
+            if tailer.backlog_bytes() > 0:
+                backlog = True
+        return backlog
+
+    def run(self) -> None:
+        try:
+            while not self.stopping.is_set():
+                started = time.monotonic()
+                try:
+                    backlog = self.cycle()
+                except Exception as e:
+                    print(f"Input {self.pattern} failed: {e}", file=sys.stderr)
+                    backlog = False
+                if backlog:
+                    # Catching up: go on as soon as the rate budget and the
+                    # shipper queue allow
+                    self.stopping.wait(self.budget.wait_seconds() if self.shipper.has_room(1) else 0.05)
+                    continue
+                # Woken early by inotify when a watched file changes
+                self.watcher.wait(self.poll_seconds)
+                # Let writes accumulate a little on busy hosts
+                elapsed = time.monotonic() - started
+                if elapsed < 0.2:
+                    self.stopping.wait(0.2 - elapsed)
+        finally:
+            for path, collapser in self._collapsers.items():
+                for line, count in collapser.drain():
+                    self._ship(path, line, count)
+            with self._lock:
+                tailers = list(self._tailers.values())
+            for tailer in tailers:
+                tailer.close()
+            self.watcher.close()
+
+
+class JournalExportParser:
+    """Incremental parser of `journalctl -o export` output.
+
+    Entries are KEY=value lines ended by a blank line; fields that are not
+    valid text come as the key alone on its line, a 64-bit little-endian
+    size, the data and a newline. feed() takes arbitrary chunks and returns
+    the entries completed so far.
+    """
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self._entry: dict[str, str] = {}
+
+    def feed(self, data: bytes) -> list[dict]:
+        buf = self._buf
+        buf += data
+        entries = []
+        pos = 0
+        while True:
+            nl = buf.find(b"\n", pos)
+            if nl < 0:
+                break
+            if nl == pos:
+                if self._entry:
+                    entries.append(self._entry)
+                    self._entry = {}
+                pos = nl + 1
+                continue
+            eq = buf.find(b"=", pos, nl)
+            if eq >= 0:
+                key = buf[pos:eq].decode("ascii", errors="replace")
+                self._entry[key] = buf[eq + 1:nl].decode("utf-8", errors="replace")
+                pos = nl + 1
+                continue
+            if len(buf) < nl + 9:
+                break
+            size = int.from_bytes(buf[nl + 1:nl + 9], "little")
+            end = nl + 9 + size
+            if len(buf) < end + 1:
+                break
+            key = buf[pos:nl].decode("ascii", errors="replace")
+            self._entry[key] = buf[nl + 9:end].decode("utf-8", errors="replace")
+            pos = end + 1
+        del buf[:pos]
+        return entries
+
+
+def journal_line(entry: dict) -> str:
+    """Formats a journal entry as a syslog line, as the file parsers expect it"""
+    stamp = ""
+    realtime = entry.get("__REALTIME_TIMESTAMP", "")
+    if realtime.isdigit():
+        stamp = time.strftime("%b %d %H:%M:%S", time.localtime(int(realtime) / 1_000_000))
+    ident = entry.get("SYSLOG_IDENTIFIER") or entry.get("_COMM") or "unknown"
+    pid = entry.get("_PID") or entry.get("SYSLOG_PID")
+    tag = f"{ident}[{pid}]" if pid else ident
+    return f"{stamp} {entry.get('_HOSTNAME', '')} {tag}: {entry.get('MESSAGE', '')}"
+
+
+JOURNAL_OUTPUT_FIELDS = ("MESSAGE", "SYSLOG_IDENTIFIER", "_COMM", "_PID", "SYSLOG_PID", "_HOSTNAME")
+
+
+class JournalWorker(threading.Thread):
+    """Follows the systemd journal through one long-lived
+    `journalctl -o export --follow` process.
+
+    Reading resumes after the last cursor shipped (persisted in the agent
+    state); without one it starts at the current end of the journal, or at
+    its beginning with "from_start". "matches" are journalctl match
+    arguments (e.g. "SYSLOG_FACILITY=10", "_SYSTEMD_UNIT=ssh.service"). If
+    journalctl exits it is restarted after restart_seconds. "replay_file"
+    reads a recorded export file instead, for tests.
+    """
+
+    def __init__(
+        self,
+        spec: dict,
+        shipper: Shipper,
+        saved_cursors: dict,
+        hostname: str,
+        ip: str,
+        defaults: dict,
+    ) -> None:
+        super().__init__(name=spec["path"], daemon=True)
+        self.spec = spec
+        self.pattern = spec["path"]
+        self.source = spec["source"]
+        self.parser = spec.get("parser", "raw")
+        self.shipper = shipper
+        self.hostname = hostname
+        self.ip = ip
+        self.defaults = defaults
+        self.parse_auth = self.parser == "auth" and defaults.get("parse_auth", True)
+        self.collapser = RepeatCollapser(
+            float(spec.get("collapse_repeats_seconds", defaults.get("collapse_repeats_seconds", 2.0) if self.parser == "syslog" else 0))
+        )
+        self.matches = list(spec.get("matches", []))
+        self.output_fields = list(spec.get("output_fields", JOURNAL_OUTPUT_FIELDS))
+        self.from_start = bool(spec.get("from_start", False))
+        self.replay_file = spec.get("replay_file", "")
+        self.journalctl = spec.get("journalctl", "journalctl")
+        self.restart_seconds = float(spec.get("restart_seconds", 5))
+        self.read_chunk_bytes = int(defaults.get("read_chunk_bytes", 64 * 1024))
+        self.budget = RateBudget(
+            lines_per_second=float(spec.get("max_lines_per_second", defaults.get("max_lines_per_second", 0))),
+            bytes_per_second=float(spec.get("max_bytes_per_second", defaults.get("max_bytes_per_second", 0))),
+        )
+        self.stopping = threading.Event()
+        self.cursor = saved_cursors.get(self.pattern, "")
+        self.committed = self.cursor
+        self.stats = {"entries": 0, "restarts": 0}
+        self._proc = None
+        self._fh = None
+        self._got_output = False
+        self._parser = JournalExportParser()
+
+    def restarted(self) -> "JournalWorker":
+        return JournalWorker(self.spec, self.shipper, self.cursors(), self.hostname, self.ip, self.defaults)
+
+    def states(self) -> dict:
+        return {}
+
+    def cursors(self) -> dict:
+        return {self.pattern: self.committed} if self.committed else {}
+
+    def backlog_bytes(self) -> int:
+        return 0
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def command(self) -> list[str]:
+        cmd = [self.journalctl, "-o", "export", "--follow", "--no-pager"]
+        if self.output_fields:
+            cmd.append("--output-fields=" + ",".join(self.output_fields))
+        if self.cursor:
+            cmd += ["--after-cursor", self.cursor]
+        elif self.from_start:
+            cmd += ["--lines", "all"]
+        else:
+            cmd += ["--lines", "0"]
+        return cmd + self.matches
+
+    def _open(self) -> bool:
+        self._parser = JournalExportParser()
+        self._got_output = False
+        if self.replay_file:
+            self._fh = open(self.replay_file, "rb")
+            return True
+        try:
+            self._proc = subprocess.Popen(
+                self.command(), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+        except OSError as e:
+            print(f"Cannot run {self.journalctl}: {e}", file=sys.stderr)
+            return False
+        self._fh = self._proc.stdout
+        return True
+
+    def _close(self) -> int | None:
+        code = None
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                self._proc.terminate()
+            try:
+                code = self._proc.wait(5)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+                code = self._proc.wait()
+            self._proc = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        return code
+
+    def _commit(self, cursor: str) -> None:
+        self.committed = cursor
+
+    def _ship(self, line: str, count: int = 1) -> None:
+        self.shipper.add(line_event(self.source, self.pattern, line, self.hostname, self.ip, self.parse_auth, count))
+
+    def read_entries(self, timeout: float) -> bool:
+        """Ships what journalctl wrote within timeout; False at end of stream"""
+        fd = self._fh.fileno()
+        if not self.replay_file:
+            readable, _, _ = select.select([fd], [], [], timeout)
+            if not readable:
+                return True
+        data = os.read(fd, self.read_chunk_bytes)
         if not data:
-            return new_offset, []
-        text = data.decode("utf-8", errors="replace")
-        lines = [ln for ln in text.splitlines() if ln.strip()]
-        return new_offset, lines
-    except FileNotFoundError:
-        return start_offset, []
-    except PermissionError:
-        return start_offset, []
-    except Exception:
-        return start_offset, []
+            return False
+        self._got_output = True
+        entries = self._parser.feed(data)
+        self.budget.consume(len(entries), len(data))
+        for entry in entries:
+            for line, count in self.collapser.feed(journal_line(entry)):
+                self._ship(line, count)
+            self.cursor = entry.get("__CURSOR", self.cursor)
+        self.stats["entries"] += len(entries)
+        if entries:
+            self.shipper.after_pending(functools.partial(self._commit, self.cursor))
+        return True
+
+    def run(self) -> None:
+        try:
+            while not self.stopping.is_set():
+                if self._fh is None and not self._open():
+                    self.stopping.wait(self.restart_seconds)
+                    continue
+                for line, count in self.collapser.drain(expired_only=True):
+                    self._ship(line, count)
+                if not self.shipper.has_room(1) or self.budget.exhausted():
+                    # Leave the rest in the pipe: journalctl blocks, nothing is lost
+                    self.stopping.wait(max(0.05, self.budget.wait_seconds()))
+                    continue
+                try:
+                    more = self.read_entries(1.0)
+                except OSError as e:
+                    print(f"Journal input {self.pattern} failed: {e}", file=sys.stderr)
+                    more = False
+                if more:
+                    continue
+                if self.replay_file:
+                    # Recorded export fully read: nothing more will come
+                    self._close()
+                    self.stopping.wait()
+                    break
+                code = self._close()
+                if code and not self._got_output and self.output_fields:
+                    # Old journalctl without --output-fields
+                    print(f"{self.journalctl} exited with {code}, retrying without --output-fields", file=sys.stderr)
+                    self.output_fields = []
+                    continue
+                print(f"{self.journalctl} exited with {code}, restarting in {self.restart_seconds:.0f}s", file=sys.stderr)
+                self.stats["restarts"] += 1
+                self.stopping.wait(self.restart_seconds)
+        finally:
+            for line, count in self.collapser.drain():
+                self._ship(line, count)
+            self._close()
 
 
 def run(config_path: str, state_path: str) -> int:
@@ -206,88 +1625,149 @@ def run(config_path: str, state_path: str) -> int:
 
     poll_seconds = int(config.get("agent", {}).get("poll_seconds", 2))
     heartbeat_seconds = int(config.get("agent", {}).get("heartbeat_seconds", 30))
-    max_lines_per_cycle = int(config.get("agent", {}).get("max_lines_per_cycle", 50))
-
-    syslog_path = config.get("inputs", {}).get("syslog", "/var/log/syslog")
-    authlog_path = config.get("inputs", {}).get("authlog", "/var/log/auth.log")
+    specs = input_specs(config)
 
-    ingest = ingest_url(base_url)
-
-    state = {"syslog_offset": 0, "authlog_offset": 0}
+    state = {"files": {}}
     try:
         if os.path.exists(state_path):
             state = load_json(state_path)
     except Exception:
-        state = {"syslog_offset": 0, "authlog_offset": 0}
+        state = {"files": {}}
+    checkpointer = StateCheckpointer(
+        state_path,
+        min_interval=float(config.get("agent", {}).get("state_min_interval_seconds", 5)),
+        fsync_interval=float(config.get("agent", {}).get("state_fsync_interval_seconds", 60)),
+    )
+
+    # Sequence numbers are reserved by blocks persisted ahead of use, so that
+    # a crash never reuses one the server has already seen
+    if not state.get("stream"):
+        state["stream"] = uuid.uuid4().hex
+    next_seq = int(state.get("seq_reserved", 0)) + 1
+    state["seq_reserved"] = next_seq - 1 + SEQ_BLOCK
+
+    spool_cfg = config.get("spool", {})
+    spool = None
+    if spool_cfg.get("enabled", True):
+        spool = Spool(
+            spool_cfg.get("directory") or os.path.join(os.path.dirname(state_path), "spool"),
+            max_bytes=int(spool_cfg.get("max_bytes", 128 * 1024 * 1024)),
+            segment_bytes=int(spool_cfg.get("segment_bytes", 8 * 1024 * 1024)),
+            acked_seq=int(state.get("spool_acked_seq", 0)),
+        )
+
+    shipper_cfg = config.get("shipper", {})
+    shipper = Shipper(
+        ndjson_url(base_url),
+        token,
+        max_events=int(shipper_cfg.get("max_batch_events", 500)),
+        max_bytes=int(shipper_cfg.get("max_batch_bytes", 512 * 1024)),
+        max_delay=float(shipper_cfg.get("max_delay_seconds", 1.0)),
+        compress=bool(shipper_cfg.get("gzip", True)),
+        timeout_seconds=float(shipper_cfg.get("timeout_seconds", 10)),
+        backoff_initial=float(shipper_cfg.get("backoff_initial_seconds", 1)),
+        backoff_max=float(shipper_cfg.get("backoff_max_seconds", 60)),
+        max_pending=int(shipper_cfg.get("max_pending_events", 50000)),
+        spool=spool,
+        stream=state["stream"],
+        next_seq=next_seq,
+    )
+    # systemd stops the service with SIGTERM: flush what is pending first
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    if isinstance(config.get("inputs", {}), dict):
+        migrate_legacy_offsets(state, {"syslog_offset": specs[0]["path"], "authlog_offset": specs[1]["path"]})
+    # The sequence reservation must be on disk before the first event goes out
+    checkpointer.save(state, durable=True)
 
     last_hb = 0.0
     prev_cpu = read_cpu_stat()
+
     hostname = get_hostname()
     ip = get_primary_ip()
 
-    while True:
-        now = time.time()
-
-        if now - last_hb >= heartbeat_seconds:
-            cur_cpu = read_cpu_stat()
-            cpu_pct = cpu_usage_percent(prev_cpu, cur_cpu)
-            prev_cpu = cur_cpu
-
-            mem = read_meminfo()
-            mem_total_kb = mem.get("MemTotal", 0)
-            mem_available_kb = mem.get("MemAvailable", 0)
-
-            hb = build_event(
-                source="linux_agent_heartbeat",
-                raw_data={
-                    "host": hostname,
-                    "ip": ip,
-                    "cpu_usage_percent": round(cpu_pct, 2),
-                    "mem_total_kb": mem_total_kb,
-                    "mem_available_kb": mem_available_kb,
-                    "timestamp": utc_now_iso(),
-                },
-            )
-            try:
-                post_json(ingest, token, hb)
-            except Exception:
-                pass
-            last_hb = now
-
-        syslog_offset = int(state.get("syslog_offset", 0) or 0)
-        syslog_offset, sys_lines = tail_file_lines(syslog_path, syslog_offset)
-        if sys_lines:
-            for ln in sys_lines[:max_lines_per_cycle]:
-                evt = build_event(
-                    source="linux_syslog",
-                    raw_data={"host": hostname, "ip": ip, "file": syslog_path, "message": ln},
-                )
-                try:
-                    post_json(ingest, token, evt)
-                except Exception:
-                    pass
-
-        auth_offset = int(state.get("authlog_offset", 0) or 0)
-        auth_offset, auth_lines = tail_file_lines(authlog_path, auth_offset)
-        if auth_lines:
-            for ln in auth_lines[:max_lines_per_cycle]:
-                evt = build_event(
-                    source="linux_auth",
-                    raw_data={"host": hostname, "ip": ip, "file": authlog_path, "message": ln},
+    workers = [
+        JournalWorker(spec, shipper, state.get("journal", {}), hostname, ip, config.get("agent", {}))
+        if spec.get("type") == "journal"
+        else InputWorker(spec, shipper, state.get("files", {}), hostname, ip, config.get("agent", {}))
+        for spec in specs
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        while True:
+            now = time.time()
+
+            # Heartbeat
+            if now - last_hb >= heartbeat_seconds:
+                cur_cpu = read_cpu_stat()
+                cpu_pct = cpu_usage_percent(prev_cpu, cur_cpu)
+                prev_cpu = cur_cpu
+
+                mem = read_meminfo()
+                mem_total_kb = mem.get("MemTotal", 0)
+                mem_available_kb = mem.get("MemAvailable", 0)
+
+                hb = build_event(
+                    source="linux_agent_heartbeat",
+                    raw_data={
+                        "host": hostname,
+                        "ip": ip,
+                        "cpu_usage_percent": round(cpu_pct, 2),
+                        "mem_total_kb": mem_total_kb,
+                        "mem_available_kb": mem_available_kb,
+                        "backlog_bytes": sum(worker.backlog_bytes() for worker in workers),
+                        "pending_events": shipper.pending(),
+                        "spool_events": shipper.spooled(),
+                        "spool_bytes": spool.bytes if spool is not None else 0,
+                        "spool_evicted_events": spool.evicted if spool is not None else 0,
+                        "timestamp": utc_now_iso(),
+                    },
                 )
-                try:
-                    post_json(ingest, token, evt)
-                except Exception:
-                    pass
 
-        state["syslog_offset"] = syslog_offset
-        state["authlog_offset"] = auth_offset
-        try:
-            save_json(state_path, state)
-        except Exception:
-            pass
+                shipper.add(hb)
+
+                last_hb = now
+
+            # Supervise the input threads: a dead one restarts from its offsets
+            for i, worker in enumerate(workers):
+                if not worker.is_alive():
+                    print(f"Input {worker.pattern} stopped, restarting", file=sys.stderr)
+                    workers[i] = worker.restarted()
+                    workers[i].start()
 
-        time.sleep(poll_seconds)
+            shipper.poll()
+
+            state["files"] = {path: pos for worker in workers for path, pos in worker.states().items()}
+            state["journal"] = {key: cursor for worker in workers for key, cursor in worker.cursors().items()}
+            if spool is not None:
+                state["spool_acked_seq"] = spool.acked_seq
+            durable = False
+            if shipper.next_seq + SEQ_BLOCK // 2 > state["seq_reserved"]:
+                state["seq_reserved"] = shipper.next_seq - 1 + SEQ_BLOCK
+                durable = True
+            try:
+                checkpointer.save(state, durable=durable)
+            except OSError as e:
+                print(f"Cannot write state {state_path}: {e}", file=sys.stderr)
+
+            # Woken early when the input threads fill a batch
+            shipper.wait(shipper.max_delay if shipper.pending() or shipper.spooled() else poll_seconds)
+    finally:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join(poll_seconds + 5)
+        shipper.close()
+        state["files"] = {path: pos for worker in workers for path, pos in worker.states().items()}
+        state["journal"] = {key: cursor for worker in workers for key, cursor in worker.cursors().items()}
+        if spool is not None:
+            state["spool_acked_seq"] = spool.acked_seq
+        try:
+            checkpointer.save(state, durable=True)
+        except OSError as e:
+            print(f"Cannot write state {state_path}: {e}", file=sys.stderr)
 
 
 def main() -> int:
@@ -304,6 +1784,12 @@ PYEOF
 
 chmod 0755 "$INSTALL_DIR/siem_agent.py"
 
+# Hosts without auth.log (sshd/sudo logging only to the journal) read the journal
+AUTH_INPUT='{"path": "/var/log/auth.log", "source": "linux_auth", "parser": "auth"}'
+if [[ ! -e /var/log/auth.log ]] && command -v journalctl >/dev/null 2>&1; then
+  AUTH_INPUT='{"type": "journal", "source": "linux_auth", "parser": "auth", "matches": ["SYSLOG_FACILITY=4", "SYSLOG_FACILITY=10"]}'
+fi
+
 cat > "$CONFIG_DIR/config.json" <<EOF
 {
   "server": {
@@ -313,11 +1799,34 @@ cat > "$CONFIG_DIR/config.json" <<EOF
   "agent": {
     "poll_seconds": 2,
     "heartbeat_seconds": 30,
-    "max_lines_per_cycle": 50
+    "inotify": true,
+    "read_chunk_bytes": 65536,
+    "read_batch_bytes": 1048576,
+    "max_lines_per_second": 0,
+    "max_bytes_per_second": 0,
+    "parse_auth": true,
+    "collapse_repeats_seconds": 2,
+    "state_min_interval_seconds": 5,
+    "state_fsync_interval_seconds": 60,
+    "rescan_seconds": 10
+  },
+  "inputs": [
+    {"path": "/var/log/syslog", "source": "linux_syslog", "parser": "syslog"},
+    ${AUTH_INPUT}
+  ],
+  "shipper": {
+    "max_batch_events": 500,
+    "max_batch_bytes": 524288,
+    "max_delay_seconds": 1.0,
+    "gzip": true,
+    "backoff_initial_seconds": 1,
+    "backoff_max_seconds": 60
   },
-  "inputs": {
-    "syslog": "/var/log/syslog",
-    "authlog": "/var/log/auth.log"
+  "spool": {
+    "enabled": true,
+    "directory": "/var/lib/siem-agent/spool",
+    "max_bytes": 134217728,
+    "segment_bytes": 8388608
   }
 }
 EOF
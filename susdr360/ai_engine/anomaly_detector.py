@@ -3,15 +3,20 @@ Anomaly Detector - Détecteur d'anomalies basé sur l'IA
 Utilise des algorithmes de machine learning pour détecter les comportements anormaux
 """
 
+import asyncio
 import numpy as np
 import pandas as pd
 import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Tuple, Callable
 from dataclasses import dataclass
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.cluster import DBSCAN
+from sklearn.neighbors import KDTree
 from sklearn.decomposition import PCA
 import joblib
 import json
@@ -32,6 +37,211 @@ class AnomalyResult:
     model_used: str
     timestamp: datetime
 
+# Features compilées: chaque entrée brute est lue une fois par événement,
+# chaque feature est une fonction de ses entrées
+_SYSTEM_PROCESSES = ('svchost.exe', 'explorer.exe', 'winlogon.exe')
+_HOME_COUNTRIES = ('CI', 'Côte d\'Ivoire')
+
+def _lower(value: Any) -> str:
+    return str(value).lower() if value is not None else ''
+
+_FEATURE_INPUTS: Dict[str, Callable[[Event], Any]] = {
+    'hour': lambda event: event.timestamp.hour,
+    'weekday': lambda event: event.timestamp.weekday(),
+    'severity': lambda event: event.severity.value,
+    'tag_count': lambda event: len(event.tags),
+    'description_length': lambda event: len(event.description),
+    'has_enrichment': lambda event: 1 if event.enrichment_data else 0,
+    'country': lambda event: event.enrichment_data.get('country'),
+    'src_port': lambda event: event.normalized_data.get('src_port', 0),
+    'dst_port': lambda event: event.normalized_data.get('dst_port', 0),
+    'protocol': lambda event: _lower(event.normalized_data.get('protocol')),
+    'bytes': lambda event: event.normalized_data.get('bytes', 0),
+    'auth_result': lambda event: _lower(event.normalized_data.get('auth_result')),
+    'auth_type': lambda event: _lower(event.normalized_data.get('auth_type')),
+    'username': lambda event: _lower(event.normalized_data.get('username')),
+    'process_name': lambda event: _lower(event.normalized_data.get('process_name')),
+    'file_path': lambda event: _lower(event.normalized_data.get('file_path')),
+    'action': lambda event: _lower(event.normalized_data.get('action')),
+    'log_level': lambda event: _lower(event.normalized_data.get('log_level')),
+    'source': lambda event: _lower(event.source),
+    'missing': lambda event: 0,
+}
+
+# Une ou deux entrées par feature
+_FEATURE_DEFINITIONS: Dict[str, Tuple[Tuple[str, ...], Callable[..., Any]]] = {
+    # Temporelles
+    'hour_of_day': (('hour',), lambda hour: hour),
+    'day_of_week': (('weekday',), lambda weekday: weekday),
+    'is_weekend': (('weekday',), lambda weekday: 1 if weekday >= 5 else 0),
+    'is_after_hours': (('hour',), lambda hour: 1 if hour < 8 or hour > 18 else 0),
+    
+    # Générales
+    'severity': (('severity',), lambda severity: severity),
+    'tag_count': (('tag_count',), lambda count: count),
+    'description_length': (('description_length',), lambda length: length),
+    'has_enrichment': (('has_enrichment',), lambda flag: flag),
+    
+    # Réseau
+    'src_port': (('src_port',), lambda port: port),
+    'dst_port': (('dst_port',), lambda port: port),
+    'is_high_port': (('src_port', 'dst_port'), lambda src, dst: 1 if src > 1024 or dst > 1024 else 0),
+    'is_well_known_port': (('dst_port',), lambda dst: 1 if dst < 1024 else 0),
+    'protocol_tcp': (('protocol',), lambda protocol: 1 if protocol == 'tcp' else 0),
+    'protocol_udp': (('protocol',), lambda protocol: 1 if protocol == 'udp' else 0),
+    'protocol_icmp': (('protocol',), lambda protocol: 1 if protocol == 'icmp' else 0),
+    'bytes': (('bytes',), lambda size: size),
+    'is_large_transfer': (('bytes',), lambda size: 1 if size > 1000000 else 0),  # > 1MB
+    'is_foreign_country': (('country',), lambda country: 0 if country is None or country in _HOME_COUNTRIES else 1),
+    
+    # Authentification
+    'auth_success': (('auth_result',), lambda result: 1 if result == 'success' else 0),
+    'auth_failed': (('auth_result',), lambda result: 1 if result == 'failed' else 0),
+    'auth_type_local': (('auth_type',), lambda auth_type: 1 if auth_type == 'local' else 0),
+    'auth_type_domain': (('auth_type',), lambda auth_type: 1 if auth_type == 'domain' else 0),
+    'auth_type_remote': (('auth_type',), lambda auth_type: 1 if auth_type == 'remote' else 0),
+    'is_admin_user': (('username',), lambda username: 1 if 'admin' in username or 'root' in username else 0),
+    'is_service_account': (('username',), lambda username: 1 if username.startswith('svc_') or username.endswith('$') else 0),
+    
+    # Endpoint
+    'is_system_process': (('process_name',), lambda name: 1 if name in _SYSTEM_PROCESSES else 0),
+    'is_powershell': (('process_name',), lambda name: 1 if 'powershell' in name else 0),
+    'is_cmd': (('process_name',), lambda name: 1 if name in ('cmd.exe', 'command.com') else 0),
+    'is_temp_file': (('file_path',), lambda path: 1 if 'temp' in path or 'tmp' in path else 0),
+    'is_system_file': (('file_path',), lambda path: 1 if path.startswith('c:\\windows\\system32') else 0),
+    'action_create': (('action',), lambda action: 1 if action == 'create' else 0),
+    'action_delete': (('action',), lambda action: 1 if action == 'delete' else 0),
+    'action_modify': (('action',), lambda action: 1 if action == 'modify' else 0),
+    
+    # Système
+    'log_error': (('log_level',), lambda level: 1 if level == 'error' else 0),
+    'log_warning': (('log_level',), lambda level: 1 if level == 'warning' else 0),
+    'log_info': (('log_level',), lambda level: 1 if level == 'info' else 0),
+    'source_windows': (('source',), lambda source: 1 if 'windows' in source else 0),
+    'source_linux': (('source',), lambda source: 1 if 'linux' in source or 'syslog' in source else 0),
+    'source_network': (('source',), lambda source: 1 if 'firewall' in source or 'router' in source else 0),
+}
+
+class FeatureSchema:
+    """Schéma de features compilé pour un modèle
+    
+    L'ordre des colonnes est figé à la compilation; les features sont écrites
+    directement dans une ligne ou une matrice préallouée, sans dictionnaire.
+    Une feature inconnue vaut 0.
+    """
+    
+    def __init__(self, feature_names: List[str]):
+        self.names = tuple(feature_names)
+        self.index = {name: column for column, name in enumerate(self.names)}
+        
+        input_names: List[str] = []
+        definitions = []
+        for name in self.names:
+            inputs, transform = _FEATURE_DEFINITIONS.get(name, (('missing',), lambda value: value))
+            for input_name in inputs:
+                if input_name not in input_names:
+                    input_names.append(input_name)
+            definitions.append((inputs, transform))
+        
+        # Colonnes compilées en (entrée, seconde entrée ou None, transformation)
+        position = {name: i for i, name in enumerate(input_names)}
+        self._readers = [_FEATURE_INPUTS[name] for name in input_names]
+        self._columns = [
+            (position[inputs[0]], position[inputs[1]] if len(inputs) > 1 else None, transform)
+            for inputs, transform in definitions
+        ]
+    
+    def __len__(self) -> int:
+        return len(self.names)
+    
+    def extract_into(self, event: Event, out: np.ndarray) -> np.ndarray:
+        """Écrit les features d'un événement dans la ligne out"""
+        values = [read(event) for read in self._readers]
+        out[:] = [
+            transform(values[first]) if second is None else transform(values[first], values[second])
+            for first, second, transform in self._columns
+        ]
+        return out
+    
+    def extract_batch(self, events: List[Event], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Écrit les features d'un lot d'événements, colonne par colonne"""
+        if out is None:
+            out = np.empty((len(events), len(self.names)))
+        inputs = [[read(event) for event in events] for read in self._readers]
+        for column, (first, second, transform) in enumerate(self._columns):
+            if second is None:
+                out[:, column] = list(map(transform, inputs[first]))
+            else:
+                out[:, column] = list(map(transform, inputs[first], inputs[second]))
+        return out
+
+def _build_core_index(model: DBSCAN) -> Optional[KDTree]:
+    """Index KD-tree des échantillons centraux d'un DBSCAN entraîné
+    
+    Les features étant surtout binaires, beaucoup d'échantillons sont
+    identiques: seuls les points distincts sont indexés.
+    """
+    if len(model.components_) == 0:
+        return None
+    return KDTree(np.unique(model.components_, axis=0), metric=model.metric)
+
+def _fit_model(model_name: str, X: np.ndarray, model_config: Dict[str, Any]) -> Tuple[Any, Any, Optional[KDTree], float]:
+    """Entraîne le scaler et le modèle (exécuté dans un processus du pool)
+    
+    Pour DBSCAN, l'index des échantillons centraux est construit ici aussi.
+    """
+    started = time.perf_counter()
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+    
+    if 'isolation_forest' in model_name:
+        model = IsolationForest(**model_config['isolation_forest'])
+    elif 'dbscan' in model_name:
+        model = DBSCAN(**model_config['dbscan'])
+    else:
+        raise ValueError(f"Type de modèle inconnu: {model_name}")
+    model.fit(X_scaled)
+    
+    index = None
+    if 'dbscan' in model_name:
+        index = _build_core_index(model)
+        if index is None:
+            raise ValueError("aucun échantillon central, eps ou min_samples trop stricts")
+    
+    return scaler, model, index, time.perf_counter() - started
+
+class TrainingBuffer:
+    """Tampon circulaire float32 des échantillons d'entraînement d'un modèle
+    
+    Les colonnes suivent l'ordre de _get_expected_features: un ajout écrit
+    une ligne en place, et l'entraînement lit une vue sans copie.
+    """
+    
+    def __init__(self, feature_names: List[str], capacity: int):
+        self.feature_names = list(feature_names)
+        self.capacity = max(1, int(capacity))
+        self.data = np.zeros((self.capacity, len(self.feature_names)), dtype=np.float32)
+        self.next_index = 0
+        self.count = 0
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def append(self, row):
+        """Écrit une ligne, en écrasant la plus ancienne une fois plein"""
+        self.data[self.next_index] = row
+        self.next_index = (self.next_index + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+    
+    def view(self) -> np.ndarray:
+        """Vue sur les échantillons présents (ordre d'arrivée perdu une fois plein)"""
+        return self.data[:self.count]
+    
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
 class AnomalyDetector:
     """Détecteur d'anomalies principal"""
     
@@ -39,6 +249,7 @@ class AnomalyDetector:
         self.config = config
         self.models = {}
         self.scalers = {}
+        self.core_indexes = {}
         self.encoders = {}
         self.feature_extractors = {}
         
@@ -55,39 +266,66 @@ class AnomalyDetector:
             }
         }
         
-        # Historique pour l'apprentissage
-        self.training_data = []
+        # Schémas de features compilés par modèle
+        self.feature_schemas: Dict[str, FeatureSchema] = {}
+        
+        # Historique pour l'apprentissage: un tampon circulaire par modèle
+        self.training_buffers: Dict[str, TrainingBuffer] = {}
         self.max_training_samples = config.get('max_training_samples', 10000)
         
+        # Entraînement en arrière-plan dans un pool de processus, à partir d'un
+        # instantané des données; réentraînement après retrain_interval secondes
+        # ou retrain_after_samples nouveaux échantillons
+        self.min_training_samples = max(2, int(config.get('min_training_samples', 10)))
+        self.retrain_interval = float(config.get('retrain_interval', 3600))
+        self.retrain_after_samples = max(1, int(config.get('retrain_after_samples', 5000)))
+        self.training_workers = max(1, int(config.get('training_workers', 1)))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._training_tasks: Dict[str, asyncio.Task] = {}
+        self._new_samples: Dict[str, int] = {}
+        self._last_training: Dict[str, float] = {}
+        self.model_info: Dict[str, Dict[str, Any]] = {}
+        
+        # Micro-lots de scoring: les vecteurs en attente sont regroupés par
+        # modèle et scorés en un seul appel dès batch_size vecteurs, ou après
+        # batch_delay_ms au plus
+        self.batch_size = max(1, int(config.get('batch_size', 256)))
+        self.batch_delay = max(0.0, float(config.get('batch_delay_ms', 2))) / 1000.0
+        self._pending: Dict[str, List[Tuple[np.ndarray, asyncio.Future]]] = {}
+        self._flush_handles: Dict[str, asyncio.TimerHandle] = {}
+        
         # Statistiques
         self.stats = {
             'events_analyzed': 0,
             'anomalies_detected': 0,
             'models_trained': 0,
             'false_positives': 0,
-            'true_positives': 0
+            'true_positives': 0,
+            'batches_scored': 0,
+            'vectors_scored': 0
         }
         
         logger.info("AnomalyDetector initialisé")
     
     async def analyze_event(self, event: Event) -> Optional[AnomalyResult]:
         """Analyse un événement pour détecter des anomalies"""
+        # Sélection du modèle approprié et extraction des features
+        model_name = self._select_model(event)
+        row = self._extract_row(event, model_name)
+        return await self._analyze_row(event, row, model_name)
+    
+    async def _analyze_row(self, event: Event, row: Optional[np.ndarray], model_name: str) -> Optional[AnomalyResult]:
+        """Détecte une anomalie à partir de la ligne de features d'un événement"""
         try:
             self.stats['events_analyzed'] += 1
-            
-            # Extraction des features
-            features = self._extract_features(event)
-            if not features:
+            if row is None:
                 return None
             
-            # Sélection du modèle approprié
-            model_name = self._select_model(event)
-            
             # Détection d'anomalie
-            anomaly_result = await self._detect_anomaly(event, features, model_name)
+            anomaly_result = await self._detect_anomaly(event, row, model_name)
             
             # Mise à jour des données d'entraînement
-            self._update_training_data(event, features, anomaly_result)
+            self._update_training_data(event, row, anomaly_result)
             
             if anomaly_result and anomaly_result.is_anomaly:
                 self.stats['anomalies_detected'] += 1
@@ -99,166 +337,64 @@ class AnomalyDetector:
             logger.error(f"Erreur lors de l'analyse d'anomalie: {e}")
             return None
     
-    def _extract_features(self, event: Event) -> Optional[Dict[str, Any]]:
-        """Extrait les features d'un événement pour l'analyse ML"""
-        try:
-            features = {}
-            
-            # Features temporelles
-            features.update(self._extract_temporal_features(event))
-            
-            # Features par type d'événement
-            if event.event_type == EventType.NETWORK:
-                features.update(self._extract_network_features(event))
-            elif event.event_type == EventType.AUTHENTICATION:
-                features.update(self._extract_auth_features(event))
-            elif event.event_type == EventType.ENDPOINT:
-                features.update(self._extract_endpoint_features(event))
-            elif event.event_type == EventType.SYSTEM:
-                features.update(self._extract_system_features(event))
-            
-            # Features générales
-            features.update(self._extract_general_features(event))
-            
-            return features
-            
-        except Exception as e:
-            logger.error(f"Erreur lors de l'extraction de features: {e}")
-            return None
-    
-    def _extract_temporal_features(self, event: Event) -> Dict[str, Any]:
-        """Extrait les features temporelles"""
-        features = {}
-        
-        # Heure de la journée (0-23)
-        features['hour_of_day'] = event.timestamp.hour
-        
-        # Jour de la semaine (0-6)
-        features['day_of_week'] = event.timestamp.weekday()
-        
-        # Est-ce un weekend ?
-        features['is_weekend'] = 1 if event.timestamp.weekday() >= 5 else 0
-        
-        # Est-ce en dehors des heures de bureau ?
-        features['is_after_hours'] = 1 if event.timestamp.hour < 8 or event.timestamp.hour > 18 else 0
-        
-        return features
-    
-    def _extract_network_features(self, event: Event) -> Dict[str, Any]:
-        """Extrait les features réseau"""
-        features = {}
-        normalized = event.normalized_data
-        
-        # Ports
-        src_port = normalized.get('src_port', 0)
-        dst_port = normalized.get('dst_port', 0)
-        
-        features['src_port'] = src_port
-        features['dst_port'] = dst_port
-        features['is_high_port'] = 1 if src_port > 1024 or dst_port > 1024 else 0
-        features['is_well_known_port'] = 1 if dst_port < 1024 else 0
-        
-        # Protocole
-        protocol = normalized.get('protocol', 'unknown').lower()
-        features['protocol_tcp'] = 1 if protocol == 'tcp' else 0
-        features['protocol_udp'] = 1 if protocol == 'udp' else 0
-        features['protocol_icmp'] = 1 if protocol == 'icmp' else 0
-        
-        # Taille des données
-        bytes_transferred = normalized.get('bytes', 0)
-        features['bytes'] = bytes_transferred
-        features['is_large_transfer'] = 1 if bytes_transferred > 1000000 else 0  # > 1MB
-        
-        # Géolocalisation (si disponible)
-        if 'country' in event.enrichment_data:
-            country = event.enrichment_data['country']
-            features['is_foreign_country'] = 1 if country not in ['CI', 'Côte d\'Ivoire'] else 0
-        
-        return features
+    async def stop(self):
+        """Annule les entraînements en cours et arrête le pool de processus"""
+        tasks = list(self._training_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._training_tasks.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
     
-    def _extract_auth_features(self, event: Event) -> Dict[str, Any]:
-        """Extrait les features d'authentification"""
-        features = {}
-        normalized = event.normalized_data
-        
-        # Résultat de l'authentification
-        auth_result = normalized.get('auth_result', 'unknown').lower()
-        features['auth_success'] = 1 if auth_result == 'success' else 0
-        features['auth_failed'] = 1 if auth_result == 'failed' else 0
-        
-        # Type d'authentification
-        auth_type = normalized.get('auth_type', 'unknown').lower()
-        features['auth_type_local'] = 1 if auth_type == 'local' else 0
-        features['auth_type_domain'] = 1 if auth_type == 'domain' else 0
-        features['auth_type_remote'] = 1 if auth_type == 'remote' else 0
-        
-        # Utilisateur
-        username = normalized.get('username', '').lower()
-        features['is_admin_user'] = 1 if 'admin' in username or 'root' in username else 0
-        features['is_service_account'] = 1 if username.startswith('svc_') or username.endswith('$') else 0
-        
-        return features
+    async def wait_for_training(self):
+        """Attend la fin des entraînements en cours"""
+        await asyncio.gather(*list(self._training_tasks.values()), return_exceptions=True)
     
-    def _extract_endpoint_features(self, event: Event) -> Dict[str, Any]:
-        """Extrait les features d'endpoint"""
-        features = {}
-        normalized = event.normalized_data
-        
-        # Processus
-        process_name = normalized.get('process_name', '').lower()
-        features['is_system_process'] = 1 if process_name in ['svchost.exe', 'explorer.exe', 'winlogon.exe'] else 0
-        features['is_powershell'] = 1 if 'powershell' in process_name else 0
-        features['is_cmd'] = 1 if process_name in ['cmd.exe', 'command.com'] else 0
-        
-        # Fichiers
-        file_path = normalized.get('file_path', '').lower()
-        features['is_temp_file'] = 1 if 'temp' in file_path or 'tmp' in file_path else 0
-        features['is_system_file'] = 1 if file_path.startswith('c:\\windows\\system32') else 0
-        
-        # Actions
-        action = normalized.get('action', '').lower()
-        features['action_create'] = 1 if action == 'create' else 0
-        features['action_delete'] = 1 if action == 'delete' else 0
-        features['action_modify'] = 1 if action == 'modify' else 0
-        
-        return features
+    async def analyze_events(self, events: List[Event]) -> List[Optional[AnomalyResult]]:
+        """Analyse un lot d'événements
+        
+        Les features sont extraites par colonnes pour chaque modèle, puis les
+        lignes sont scorées ensemble par micro-lots.
+        """
+        model_names = [self._select_model(event) for event in events]
+        groups: Dict[str, List[int]] = {}
+        for i, model_name in enumerate(model_names):
+            groups.setdefault(model_name, []).append(i)
+        
+        rows: List[Optional[np.ndarray]] = [None] * len(events)
+        for model_name, indexes in groups.items():
+            try:
+                X = self._get_feature_schema(model_name).extract_batch([events[i] for i in indexes])
+                for position, i in enumerate(indexes):
+                    rows[i] = X[position]
+            except Exception:
+                # Un événement mal formé fait échouer le lot: extraction unitaire
+                for i in indexes:
+                    rows[i] = self._extract_row(events[i], model_name)
+        
+        return list(await asyncio.gather(*(
+            self._analyze_row(event, row, model_name)
+            for event, row, model_name in zip(events, rows, model_names)
+        )))
     
-    def _extract_system_features(self, event: Event) -> Dict[str, Any]:
-        """Extrait les features système"""
-        features = {}
-        normalized = event.normalized_data
-        
-        # Niveau de log
-        log_level = normalized.get('log_level', '').lower()
-        features['log_error'] = 1 if log_level == 'error' else 0
-        features['log_warning'] = 1 if log_level == 'warning' else 0
-        features['log_info'] = 1 if log_level == 'info' else 0
-        
-        # Source système
-        source = event.source.lower()
-        features['source_windows'] = 1 if 'windows' in source else 0
-        features['source_linux'] = 1 if 'linux' in source or 'syslog' in source else 0
-        features['source_network'] = 1 if 'firewall' in source or 'router' in source else 0
-        
-        return features
+    def _get_feature_schema(self, model_name: str) -> FeatureSchema:
+        """Retourne le schéma de features du modèle, compilé au premier usage"""
+        schema = self.feature_schemas.get(model_name)
+        if schema is None:
+            schema = FeatureSchema(self._get_expected_features(model_name))
+            self.feature_schemas[model_name] = schema
+        return schema
     
-    def _extract_general_features(self, event: Event) -> Dict[str, Any]:
-        """Extrait les features générales"""
-        features = {}
-        
-        # Sévérité
-        features['severity'] = event.severity.value
-        
-        # Nombre de tags
-        features['tag_count'] = len(event.tags)
-        
-        # Taille de la description
-        features['description_length'] = len(event.description)
-        
-        # Présence d'enrichissement
-        features['has_enrichment'] = 1 if event.enrichment_data else 0
-        
-        return features
+    def _extract_row(self, event: Event, model_name: str) -> Optional[np.ndarray]:
+        """Extrait les features d'un événement dans une ligne préallouée"""
+        try:
+            schema = self._get_feature_schema(model_name)
+            return schema.extract_into(event, np.empty(len(schema)))
+        except Exception as e:
+            logger.error(f"Erreur lors de l'extraction de features: {e}")
+            return None
     
     def _select_model(self, event: Event) -> str:
         """Sélectionne le modèle approprié selon le type d'événement"""
@@ -271,45 +407,36 @@ class AnomalyDetector:
         else:
             return 'general_isolation_forest'
     
-    async def _detect_anomaly(self, event: Event, features: Dict[str, Any], model_name: str) -> Optional[AnomalyResult]:
+    async def _detect_anomaly(self, event: Event, row: np.ndarray, model_name: str) -> Optional[AnomalyResult]:
         """Détecte les anomalies avec le modèle spécifié"""
         try:
-            # Vérifie si le modèle existe
-            if model_name not in self.models:
-                await self._train_model(model_name, event.event_type)
+            # Premier entraînement ou réentraînement, sans bloquer l'analyse
+            self._maybe_schedule_training(model_name)
             
             model = self.models.get(model_name)
             if not model:
                 return None
             
-            # Prépare les données
-            feature_vector = self._prepare_feature_vector(features, model_name)
-            if feature_vector is None:
-                return None
-            
-            # Prédiction
+            # Prédiction (la normalisation est faite au scoring du lot)
             if 'isolation_forest' in model_name:
-                anomaly_score = model.decision_function([feature_vector])[0]
-                is_anomaly = model.predict([feature_vector])[0] == -1
+                anomaly_score, is_anomaly = await self._score(model_name, row)
                 confidence = abs(anomaly_score)
             elif 'dbscan' in model_name:
-                # Pour DBSCAN, on utilise la distance au cluster le plus proche
-                cluster_label = model.fit_predict([feature_vector])[0]
-                is_anomaly = cluster_label == -1  # -1 = outlier dans DBSCAN
-                anomaly_score = -1.0 if is_anomaly else 1.0
-                confidence = 0.8 if is_anomaly else 0.2
+                # Score = eps - distance à l'échantillon central le plus proche
+                anomaly_score, is_anomaly = await self._score(model_name, row)
+                confidence = min(1.0, abs(anomaly_score) / model.eps)
             else:
                 return None
             
             # Génère l'explication
-            explanation = self._generate_explanation(event, features, is_anomaly, model_name)
+            explanation = self._generate_explanation(event, row, is_anomaly, model_name)
             
             return AnomalyResult(
                 event_id=event.id,
                 anomaly_score=anomaly_score,
                 is_anomaly=is_anomaly,
                 confidence=confidence,
-                features_used=list(features.keys()),
+                features_used=list(self._get_feature_schema(model_name).names),
                 explanation=explanation,
                 model_used=model_name,
                 timestamp=datetime.now()
@@ -319,39 +446,69 @@ class AnomalyDetector:
             logger.error(f"Erreur lors de la détection d'anomalie avec {model_name}: {e}")
             return None
     
-    def _prepare_feature_vector(self, features: Dict[str, Any], model_name: str) -> Optional[np.ndarray]:
-        """Prépare le vecteur de features pour le modèle"""
+    def _score(self, model_name: str, feature_vector: np.ndarray) -> asyncio.Future:
+        """Place une ligne de features brute dans le micro-lot du modèle
+        
+        Le futur renvoyé est résolu avec (score, est_anomalie) au scoring du lot.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(model_name, [])
+        pending.append((feature_vector, future))
+        
+        if len(pending) >= self.batch_size:
+            self._flush_batch(model_name)
+        elif model_name not in self._flush_handles:
+            self._flush_handles[model_name] = loop.call_later(
+                self.batch_delay, self._flush_batch, model_name
+            )
+        return future
+    
+    def _flush_batch(self, model_name: str):
+        """Score en un appel les vecteurs en attente et résout les futurs"""
+        handle = self._flush_handles.pop(model_name, None)
+        if handle is not None:
+            handle.cancel()
+        batch = self._pending.pop(model_name, None)
+        if not batch:
+            return
+        
         try:
-            # Récupère les features attendues par le modèle
-            expected_features = self._get_expected_features(model_name)
-            
-            # Crée le vecteur avec les valeurs par défaut pour les features manquantes
-            feature_vector = []
-            for feature_name in expected_features:
-                value = features.get(feature_name, 0)
-                
-                # Encode les valeurs catégorielles si nécessaire
-                if isinstance(value, str):
-                    encoder_key = f"{model_name}_{feature_name}"
-                    if encoder_key in self.encoders:
-                        try:
-                            value = self.encoders[encoder_key].transform([value])[0]
-                        except:
-                            value = 0  # Valeur inconnue
-                    else:
-                        value = hash(value) % 1000  # Hash simple pour les nouvelles valeurs
-                
-                feature_vector.append(float(value))
-            
-            # Normalisation si un scaler existe
-            if model_name in self.scalers:
-                feature_vector = self.scalers[model_name].transform([feature_vector])[0]
-            
-            return np.array(feature_vector)
-            
+            scores, flags = self._score_batch(model_name, np.vstack([vector for vector, _ in batch]))
         except Exception as e:
-            logger.error(f"Erreur lors de la préparation du vecteur de features: {e}")
-            return None
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        self.stats['batches_scored'] += 1
+        self.stats['vectors_scored'] += len(batch)
+        for (_, future), score, flag in zip(batch, scores, flags):
+            if not future.done():
+                future.set_result((float(score), bool(flag)))
+    
+    def _score_batch(self, model_name: str, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Score un lot de vecteurs avec un seul parcours du modèle
+        
+        Le scaler et le modèle sont lus ensemble au moment du scoring.
+        Isolation forest: score_samples - offset_ vaut decision_function, et
+        predict renvoie -1 exactement quand ce score est négatif.
+        DBSCAN: un point est hors cluster quand l'échantillon central le plus
+        proche est à plus de eps, soit un score eps - distance négatif.
+        """
+        model = self.models[model_name]
+        X = self._scale(model_name, X)
+        if 'dbscan' in model_name:
+            distances, _ = self.core_indexes[model_name].query(X, k=1)
+            scores = model.eps - distances[:, 0]
+        else:
+            scores = model.score_samples(X) - model.offset_
+        return scores, scores < 0
+    
+    def _scale(self, model_name: str, X: np.ndarray) -> np.ndarray:
+        """Normalise une matrice de features si un scaler existe"""
+        scaler = self.scalers.get(model_name)
+        return scaler.transform(X) if scaler is not None else X
     
     def _get_expected_features(self, model_name: str) -> List[str]:
         """Retourne la liste des features attendues par le modèle"""
@@ -380,85 +537,115 @@ class AnomalyDetector:
         else:
             return base_features
     
-    async def _train_model(self, model_name: str, event_type: EventType):
-        """Entraîne un modèle de détection d'anomalies"""
+    def _maybe_schedule_training(self, model_name: str):
+        """Lance l'entraînement en arrière-plan si le modèle manque ou est périmé"""
+        if model_name in self._training_tasks:
+            return
+        
+        new_samples = self._new_samples.get(model_name, 0)
+        if model_name not in self.models:
+            if new_samples < self.min_training_samples:
+                return
+        else:
+            last_training = self._last_training.setdefault(model_name, time.monotonic())
+            if (new_samples < self.retrain_after_samples and
+                    time.monotonic() - last_training < self.retrain_interval):
+                return
+        
+        self._training_tasks[model_name] = asyncio.create_task(
+            self._train_model(model_name)
+        )
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Crée le pool de processus d'entraînement au premier usage"""
+        if self._executor is None:
+            # Processus lancés hors fork: le serveur a des threads (écriture
+            # SQLite, boucle asyncio) qu'un fork dupliquerait dans un état incohérent
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.training_workers,
+                mp_context=multiprocessing.get_context(method),
+            )
+        return self._executor
+    
+    async def _train_model(self, model_name: str):
+        """Entraîne un modèle dans le pool de processus puis l'installe"""
         try:
             logger.info(f"Entraînement du modèle {model_name}")
             
-            # Récupère les données d'entraînement
-            training_features = self._get_training_data(event_type)
-            if len(training_features) < 10:  # Minimum de données requis
+            # Instantané des données d'entraînement: le tampon continue
+            # d'être alimenté pendant que le pool sérialise la matrice
+            training_data = self._get_training_data(model_name)
+            if len(training_data) < self.min_training_samples:
                 logger.warning(f"Pas assez de données pour entraîner {model_name}")
                 return
             
-            # Prépare les données
-            feature_names = self._get_expected_features(model_name)
-            X = []
-            
-            for features in training_features:
-                feature_vector = []
-                for feature_name in feature_names:
-                    value = features.get(feature_name, 0)
-                    if isinstance(value, str):
-                        value = hash(value) % 1000
-                    feature_vector.append(float(value))
-                X.append(feature_vector)
-            
-            X = np.array(X)
-            
-            # Normalisation
-            scaler = StandardScaler()
-            X_scaled = scaler.fit_transform(X)
-            self.scalers[model_name] = scaler
-            
-            # Entraînement du modèle
-            if 'isolation_forest' in model_name:
-                model = IsolationForest(**self.model_config['isolation_forest'])
-                model.fit(X_scaled)
-            elif 'dbscan' in model_name:
-                model = DBSCAN(**self.model_config['dbscan'])
-                model.fit(X_scaled)
-            else:
-                logger.error(f"Type de modèle inconnu: {model_name}")
-                return
-            
-            self.models[model_name] = model
-            self.stats['models_trained'] += 1
+            X = training_data.copy()
+            self._new_samples[model_name] = 0
             
-            logger.info(f"Modèle {model_name} entraîné avec {len(X)} échantillons")
+            loop = asyncio.get_running_loop()
+            scaler, model, index, duration = await loop.run_in_executor(
+                self._get_executor(), _fit_model, model_name, X, self.model_config
+            )
+            self._install_model(model_name, scaler, model, index, len(X), duration)
             
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Erreur lors de l'entraînement du modèle {model_name}: {e}")
+        finally:
+            self._training_tasks.pop(model_name, None)
     
-    def _get_training_data(self, event_type: EventType) -> List[Dict[str, Any]]:
-        """Récupère les données d'entraînement pour un type d'événement"""
-        return [
-            data['features'] for data in self.training_data
-            if data['event_type'] == event_type
-        ]
+    def _install_model(self, model_name: str, scaler: Any, model: Any, index: Optional[KDTree],
+                       samples: int, duration: float):
+        """Remplace le modèle, son scaler et son index ensemble, sans point de suspension"""
+        if index is not None:
+            self.core_indexes[model_name] = index
+        self.scalers[model_name] = scaler
+        self.models[model_name] = model
+        self._last_training[model_name] = time.monotonic()
+        
+        version = self.model_info.get(model_name, {}).get('version', 0) + 1
+        self.model_info[model_name] = {
+            'version': version,
+            'samples': samples,
+            'training_seconds': round(duration, 3),
+            'trained_at': datetime.now().isoformat()
+        }
+        self.stats['models_trained'] += 1
+        
+        logger.info(f"Modèle {model_name} v{version} entraîné avec {samples} échantillons en {duration:.2f}s")
     
-    def _update_training_data(self, event: Event, features: Dict[str, Any], anomaly_result: Optional[AnomalyResult]):
+    def _get_training_buffer(self, model_name: str) -> TrainingBuffer:
+        """Retourne le tampon d'entraînement du modèle, créé au premier usage"""
+        buffer = self.training_buffers.get(model_name)
+        if buffer is None:
+            buffer = TrainingBuffer(self._get_expected_features(model_name), self.max_training_samples)
+            self.training_buffers[model_name] = buffer
+        return buffer
+    
+    def _get_training_data(self, model_name: str) -> np.ndarray:
+        """Récupère les données d'entraînement d'un modèle (vue sans copie)"""
+        buffer = self.training_buffers.get(model_name)
+        if buffer is None:
+            return np.empty((0, len(self._get_expected_features(model_name))), dtype=np.float32)
+        return buffer.view()
+    
+    def _update_training_data(self, event: Event, row: np.ndarray, anomaly_result: Optional[AnomalyResult]):
         """Met à jour les données d'entraînement"""
         # Ajoute seulement les événements normaux pour l'entraînement
         if not anomaly_result or not anomaly_result.is_anomaly:
-            training_sample = {
-                'event_type': event.event_type,
-                'features': features,
-                'timestamp': event.timestamp,
-                'is_anomaly': anomaly_result.is_anomaly if anomaly_result else False
-            }
-            
-            self.training_data.append(training_sample)
+            model_name = self._select_model(event)
+            self._get_training_buffer(model_name).append(row)
             
-            # Limite la taille des données d'entraînement
-            if len(self.training_data) > self.max_training_samples:
-                self.training_data = self.training_data[-self.max_training_samples:]
+            self._new_samples[model_name] = self._new_samples.get(model_name, 0) + 1
     
-    def _generate_explanation(self, event: Event, features: Dict[str, Any], is_anomaly: bool, model_name: str) -> str:
+    def _generate_explanation(self, event: Event, row: np.ndarray, is_anomaly: bool, model_name: str) -> str:
         """Génère une explication pour le résultat de détection"""
         if not is_anomaly:
             return "Comportement normal détecté"
         
+        features = dict(zip(self._get_feature_schema(model_name).names, row.tolist()))
         explanations = []
         
         # Analyse des features temporelles
@@ -500,9 +687,16 @@ class AnomalyDetector:
         """Retourne les statistiques du détecteur d'anomalies"""
         stats = self.stats.copy()
         stats['models_loaded'] = len(self.models)
-        stats['training_samples'] = len(self.training_data)
-        
-        if self.stats['anomalies_detected'] > 0:
+        stats['training_samples'] = sum(len(buffer) for buffer in self.training_buffers.values())
+        stats['training_buffer_bytes'] = sum(buffer.nbytes for buffer in self.training_buffers.values())
+        stats['avg_batch_size'] = (
+            self.stats['vectors_scored'] / self.stats['batches_scored']
+            if self.stats['batches_scored'] else 0.0
+        )
+        stats['models'] = {name: dict(info) for name, info in self.model_info.items()}
+        stats['trainings_in_progress'] = sorted(self._training_tasks)
+        
+        if self.stats['true_positives'] + self.stats['false_positives'] > 0:
             stats['accuracy'] = (self.stats['true_positives'] / 
                                (self.stats['true_positives'] + self.stats['false_positives']))
         else:
@@ -517,6 +711,7 @@ class AnomalyDetector:
                 'models': self.models,
                 'scalers': self.scalers,
                 'encoders': self.encoders,
+                'model_info': self.model_info,
                 'config': self.model_config,
                 'stats': self.stats
             }
@@ -532,6 +727,21 @@ class AnomalyDetector:
             self.models = model_data.get('models', {})
             self.scalers = model_data.get('scalers', {})
             self.encoders = model_data.get('encoders', {})
+            self.model_info = model_data.get('model_info', {})
+            
+            # Les index KD-tree ne sont pas sauvegardés: reconstruits depuis
+            # les échantillons centraux de chaque DBSCAN
+            self.core_indexes = {}
+            for name, model in list(self.models.items()):
+                if 'dbscan' not in name:
+                    continue
+                index = _build_core_index(model)
+                if index is None:
+                    logger.warning(f"Modèle {name} sans échantillon central ignoré")
+                    del self.models[name]
+                else:
+                    self.core_indexes[name] = index
+            self._last_training = {name: time.monotonic() for name in self.models}
             self.model_config = model_data.get('config', self.model_config)
             self.stats = model_data.get('stats', self.stats)
             logger.info(f"Modèles chargés depuis {filepath}")
@@ -1,53 +1,96 @@
-import sqlite3
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+from .storage import SQLiteStore, batch_writer, data_dir, run_read
 
 
 def _db_path() -> Path:
-    base = Path(__file__).resolve().parents[1]
-    data_dir = base / "data"
-    data_dir.mkdir(parents=True, exist_ok=True)
-    return data_dir / "agents.db"
+    return data_dir() / "agents.db"
+
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS agents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        agent_id TEXT UNIQUE,
+        hostname TEXT,
+        ip_address TEXT,
+        os TEXT,
+        version TEXT,
+        last_seen TEXT,
+        status TEXT,
+        events_count INTEGER DEFAULT 0,
+        created_at TEXT,
+        updated_at TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_agents_last_seen ON agents(last_seen)",
+    """
+    CREATE TABLE IF NOT EXISTS agent_sequences (
+        agent_id TEXT PRIMARY KEY,
+        stream TEXT,
+        last_seq INTEGER,
+        updated_at TEXT
+    )
+    """,
+)
 
+_store = SQLiteStore(_db_path(), _SCHEMA)
+_batch = batch_writer(_store)
 
-def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(str(_db_path()))
-    conn.row_factory = sqlite3.Row
-    return conn
+_RECORD_SQL = """
+    INSERT INTO agents (agent_id, hostname, ip_address, os, version, last_seen, status, events_count, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(agent_id) DO UPDATE SET
+        hostname=excluded.hostname,
+        ip_address=excluded.ip_address,
+        os=excluded.os,
+        version=excluded.version,
+        last_seen=excluded.last_seen,
+        status=excluded.status,
+        events_count=COALESCE(agents.events_count, 0) + excluded.events_count,
+        updated_at=excluded.updated_at
+"""
+
+_SEQUENCE_SQL = """
+    INSERT INTO agent_sequences (agent_id, stream, last_seq, updated_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(agent_id) DO UPDATE SET
+        stream=excluded.stream,
+        last_seq=excluded.last_seq,
+        updated_at=excluded.updated_at
+"""
+
+# agent_id -> (stream, last_seq); only touched from the SQLite write thread
+_high_water: Dict[str, Tuple[str, int]] = {}
 
 
 def init_db() -> None:
-    conn = _connect()
-    try:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS agents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                agent_id TEXT UNIQUE,
-                hostname TEXT,
-                ip_address TEXT,
-                os TEXT,
-                version TEXT,
-                last_seen TEXT,
-                status TEXT,
-                events_count INTEGER DEFAULT 0,
-                created_at TEXT,
-                updated_at TEXT
-            )
-            """
-        )
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_agents_last_seen ON agents(last_seen)")
-        conn.commit()
-    finally:
-        conn.close()
+    _store.migrate()
 
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def upsert_agent(
+def _sum_increment(index: int):
+    def merge(previous, current):
+        merged = list(current)
+        merged[index] = previous[index] + current[index]
+        return tuple(merged)
+    return merge
+
+
+def list_agents() -> List[Dict[str, Any]]:
+    conn = _store.connection()
+    rows = conn.execute(
+        "SELECT agent_id, hostname, ip_address, os, version, status, last_seen, events_count FROM agents ORDER BY last_seen DESC"
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def record_agent_event(
     *,
     agent_id: str,
     hostname: str,
@@ -56,53 +99,35 @@ def upsert_agent(
     version: str,
     status: str,
     seen_at_iso: Optional[str] = None,
+    increment: int = 1,
 ) -> None:
-    init_db()
+    # One pending row per agent until the next flush: latest attributes win,
+    # event increments are summed.
     now = _now_iso()
     seen = seen_at_iso or now
+    _batch.coalesce(
+        _RECORD_SQL,
+        agent_id,
+        (agent_id, hostname, ip_address, os_name, version, seen, status, int(increment), now, now),
+        merge=_sum_increment(7),
+    )
 
-    conn = _connect()
-    try:
-        conn.execute(
-            """
-            INSERT INTO agents (agent_id, hostname, ip_address, os, version, last_seen, status, events_count, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
-            ON CONFLICT(agent_id) DO UPDATE SET
-                hostname=excluded.hostname,
-                ip_address=excluded.ip_address,
-                os=excluded.os,
-                version=excluded.version,
-                last_seen=excluded.last_seen,
-                status=excluded.status,
-                updated_at=excluded.updated_at
-            """,
-            (agent_id, hostname, ip_address, os_name, version, seen, status, now, now),
-        )
-        conn.commit()
-    finally:
-        conn.close()
-
-
-def increment_events(agent_id: str, increment: int = 1) -> None:
-    init_db()
-    conn = _connect()
-    try:
-        conn.execute(
-            "UPDATE agents SET events_count = COALESCE(events_count, 0) + ?, updated_at = ? WHERE agent_id = ?",
-            (increment, _now_iso(), agent_id),
-        )
-        conn.commit()
-    finally:
-        conn.close()
 
+def accept_sequence(*, agent_id: str, stream: str, seq: int) -> bool:
+    # At-least-once agents resend after a lost response: anything at or below
+    # the high-water mark of the same stream was already ingested. A new
+    # stream (agent reinstalled, state wiped) starts over.
+    current = _high_water.get(agent_id)
+    if current is None:
+        row = _store.fetchone("SELECT stream, last_seq FROM agent_sequences WHERE agent_id = ?", (agent_id,))
+        current = (row["stream"] or "", int(row["last_seq"] or 0)) if row else ("", 0)
+        _high_water[agent_id] = current
+    if current[0] == stream and seq <= current[1]:
+        return False
+    _high_water[agent_id] = (stream, seq)
+    _batch.coalesce(_SEQUENCE_SQL, agent_id, (agent_id, stream, seq, _now_iso()))
+    return True
 
-def list_agents() -> List[Dict[str, Any]]:
-    init_db()
-    conn = _connect()
-    try:
-        rows = conn.execute(
-            "SELECT agent_id, hostname, ip_address, os, version, status, last_seen, events_count FROM agents ORDER BY last_seen DESC"
-        ).fetchall()
-        return [dict(r) for r in rows]
-    finally:
-        conn.close()
+
+async def list_agents_async() -> List[Dict[str, Any]]:
+    return await run_read(list_agents)
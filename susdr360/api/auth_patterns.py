@@ -0,0 +1,213 @@
+import re
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Pattern, Sequence, Tuple
+
+_IP = r"(?P<src_ip>\d+\.\d+\.\d+\.\d+)"
+
+_SSHD = ("sshd", "sshd-session")
+
+
+class AuthPattern(NamedTuple):
+    """One row of the auth.log pattern table.
+
+    `programs` are the syslog tags the row applies to (`sshd` for `sshd[42]:`),
+    an empty tuple meaning any program. The `literal` must appear verbatim in
+    every line the regex can match and is checked before the regex runs. Named
+    groups `user`, `src_ip`, `method` and `cmd` fill the parsed fields;
+    `auth_method` is used when the regex has no `method` group.
+    """
+
+    event_kind: str
+    programs: Tuple[str, ...]
+    literal: str
+    regex: Pattern[str]
+    auth_method: str = ""
+
+
+# Order matters: the first matching row wins, as with the former regex chain
+AUTH_PATTERNS: List[AuthPattern] = [
+    AuthPattern(
+        "ssh_auth_failed",
+        _SSHD,
+        "Failed password for ",
+        re.compile(r"Failed password for (invalid user )?(?P<user>\S+) from " + _IP),
+        "password",
+    ),
+    AuthPattern(
+        "ssh_auth_failed",
+        _SSHD,
+        "Failed publickey for ",
+        re.compile(r"Failed publickey for (invalid user )?(?P<user>\S+) from " + _IP),
+        "publickey",
+    ),
+    AuthPattern(
+        "ssh_auth_success",
+        _SSHD,
+        "Accepted ",
+        re.compile(r"Accepted (?P<method>password|publickey) for (?P<user>\S+) from " + _IP),
+    ),
+    AuthPattern(
+        "ssh_invalid_user",
+        _SSHD,
+        "Invalid user ",
+        re.compile(r"Invalid user (?P<user>\S+) from " + _IP),
+    ),
+    AuthPattern(
+        "ssh_max_auth_attempts",
+        _SSHD,
+        "maximum authentication attempts exceeded",
+        re.compile(r"maximum authentication attempts exceeded for (invalid user )?(?P<user>\S+) from " + _IP),
+    ),
+    AuthPattern(
+        "sudo_command",
+        ("sudo",),
+        "COMMAND=",
+        re.compile(r"sudo(?:\[\d+\])?: +(?P<user>\S+) : .*COMMAND=(?P<cmd>.+)$"),
+    ),
+    AuthPattern(
+        "su_failed",
+        ("su",),
+        "FAILED SU",
+        re.compile(r"FAILED SU \(to \S+\) (?P<user>\S+)"),
+    ),
+    AuthPattern(
+        "su_success",
+        ("su",),
+        "Successful su for ",
+        re.compile(r"Successful su for \S+ by (?P<user>\S+)"),
+    ),
+    AuthPattern(
+        "pam_auth_failure",
+        (),
+        "authentication failure;",
+        re.compile(r"pam_unix\([^)]*:auth\): authentication failure;.*?rhost=(?:" + _IP + r")?(?:.*\buser=(?P<user>\S+))?"),
+        "pam",
+    ),
+    AuthPattern(
+        "logind_new_session",
+        ("systemd-logind",),
+        "New session ",
+        re.compile(r"New session \S+ of user (?P<user>[^\s.]+)"),
+    ),
+]
+
+
+def _any_in(needles: Sequence[str]) -> str:
+    return " or ".join(f"{needle!r} in msg" for needle in dict.fromkeys(needles))
+
+
+def _fields_source(pattern: AuthPattern) -> str:
+    """Dict display of the parsed fields, reading the match groups by number"""
+    groups = pattern.regex.groupindex
+
+    def group(name: str, default: str) -> str:
+        return f"(m[{groups[name]}] or {default!r})" if name in groups else repr(default)
+
+    command = f"{group('cmd', '')}.strip()" if "cmd" in groups else "''"
+    return (
+        f"{{'event_kind': {pattern.event_kind!r}, 'src_ip': {group('src_ip', '')}, "
+        f"'username': {group('user', '')}, 'auth_method': {group('method', pattern.auth_method)}, "
+        f"'command': {command}}}"
+    )
+
+
+def _applies_source(pattern: AuthPattern, programs: Sequence[str], *, tagged: bool) -> str:
+    """Condition for a row bound to programs to apply to the line `msg`.
+
+    The line's program is its first syslog tag of a known program; when the
+    line names no other known program, finding one of the row's tags settles
+    it without the regex scan.
+    """
+    own = [f" {name}{sep}" for name in pattern.programs for sep in "[:"]
+    # " su" finds " sudo" too; it needs its separators when the row is sudo's
+    others = [
+        needle
+        for name in programs if name not in pattern.programs
+        for needle in ([f" {name}{sep}" for sep in "[:"] if any(f" {name}" in tag for tag in own) else [f" {name}"])
+    ]
+    others = [o for o in others if not any(n != o and n in o for n in others)]
+    fast = f"({_any_in(own)})" + (f" and not ({_any_in(others)})" if others else "")
+    allowed = pattern.programs if tagged else pattern.programs + (None,)
+    return f"{fast} or program(msg) in {allowed!r}"
+
+
+def _try_source(
+    index: int, pattern: AuthPattern, programs: Sequence[str], indent: str, *, tagged: bool, known: str = ""
+) -> List[str]:
+    """Source trying one row, `known` being a literal already found in the line"""
+    source = [f"{indent}m = search_{index}(msg)"]
+    if pattern.programs:
+        # A row bound to programs applies to their lines and to bare messages
+        source.append(f"{indent}if m is not None and ({_applies_source(pattern, programs, tagged=tagged)}):")
+    else:
+        source.append(f"{indent}if m is not None:")
+    source.append(f"{indent}    return {_fields_source(pattern)}")
+    if pattern.literal == known:
+        return source
+    return [f"{indent}if {pattern.literal!r} in msg:"] + ["    " + line for line in source]
+
+
+def _compile_parser() -> Callable[[str], Optional[Dict[str, Any]]]:
+    """Generate the parser of the current table as a single function.
+
+    Most auth.log lines match no row, so the generated code rejects them with
+    a few plain substring tests: a line tagged "name[pid]: " is only tested
+    against the literals of the rows of the programs it names and of the rows
+    of any program, a bare message against every literal. The literal found
+    leads straight to the rows that can still match, tried in table order.
+    """
+    rows = list(enumerate(AUTH_PATTERNS))
+    programs = sorted({name for p in AUTH_PATTERNS for name in p.programs}, key=len, reverse=True)
+    # One scan for the syslog tag ("sshd[42]:", "sudo:") of the known programs;
+    # a leading space keeps the scan fast, so bare messages are matched apart
+    tag = re.compile(r"(" + "|".join(re.escape(name) for name in programs) + r")[\[:]")
+    find_program, match_program = re.compile(" " + tag.pattern).search, tag.match
+
+    def program(msg: str) -> Optional[str]:
+        found = find_program(msg) or match_program(msg)
+        return found[1] if found else None
+
+    namespace: Dict[str, Any] = {"program": program}
+    namespace.update((f"search_{i}", p.regex.search) for i, p in rows)
+
+    source = ["def parse(msg):", "    if ']: ' in msg:"]
+    groups = list(dict.fromkeys(p.programs for p in AUTH_PATTERNS if p.programs))
+    for position, names in enumerate(groups):
+        # "sshd" also finds "sshd-session"; a line may name several programs,
+        # so the rows of the later groups stay candidates once the gate passed
+        gates = [n for n in names if not any(o != n and o in n for o in names)]
+        source.append(f"        if {_any_in(gates)}:")
+        candidates = [(i, p) for i, p in rows if not p.programs or p.programs in groups[position:]]
+        literals = list(dict.fromkeys(p.literal for p in AUTH_PATTERNS if p.programs == names))
+        for tested, literal in enumerate(literals):
+            source.append(f"            if {literal!r} in msg:")
+            for i, p in candidates:
+                # Rows whose literal was already found absent cannot match
+                if p.literal not in literals[:tested]:
+                    source += _try_source(i, p, programs, " " * 16, tagged=True, known=literal)
+            source.append("                return None")
+    for i, p in rows:
+        if not p.programs:
+            source += _try_source(i, p, programs, " " * 8, tagged=True)
+    source.append("        return None")
+    for i, p in rows:
+        source += _try_source(i, p, programs, " " * 4, tagged=False)
+    source.append("    return None")
+    exec("\n".join(source), namespace)
+    return namespace["parse"]
+
+
+_parse = _compile_parser()
+
+
+def register_auth_pattern(pattern: AuthPattern, *, before: Optional[str] = None) -> None:
+    global _parse
+    if before is None:
+        AUTH_PATTERNS.append(pattern)
+    else:
+        index = next((i for i, p in enumerate(AUTH_PATTERNS) if p.event_kind == before), len(AUTH_PATTERNS))
+        AUTH_PATTERNS.insert(index, pattern)
+    _parse = _compile_parser()
+
+
+def parse_auth_line(message: str) -> Optional[Dict[str, Any]]:
+    return _parse(message or "")
@@ -1,23 +1,19 @@
-import re
+import atexit
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List, Optional, Tuple
 
+from .auth_patterns import parse_auth_line
 from .detections_registry import (
     create_alert,
-    get_state,
     insert_auth_event,
     recent_evidence,
-    upsert_state,
 )
+from .detections_state import DetectionStateCache, StateSlot, _parse_dt
+from .multi_pattern import PatternListMatcher
+from .storage import data_dir
 
 
-_RE_SSH_FAILED = re.compile(r"Failed password for (invalid user )?(?P<user>\S+) from (?P<src_ip>\d+\.\d+\.\d+\.\d+)")
-_RE_SSH_SUCCESS = re.compile(r"Accepted (?P<method>password|publickey) for (?P<user>\S+) from (?P<src_ip>\d+\.\d+\.\d+\.\d+)")
-_RE_SSH_INVALID_USER = re.compile(r"Invalid user (?P<user>\S+) from (?P<src_ip>\d+\.\d+\.\d+\.\d+)")
-_RE_SUDO_CMD = re.compile(r"sudo: (?P<user>\S+) : .*COMMAND=(?P<cmd>.+)$")
-
-
-_RISKY_CMDS = [
+_RISKY_CMDS_DEFAULT = [
     "/bin/bash",
     " su ",
     "useradd",
@@ -29,64 +25,67 @@ _RISKY_CMDS = [
     "wget",
 ]
 
+# Built-in fragments extended by local lists, one string per line
+_risky_cmds = PatternListMatcher(
+    "risky_commands",
+    defaults=_RISKY_CMDS_DEFAULT,
+    path=data_dir() / "risky_commands.txt",
+)
+_iocs = PatternListMatcher(
+    "ioc_strings",
+    path=data_dir() / "ioc_strings.txt",
+    case_sensitive=False,
+)
 
-def _now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
 
+def configure_pattern_lists(
+    *,
+    risky_commands_file: Optional[str] = None,
+    ioc_strings_file: Optional[str] = None,
+    reload_seconds: Optional[float] = None,
+) -> None:
+    _risky_cmds.configure(path=risky_commands_file, reload_seconds=reload_seconds)
+    _iocs.configure(path=ioc_strings_file, reload_seconds=reload_seconds)
+
+
+def get_pattern_list_stats() -> Dict[str, Any]:
+    return {"risky_commands": _risky_cmds.stats(), "ioc_strings": _iocs.stats()}
+
+
+_SSH_BRUTEFORCE_WINDOW = 300
+_SSH_SUCCESS_AFTER_FAIL_WINDOW = 600
+
+# Rule counters live in memory; the `state` table is a periodic checkpoint.
+# ssh_success_after_fail reads the ssh_bruteforce_ip counters over its own,
+# longer window: they are kept that long.
+_state = DetectionStateCache(retention_seconds={"ssh_bruteforce_ip": _SSH_SUCCESS_AFTER_FAIL_WINDOW})
 
-def _parse_dt(value: Optional[str]) -> datetime:
-    if not value:
-        return datetime.now(timezone.utc)
-    try:
-        return datetime.fromisoformat(value.replace("Z", "+00:00"))
-    except Exception:
-        return datetime.now(timezone.utc)
+
+def load_state() -> None:
+    _state.load()
+
+
+def checkpoint_state() -> None:
+    _state.checkpoint()
+
+
+def start_state_checkpoints() -> None:
+    _state.start_checkpoints()
+
+
+def stop_state_checkpoints() -> None:
+    _state.stop_checkpoints()
+
+
+atexit.register(checkpoint_state)
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
 
 
 def parse_linux_auth_message(message: str) -> Optional[Dict[str, Any]]:
-    msg = message or ""
-
-    m = _RE_SSH_FAILED.search(msg)
-    if m:
-        return {
-            "event_kind": "ssh_auth_failed",
-            "src_ip": m.group("src_ip"),
-            "username": m.group("user"),
-            "auth_method": "password",
-            "command": "",
-        }
-
-    m = _RE_SSH_SUCCESS.search(msg)
-    if m:
-        return {
-            "event_kind": "ssh_auth_success",
-            "src_ip": m.group("src_ip"),
-            "username": m.group("user"),
-            "auth_method": m.group("method"),
-            "command": "",
-        }
-
-    m = _RE_SSH_INVALID_USER.search(msg)
-    if m:
-        return {
-            "event_kind": "ssh_invalid_user",
-            "src_ip": m.group("src_ip"),
-            "username": m.group("user"),
-            "auth_method": "",
-            "command": "",
-        }
-
-    m = _RE_SUDO_CMD.search(msg)
-    if m:
-        return {
-            "event_kind": "sudo_command",
-            "src_ip": "",
-            "username": m.group("user"),
-            "auth_method": "",
-            "command": m.group("cmd").strip(),
-        }
-
-    return None
+    return parse_auth_line(message)
 
 
 def _state_key(rule_id: str, hostname: str, src_ip: str) -> str:
@@ -101,64 +100,34 @@ def _update_counter(
     now_iso: str,
     username: Optional[str],
 ) -> Tuple[int, str, str, List[str], Optional[str]]:
-    st = get_state(key)
+    slot = _state.get(key)
     now_dt = _parse_dt(now_iso)
 
-    if not st:
+    if not slot or (now_dt - slot.first_seen_dt).total_seconds() > float(window_seconds):
+        last_alert_at = slot.last_alert_at if slot else None
         users = [username] if username else []
-        upsert_state(
-            key=key,
-            rule_id=rule_id,
-            count=1,
-            window_seconds=window_seconds,
-            first_seen=now_iso,
-            last_seen=now_iso,
-            users=users,
-            last_alert_at=None,
-        )
-        return 1, now_iso, now_iso, users, None
-
-    first_seen = st.get("first_seen") or now_iso
-    first_dt = _parse_dt(first_seen)
-    last_alert_at = st.get("last_alert_at")
-
-    if (now_dt - first_dt).total_seconds() > float(window_seconds):
-        users = [username] if username else []
-        upsert_state(
-            key=key,
-            rule_id=rule_id,
-            count=1,
-            window_seconds=window_seconds,
-            first_seen=now_iso,
-            last_seen=now_iso,
-            users=users,
-            last_alert_at=last_alert_at,
+        _state.put(
+            key,
+            StateSlot(
+                rule_id=rule_id,
+                count=1,
+                window_seconds=window_seconds,
+                first_seen=now_iso,
+                last_seen=now_iso,
+                users=users,
+                last_alert_at=last_alert_at,
+                first_seen_dt=now_dt,
+            ),
         )
         return 1, now_iso, now_iso, users, last_alert_at
 
-    users: List[str] = []
-    try:
-        import json
-
-        users = json.loads(st.get("users_json") or "[]")
-    except Exception:
-        users = []
-
-    if username and username not in users:
-        users.append(username)
-
-    count = int(st.get("count") or 0) + 1
-    upsert_state(
-        key=key,
-        rule_id=rule_id,
-        count=count,
-        window_seconds=window_seconds,
-        first_seen=first_seen,
-        last_seen=now_iso,
-        users=users,
-        last_alert_at=last_alert_at,
-    )
-    return count, first_seen, now_iso, users, last_alert_at
+    if username and username not in slot.users:
+        slot.users.append(username)
+    slot.count += 1
+    slot.last_seen = now_iso
+    slot.window_seconds = window_seconds
+    _state.touch(key)
+    return slot.count, slot.first_seen, now_iso, slot.users, slot.last_alert_at
 
 
 def process_linux_auth_event(
@@ -167,9 +136,12 @@ def process_linux_auth_event(
     hostname: str,
     message: str,
     observed_at_iso: Optional[str],
+    parsed: Optional[Dict[str, Any]] = None,
 ) -> None:
-    parsed = parse_linux_auth_message(message)
-    if not parsed:
+    # Agents that parse at the edge send the fields along: no second parse
+    if parsed is None:
+        parsed = parse_linux_auth_message(message)
+    if not parsed or not parsed.get("event_kind"):
         return
 
     event_kind = parsed.get("event_kind") or ""
@@ -193,7 +165,7 @@ def process_linux_auth_event(
 
     if event_kind == "ssh_auth_failed" and src_ip:
         rule_id = "ssh_bruteforce_ip"
-        window_seconds = 300
+        window_seconds = _SSH_BRUTEFORCE_WINDOW
         threshold = 10
         key = _state_key(rule_id, hostname, src_ip)
         count, first_seen, last_seen, users, _ = _update_counter(
@@ -224,24 +196,26 @@ def process_linux_auth_event(
                 last_seen=last_seen,
                 evidence=evidence,
             )
-            upsert_state(
-                key=key,
-                rule_id=rule_id,
-                count=0,
-                window_seconds=window_seconds,
-                first_seen=last_seen,
-                last_seen=last_seen,
-                users=users,
-                last_alert_at=_now_iso(),
+            _state.put(
+                key,
+                StateSlot(
+                    rule_id=rule_id,
+                    count=0,
+                    window_seconds=window_seconds,
+                    first_seen=last_seen,
+                    last_seen=last_seen,
+                    users=users,
+                    last_alert_at=_now_iso(),
+                ),
             )
 
     if event_kind == "ssh_auth_success" and src_ip:
         rule_id = "ssh_success_after_fail"
-        window_seconds = 600
+        window_seconds = _SSH_SUCCESS_AFTER_FAIL_WINDOW
         key = _state_key("ssh_bruteforce_ip", hostname, src_ip)
-        st = get_state(key)
-        if st and int(st.get("count") or 0) >= 5:
-            first_seen = st.get("first_seen") or (datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat()
+        st = _state.get(key)
+        if st and st.count >= 5:
+            first_seen = st.first_seen or (datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat()
             evidence = recent_evidence(
                 hostname=hostname,
                 src_ip=src_ip,
@@ -257,7 +231,7 @@ def process_linux_auth_event(
                 hostname=hostname,
                 src_ip=src_ip,
                 username=username,
-                count=int(st.get("count") or 0),
+                count=st.count,
                 window_seconds=window_seconds,
                 first_seen=first_seen,
                 last_seen=observed,
@@ -265,10 +239,10 @@ def process_linux_auth_event(
             )
 
     if event_kind == "sudo_command" and command:
-        risky = any(tok in command for tok in _RISKY_CMDS)
+        risky = _risky_cmds.find_all(command)
         if risky:
             rule_id = "sudo_risky_command"
-            evidence = [{"message": message, "command": command, "observed_at": observed, "user": username}]
+            evidence = [{"message": message, "command": command, "observed_at": observed, "user": username, "matched": risky}]
             create_alert(
                 rule_id=rule_id,
                 severity="high",
@@ -282,3 +256,23 @@ def process_linux_auth_event(
                 last_seen=observed,
                 evidence=evidence,
             )
+
+    iocs = _iocs.find_all(message)
+    if iocs:
+        rule_id = "ioc_substring_match"
+        evidence = [{"message": message, "event_kind": event_kind, "observed_at": observed, "iocs": iocs[:20]}]
+        create_alert(
+            rule_id=rule_id,
+            severity="high",
+            agent_id=agent_id,
+            hostname=hostname,
+            src_ip=src_ip,
+            username=username,
+            count=len(iocs),
+            window_seconds=0,
+            first_seen=observed,
+            last_seen=observed,
+            evidence=evidence,
+        )
+
+    _state.maybe_checkpoint()
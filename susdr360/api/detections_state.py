@@ -0,0 +1,189 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+
+from .detections_registry import load_all_state, upsert_states
+from .storage import PeriodicWrite
+
+logger = logging.getLogger(__name__)
+
+
+def _as_utc(dt: datetime) -> datetime:
+    # Agents may send observed_at without offset: it is taken as UTC, so
+    # that all slot timestamps compare with the aware now()
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def _parse_dt(value: Optional[str]) -> datetime:
+    if not value:
+        return datetime.now(timezone.utc)
+    try:
+        return _as_utc(datetime.fromisoformat(value.replace("Z", "+00:00")))
+    except Exception:
+        return datetime.now(timezone.utc)
+
+
+class StateSlot:
+    __slots__ = (
+        "rule_id",
+        "count",
+        "window_seconds",
+        "first_seen",
+        "first_seen_dt",
+        "last_seen",
+        "users",
+        "last_alert_at",
+    )
+
+    def __init__(
+        self,
+        rule_id: str,
+        count: int,
+        window_seconds: int,
+        first_seen: str,
+        last_seen: str,
+        users: List[str],
+        last_alert_at: Optional[str],
+        first_seen_dt: Optional[datetime] = None,
+    ) -> None:
+        self.rule_id = rule_id
+        self.count = count
+        self.window_seconds = window_seconds
+        self.first_seen = first_seen
+        self.first_seen_dt = _as_utc(first_seen_dt) if first_seen_dt else _parse_dt(first_seen)
+        self.last_seen = last_seen
+        self.users = users
+        self.last_alert_at = last_alert_at
+
+
+class DetectionStateCache:
+    """Authoritative in-process copy of the detections `state` table.
+
+    Reads and counter updates only touch memory. Modified keys are written
+    back with one executemany() on checkpoint(), which start_checkpoints()
+    runs every checkpoint_seconds on the storage writer thread. Slots whose
+    window has expired are dropped at checkpoint time, from memory and from
+    the table; load() restores the table content at startup. A rule whose
+    slots are also read by another rule is given that rule's window in
+    retention_seconds, so they outlive their own window long enough.
+    """
+
+    def __init__(self, checkpoint_seconds: float = 5.0, retention_seconds: Optional[Dict[str, int]] = None) -> None:
+        self.checkpoint_seconds = checkpoint_seconds
+        self.retention_seconds = dict(retention_seconds or {})
+        self._slots: Dict[str, StateSlot] = {}
+        self._dirty: Set[str] = set()
+        self._evicted: Set[str] = set()
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._last_checkpoint = time.monotonic()
+        self._timer: Optional[PeriodicWrite] = None
+
+    def load(self) -> None:
+        with self._lock:
+            slots: Dict[str, StateSlot] = {}
+            for row in load_all_state():
+                try:
+                    users = json.loads(row.get("users_json") or "[]")
+                except Exception:
+                    users = []
+                slots[row["key"]] = StateSlot(
+                    rule_id=row.get("rule_id") or "",
+                    count=int(row.get("count") or 0),
+                    window_seconds=int(row.get("window_seconds") or 0),
+                    first_seen=row.get("first_seen") or "",
+                    last_seen=row.get("last_seen") or "",
+                    users=users,
+                    last_alert_at=row.get("last_alert_at"),
+                )
+            self._slots = slots
+            self._dirty.clear()
+            self._evicted.clear()
+            self._loaded = True
+        logger.info(f"Detection state loaded: {len(slots)} keys")
+
+    def get(self, key: str) -> Optional[StateSlot]:
+        if not self._loaded:
+            self.load()
+        return self._slots.get(key)
+
+    def put(self, key: str, slot: StateSlot) -> StateSlot:
+        if not self._loaded:
+            self.load()
+        with self._lock:
+            self._slots[key] = slot
+            self._dirty.add(key)
+        return slot
+
+    def touch(self, key: str) -> None:
+        with self._lock:
+            self._dirty.add(key)
+
+    def maybe_checkpoint(self) -> None:
+        if self._dirty and time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds:
+            self.checkpoint()
+
+    def start_checkpoints(self) -> None:
+        if self._timer is None:
+            self._timer = PeriodicWrite(self.checkpoint_seconds, self.checkpoint, name="detection-state-checkpoint")
+
+    def stop_checkpoints(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _evict_expired(self) -> None:
+        now = datetime.now(timezone.utc)
+        expired = []
+        for key, slot in self._slots.items():
+            # One unreadable slot must not abort the checkpoint of the others
+            try:
+                window = max(slot.window_seconds, self.retention_seconds.get(slot.rule_id, 0))
+                if (now - slot.first_seen_dt).total_seconds() > window:
+                    expired.append(key)
+            except Exception as e:
+                logger.warning(f"Detection state slot {key} not checked for expiry: {e}")
+        for key in expired:
+            del self._slots[key]
+            self._dirty.discard(key)
+        self._evicted.update(expired)
+
+    def checkpoint(self) -> None:
+        with self._lock:
+            self._last_checkpoint = time.monotonic()
+            self._evict_expired()
+            if not self._dirty and not self._evicted:
+                return
+            keys, self._dirty = self._dirty, set()
+            evicted, self._evicted = self._evicted, set()
+            rows = []
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    continue
+                rows.append(
+                    (
+                        key,
+                        slot.rule_id,
+                        slot.count,
+                        slot.window_seconds,
+                        slot.first_seen,
+                        slot.last_seen,
+                        json.dumps(slot.users),
+                        slot.last_alert_at,
+                    )
+                )
+        try:
+            upsert_states(rows, delete_keys=list(evicted))
+        except Exception as e:
+            logger.error(f"Detection state checkpoint failed: {e}")
+            with self._lock:
+                self._dirty.update(keys)
+                # A key recreated since its eviction is in _slots again
+                self._evicted.update(key for key in evicted if key not in self._slots)
+
+    def stats(self) -> Dict[str, int]:
+        return {"keys": len(self._slots), "dirty": len(self._dirty)}
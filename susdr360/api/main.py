@@ -19,6 +19,7 @@ from ..core.event_processor import EventProcessor, Event
 from ..core.correlation_engine import CorrelationEngine
 from .routes import events, incidents, analytics, config as config_routes, agents as agents_routes, detections as detections_routes
 from .middleware.auth import AuthManager
+from . import agent_registry, detections_registry, detections_engine, storage
 from .models import *
 
 try:
@@ -136,6 +137,8 @@ class SUSDR360API:
             return {
                 "event_processor": self.event_processor.get_stats(),
                 "correlation_engine": self.correlation_engine.get_stats(),
+                "correlation_rules": self.correlation_engine.get_rule_stats(),
+                "detection_lists": detections_engine.get_pattern_list_stats(),
                 "anomaly_detector": self.anomaly_detector.get_stats() if self.anomaly_detector is not None else {},
                 "timestamp": datetime.now().isoformat()
             }
@@ -210,6 +213,40 @@ class SUSDR360API:
         # Enregistrement des gestionnaires
         self.event_processor.add_output_handler(handle_processed_event)
         self.correlation_engine.add_incident_handler(handle_incident)
+        
+        # Cycle de vie de la file d'ingestion et du nettoyage des contextes
+        @self.app.on_event("startup")
+        async def start_pipeline():
+            # Migration unique des schémas SQLite avant la première requête
+            agent_registry.init_db()
+            detections_registry.init_db()
+            detections_engine.load_state()
+            detections_engine.start_state_checkpoints()
+            batch_config = self.config.get('storage', {}).get('batch', {})
+            storage.configure_batching(
+                max_rows=batch_config.get('max_rows'),
+                max_delay_ms=batch_config.get('max_delay_ms')
+            )
+            # Listes locales (commandes à risque, IOCs) du moteur de détection
+            detections_config = self.config.get('detections', {})
+            detections_engine.configure_pattern_lists(
+                risky_commands_file=detections_config.get('risky_commands_file'),
+                ioc_strings_file=detections_config.get('ioc_strings_file'),
+                reload_seconds=detections_config.get('reload_seconds')
+            )
+            await self.event_processor.start()
+            await self.correlation_engine.start()
+        
+        @self.app.on_event("shutdown")
+        async def stop_pipeline():
+            await self.event_processor.stop()
+            await self.correlation_engine.stop()
+            if self.anomaly_detector is not None:
+                await self.anomaly_detector.stop()
+            # Checkpoint sur le thread d'écriture, après les écritures en attente
+            detections_engine.stop_state_checkpoints()
+            await storage.run_write(detections_engine.checkpoint_state)
+            storage.shutdown()
     
     # Dépendances pour l'injection
     async def _get_event_processor(self):
@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AhoCorasick:
+    """Automaton matching a fixed set of strings in one pass over the text.
+
+    Build cost is linear in the total pattern length; a search walks the text
+    once, whatever the number of patterns.
+    """
+
+    __slots__ = ("patterns", "case_sensitive", "_goto", "_fail", "_out")
+
+    def __init__(self, patterns: Iterable[str], *, case_sensitive: bool = True) -> None:
+        self.case_sensitive = case_sensitive
+        unique: Dict[str, None] = {}
+        for pattern in patterns:
+            if pattern:
+                unique[pattern if case_sensitive else pattern.lower()] = None
+        self.patterns: Tuple[str, ...] = tuple(unique)
+
+        goto: List[Dict[str, int]] = [{}]
+        out: List[Tuple[int, ...]] = [()]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append(())
+                state = nxt
+            out[state] = out[state] + (index,)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                # Matches ending here include those of the longest proper suffix
+                out[nxt] = out[nxt] + out[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def _walk(self, text: str, first_only: bool) -> List[str]:
+        goto, fail, out = self._goto, self._fail, self._out
+        if not self.case_sensitive:
+            text = text.lower()
+        found: Dict[int, None] = {}
+        state = 0
+        for ch in text:
+            nxt = goto[state].get(ch)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto[state].get(ch)
+            state = nxt or 0
+            if out[state]:
+                for index in out[state]:
+                    found[index] = None
+                if first_only:
+                    break
+        return [self.patterns[i] for i in found]
+
+    def search(self, text: str) -> Optional[str]:
+        if not self.patterns or not text:
+            return None
+        hits = self._walk(text, True)
+        return hits[0] if hits else None
+
+    def find_all(self, text: str) -> List[str]:
+        if not self.patterns or not text:
+            return []
+        return self._walk(text, False)
+
+
+def read_pattern_file(path: Path) -> List[str]:
+    patterns = []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                patterns.append(line)
+    return patterns
+
+
+class PatternListMatcher:
+    """AhoCorasick over built-in patterns plus an optional local list file.
+
+    The file (one string per line, `#` for comments) is re-read when its
+    mtime changes, checked at most every reload_seconds; the automaton is
+    rebuilt off to the side and swapped in once complete.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        defaults: Sequence[str] = (),
+        path: Optional[Path] = None,
+        case_sensitive: bool = True,
+        reload_seconds: float = 5.0,
+    ) -> None:
+        self.name = name
+        self.defaults = tuple(defaults)
+        self.path = path
+        self.case_sensitive = case_sensitive
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._automaton = AhoCorasick(self.defaults, case_sensitive=case_sensitive)
+
+    def configure(self, *, path: Optional[Path] = None, reload_seconds: Optional[float] = None) -> None:
+        if path is not None:
+            self.path = Path(path)
+        if reload_seconds is not None:
+            self.reload_seconds = float(reload_seconds)
+        self.reload()
+
+    def _file_mtime(self) -> Optional[float]:
+        if self.path is None:
+            return None
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def reload(self) -> None:
+        with self._lock:
+            mtime = self._file_mtime()
+            patterns = list(self.defaults)
+            if mtime is not None:
+                try:
+                    patterns.extend(read_pattern_file(self.path))
+                except OSError as e:
+                    logger.error(f"Cannot read {self.name} list {self.path}: {e}")
+                    return
+            self._automaton = AhoCorasick(patterns, case_sensitive=self.case_sensitive)
+            self._mtime = mtime
+            self._checked_at = time.monotonic()
+        logger.info(f"{self.name} list loaded: {len(self._automaton)} patterns")
+
+    def maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_seconds:
+            return
+        self._checked_at = now
+        if self._file_mtime() != self._mtime:
+            self.reload()
+
+    def search(self, text: str) -> Optional[str]:
+        self.maybe_reload()
+        return self._automaton.search(text)
+
+    def find_all(self, text: str) -> List[str]:
+        self.maybe_reload()
+        return self._automaton.find_all(text)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "patterns": len(self._automaton),
+            "path": str(self.path) if self.path else None,
+            "loaded": self._mtime is not None,
+        }
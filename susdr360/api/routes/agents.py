@@ -3,7 +3,7 @@ from typing import Any, Dict, List, Optional
 
 from fastapi import APIRouter
 
-from ..agent_registry import list_agents
+from ..agent_registry import list_agents_async
 
 router = APIRouter()
 
@@ -28,7 +28,7 @@ def _compute_status(last_seen_iso: Optional[str], active_seconds: int = 120) ->
 
 @router.get("/", response_model=List[Dict[str, Any]])
 async def get_agents():
-    agents = list_agents()
+    agents = await list_agents_async()
     for a in agents:
         a["status"] = _compute_status(a.get("last_seen"))
     return agents
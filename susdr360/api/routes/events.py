@@ -3,19 +3,22 @@ SUSDR 360 - Routes des Événements
 Gestion des événements de sécurité via API REST
 """
 
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Query, Request
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import List, Optional, Dict, Any
+from typing import Iterator, List, Optional, Dict, Any, Tuple
 from datetime import datetime, timedelta
+import json
 import logging
+import zlib
 
 from ..models import (
     EventCreate, EventResponse, EventQuery, SuccessResponse, 
     ErrorResponse, PaginatedResponse, EventTypeEnum, SeverityEnum
 )
-from ...core.event_processor import EventProcessor, Event
-from ..agent_registry import upsert_agent, increment_events
+from ...core.event_processor import EventProcessor, Event, QueueFullError
+from ..agent_registry import accept_sequence, record_agent_event
 from ..detections_engine import process_linux_auth_event
+from ..storage import run_write
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -28,29 +31,54 @@ def get_event_processor(request: Request) -> EventProcessor:
         raise HTTPException(status_code=500, detail="EventProcessor not initialized")
     return event_processor
 
-@router.post("/ingest", response_model=SuccessResponse)
-async def ingest_event(
-    event_data: EventCreate,
-    background_tasks: BackgroundTasks,
-    event_processor: EventProcessor = Depends(get_event_processor),
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-):
-    """
-    Ingère un nouvel événement dans le système SUSDR 360
+
+def _queue_full(exc: QueueFullError) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="File d'ingestion pleine, réessayez plus tard",
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+# Événement reçu: (source, raw_data, timestamp ISO ou None, (flux, séquence) ou None)
+IngestItem = Tuple[str, Dict[str, Any], Optional[str], Optional[Tuple[str, int]]]
+
+
+def _agent_parsed_fields(raw: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Champs déjà extraits par l'agent (event_kind vide: ligne sans motif connu)"""
+    event_kind = raw.get('event_kind')
+    if not isinstance(event_kind, str):
+        return None
+    return {
+        'event_kind': event_kind,
+        'src_ip': str(raw.get('src_ip') or ''),
+        'username': str(raw.get('username') or ''),
+        'auth_method': str(raw.get('auth_method') or ''),
+        'command': str(raw.get('command') or ''),
+    }
+
+
+def _track_events(items: List[IngestItem]) -> List[IngestItem]:
+    """Détections linux_auth et registre des agents pour un lot d'événements
     
-    - **source**: Source de l'événement (ex: "windows_security", "firewall", "antivirus")
-    - **raw_data**: Données brutes de l'événement au format JSON
-    - **timestamp**: Timestamp optionnel (utilise l'heure actuelle si non fourni)
+    Exécuté sur le thread d'écriture SQLite: un seul saut de thread par lot.
+    Retourne les événements à traiter, sans les doublons déjà reçus (numéro
+    de séquence inférieur ou égal au dernier vu pour l'agent).
     """
-    try:
-        raw = event_data.raw_data or {}
+    kept = []
+    for item in items:
+        source, raw, observed_at, sequence = item
         hostname = str(raw.get('host') or raw.get('hostname') or raw.get('computer') or raw.get('Computer') or 'unknown')
         ip_address = str(raw.get('ip') or raw.get('ip_address') or raw.get('IpAddress') or '')
         os_name = str(raw.get('os') or raw.get('platform') or 'Linux')
         version = str(raw.get('agent_version') or raw.get('version') or '4.5.2')
         agent_id = str(raw.get('agent_id') or raw.get('agent') or hostname)
 
-        if event_data.source == 'linux_auth':
+        if sequence is not None and not accept_sequence(agent_id=agent_id, stream=sequence[0], seq=sequence[1]):
+            continue
+        kept.append(item)
+
+        if source == 'linux_auth':
             msg = str(raw.get('message') or '')
             if msg:
                 try:
@@ -58,35 +86,168 @@ async def ingest_event(
                         agent_id=agent_id,
                         hostname=hostname,
                         message=msg,
-                        observed_at_iso=(event_data.timestamp.isoformat() if event_data.timestamp else None),
+                        observed_at_iso=observed_at,
+                        parsed=_agent_parsed_fields(raw),
                     )
                 except Exception:
                     pass
 
         # Met à jour / crée l'agent dans le registre
-        upsert_agent(
+        record_agent_event(
             agent_id=agent_id,
             hostname=hostname,
             ip_address=ip_address,
             os_name=os_name,
             version=version,
             status='active',
-            seen_at_iso=(event_data.timestamp.isoformat() if event_data.timestamp else None),
+            seen_at_iso=observed_at,
         )
-        increment_events(agent_id, 1)
+    return kept
 
-        # Traitement asynchrone de l'événement
-        background_tasks.add_task(
-            event_processor.process_raw_event,
-            event_data.raw_data,
-            event_data.source
-        )
+
+async def _track_events_async(items: List[IngestItem]) -> List[IngestItem]:
+    return await run_write(_track_events, items)
+
+
+# Ingestion NDJSON: taille des lots remis au processeur et limites de sécurité
+NDJSON_CHUNK_SIZE = 500
+NDJSON_MAX_LINE_BYTES = 1024 * 1024
+NDJSON_MAX_ERRORS = 20
+
+
+def _parse_ndjson_line(line: bytes) -> Tuple[Optional[IngestItem], Optional[str]]:
+    """Validation rapide d'une ligne (mêmes règles que EventCreate)"""
+    try:
+        obj = json.loads(line)
+    except ValueError as e:
+        return None, f"JSON invalide: {e}"
+    if not isinstance(obj, dict):
+        return None, "objet JSON attendu"
+    source = obj.get('source')
+    if not isinstance(source, str) or not source:
+        return None, "champ 'source' manquant"
+    raw = obj.get('raw_data')
+    if not isinstance(raw, dict):
+        return None, "champ 'raw_data' (objet) manquant"
+    timestamp = obj.get('timestamp')
+    if timestamp is not None:
+        if not isinstance(timestamp, str):
+            return None, "champ 'timestamp' invalide"
+        try:
+            s = timestamp.strip()
+            timestamp = datetime.fromisoformat(s[:-1] + '+00:00' if s.endswith('Z') else s).isoformat()
+        except ValueError:
+            return None, "champ 'timestamp' invalide"
+    # Numéro de séquence optionnel des agents à livraison "au moins une fois"
+    seq = obj.get('seq')
+    sequence = None
+    if seq is not None:
+        stream = obj.get('stream', '')
+        if not isinstance(seq, int) or isinstance(seq, bool) or seq < 0 or not isinstance(stream, str):
+            return None, "champs 'seq'/'stream' invalides"
+        sequence = (stream, seq)
+    return (source, raw, timestamp, sequence), None
+
+
+class _LineSplitter:
+    """Découpe un flux d'octets (éventuellement gzip) en lignes NDJSON"""
+    
+    def __init__(self, gzipped: bool):
+        # 16 + MAX_WBITS: en-tête gzip; les membres concaténés sont gérés dans feed()
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+        self._buffer = b''
+        self._skipping = False
+        self._in_member = False
+    
+    def _inflate(self, data: bytes):
+        """Décompresse par blocs bornés (protection contre les bombes gzip)"""
+        while data:
+            self._in_member = True
+            out = self._decompressor.decompress(data, 64 * 1024)
+            yield out
+            if self._decompressor.eof:
+                data = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self._in_member = False
+            else:
+                data = self._decompressor.unconsumed_tail
+    
+    def feed(self, chunk: bytes) -> Iterator[Optional[bytes]]:
+        """Lignes complètes du morceau, produites au fil des blocs décompressés:
+        un petit morceau gzip très compressé n'est jamais déployé en entier"""
+        blocks = self._inflate(chunk) if self._decompressor is not None else (chunk,)
+        for block in blocks:
+            lines: List[Optional[bytes]] = []
+            self._split(block, lines)
+            yield from lines
+    
+    def _split(self, block: bytes, lines: List[Optional[bytes]]):
+        data = self._buffer + block if self._buffer else block
+        start = 0
+        while True:
+            end = data.find(b'\n', start)
+            if end < 0:
+                break
+            if self._skipping:
+                # Fin d'une ligne trop longue, signalée par None
+                self._skipping = False
+                lines.append(None)
+            else:
+                lines.append(data[start:end])
+            start = end + 1
+        self._buffer = data[start:]
+        if len(self._buffer) > NDJSON_MAX_LINE_BYTES:
+            # Ligne trop longue: ignorée jusqu'au prochain saut de ligne
+            self._skipping = True
+            self._buffer = b''
+    
+    def close(self) -> List[Optional[bytes]]:
+        lines = []
+        if self._decompressor is not None and self._in_member:
+            self._split(self._decompressor.flush(), lines)
+            if not self._decompressor.eof:
+                raise zlib.error("flux gzip tronqué")
+        if self._skipping:
+            lines.append(None)
+        elif self._buffer:
+            lines.append(self._buffer)
+        self._skipping = False
+        self._buffer = b''
+        return lines
+
+@router.post("/ingest", response_model=SuccessResponse)
+async def ingest_event(
+    event_data: EventCreate,
+    event_processor: EventProcessor = Depends(get_event_processor),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Ingère un nouvel événement dans le système SUSDR 360
+    
+    - **source**: Source de l'événement (ex: "windows_security", "firewall", "antivirus")
+    - **raw_data**: Données brutes de l'événement au format JSON
+    - **timestamp**: Timestamp optionnel (utilise l'heure actuelle si non fourni)
+    """
+    try:
+        # Mise en file pour traitement asynchrone par le pool de workers
+        event_processor.submit(event_data.raw_data, event_data.source)
+
+        # Détections et registre des agents (thread d'écriture SQLite), une
+        # fois l'événement accepté: un 429 ne laisse aucune trace
+        await _track_events_async([(
+            event_data.source,
+            event_data.raw_data or {},
+            event_data.timestamp.isoformat() if event_data.timestamp else None,
+            None,
+        )])
         
         return SuccessResponse(
             message=f"Événement de {event_data.source} ajouté à la file de traitement",
             data={"source": event_data.source, "timestamp": datetime.now().isoformat()}
         )
         
+    except QueueFullError as e:
+        raise _queue_full(e)
     except Exception as e:
         logger.error(f"Erreur lors de l'ingestion d'événement: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -94,8 +255,7 @@ async def ingest_event(
 @router.post("/ingest/batch", response_model=SuccessResponse)
 async def ingest_events_batch(
     events: List[EventCreate],
-    background_tasks: BackgroundTasks,
-    event_processor: EventProcessor = Depends(),
+    event_processor: EventProcessor = Depends(get_event_processor),
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
     """
@@ -118,13 +278,15 @@ async def ingest_events_batch(
                 events_by_source[source] = []
             events_by_source[source].append(event_data.raw_data)
         
-        # Traitement asynchrone par source
+        # Mise en file par source (tout ou rien si la file est saturée);
+        # aucun await entre la vérification et les dépôts
+        event_processor.ensure_capacity(len(events))
         for source, raw_events in events_by_source.items():
-            background_tasks.add_task(
-                event_processor.process_batch,
-                raw_events,
-                source
-            )
+            event_processor.submit_batch(raw_events, source)
+        await _track_events_async([
+            (e.source, e.raw_data or {}, e.timestamp.isoformat() if e.timestamp else None, None)
+            for e in events
+        ])
         
         return SuccessResponse(
             message=f"{len(events)} événements ajoutés à la file de traitement",
@@ -135,10 +297,105 @@ async def ingest_events_batch(
             }
         )
         
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise _queue_full(e)
     except Exception as e:
         logger.error(f"Erreur lors de l'ingestion en lot: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _flush_ndjson_chunk(event_processor: EventProcessor, items: List[IngestItem]) -> int:
+    """Remet un lot de lignes validées au processeur (attend si la file est pleine)
+    
+    Retourne le nombre de doublons écartés.
+    """
+    kept = await _track_events_async(items)
+    by_source: Dict[str, List[Dict[str, Any]]] = {}
+    for source, raw, _, _ in kept:
+        by_source.setdefault(source, []).append(raw)
+    for source, raw_events in by_source.items():
+        await event_processor.enqueue_batch(raw_events, source)
+    return len(items) - len(kept)
+
+@router.post("/ingest/ndjson", response_model=SuccessResponse)
+async def ingest_events_ndjson(
+    request: Request,
+    event_processor: EventProcessor = Depends(get_event_processor),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Ingère un flux NDJSON (un événement JSON par ligne), éventuellement gzip
+    
+    Le corps est lu et validé au fil de l'eau puis remis au processeur par
+    lots; sans limite de taille, le débit est réglé par la file d'ingestion.
+    Chaque ligne suit le format de /ingest: {"source", "raw_data", "timestamp"},
+    avec en option "stream" et "seq" pour écarter les renvois d'un agent.
+    """
+    encoding = request.headers.get('content-encoding', '').lower()
+    if encoding not in ('', 'identity', 'gzip', 'x-gzip'):
+        raise HTTPException(status_code=415, detail=f"Content-Encoding non supporté: {encoding}")
+    
+    splitter = _LineSplitter(gzipped=encoding in ('gzip', 'x-gzip'))
+    line_number = 0
+    accepted = 0
+    rejected = 0
+    duplicates = 0
+    errors = []
+    sources: Dict[str, int] = {}
+    chunk: List[IngestItem] = []
+    
+    def handle(line: Optional[bytes]):
+        nonlocal line_number, accepted, rejected
+        line_number += 1
+        if line is None:
+            item, error = None, f"ligne de plus de {NDJSON_MAX_LINE_BYTES} octets"
+        elif not line.strip():
+            return
+        else:
+            item, error = _parse_ndjson_line(line)
+        if item is None:
+            rejected += 1
+            if len(errors) < NDJSON_MAX_ERRORS:
+                errors.append({"line": line_number, "error": error})
+            return
+        accepted += 1
+        sources[item[0]] = sources.get(item[0], 0) + 1
+        chunk.append(item)
+    
+    try:
+        async for body_chunk in request.stream():
+            # Remis par lots de NDJSON_CHUNK_SIZE au fil de la décompression
+            for line in splitter.feed(body_chunk):
+                handle(line)
+                if len(chunk) >= NDJSON_CHUNK_SIZE:
+                    duplicates += await _flush_ndjson_chunk(event_processor, chunk)
+                    chunk = []
+        for line in splitter.close():
+            handle(line)
+        if chunk:
+            duplicates += await _flush_ndjson_chunk(event_processor, chunk)
+    except zlib.error as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Corps gzip invalide après {accepted} événements acceptés: {e}"
+        )
+    except Exception as e:
+        logger.error(f"Erreur lors de l'ingestion NDJSON: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return SuccessResponse(
+        message=f"{accepted - duplicates} événements ajoutés à la file de traitement, {rejected} rejetés, {duplicates} doublons",
+        data={
+            "accepted": accepted - duplicates,
+            "rejected": rejected,
+            "duplicates": duplicates,
+            "sources": sources,
+            "errors": errors,
+            "timestamp": datetime.now().isoformat()
+        }
+    )
+
 @router.get("/search", response_model=PaginatedResponse)
 async def search_events(
     start_time: Optional[datetime] = Query(None, description="Début de la période de recherche"),
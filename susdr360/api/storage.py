@@ -0,0 +1,341 @@
+import asyncio
+import atexit
+import functools
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+def data_dir() -> Path:
+    return Path(__file__).resolve().parents[1] / "data"
+
+
+class SQLiteStore:
+    """Long-lived, per-thread SQLite connections on a WAL database.
+
+    The schema is applied once per process (on first use or explicitly via
+    migrate()); every thread then reuses its own connection, whose statement
+    cache keeps the registries' SQL prepared.
+    """
+
+    def __init__(self, path: Path, schema: Sequence[str], cached_statements: int = 256) -> None:
+        self.path = path
+        self._schema = tuple(schema)
+        self._cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        self._migrated = False
+
+    def _open(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            str(self.path),
+            timeout=30.0,
+            check_same_thread=False,
+            cached_statements=self._cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def migrate(self) -> None:
+        if self._migrated:
+            return
+        with self._lock:
+            if self._migrated:
+                return
+            conn = self._open()
+            try:
+                with conn:
+                    for statement in self._schema:
+                        conn.execute(statement)
+            finally:
+                conn.close()
+            self._migrated = True
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.migrate()
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self.connection()
+        with conn:
+            yield conn
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> None:
+        with self.transaction() as conn:
+            conn.execute(sql, params)
+
+    def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[Dict[str, Any]]:
+        row = self.connection().execute(sql, params).fetchone()
+        return dict(row) if row else None
+
+    def fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        return [dict(r) for r in self.connection().execute(sql, params).fetchall()]
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+
+
+class BatchWriter:
+    """Write-behind buffer for one store, flushed by group commit.
+
+    Rows are grouped per SQL statement and written with executemany() in a
+    single transaction once max_rows rows are pending or max_delay_ms after
+    the first pending row, whichever comes first. coalesce() keeps one row
+    per key (optionally merged with the pending one) until the next flush.
+    """
+
+    def __init__(self, store: SQLiteStore, max_rows: int = 500, max_delay_ms: int = 200) -> None:
+        self.store = store
+        self.max_rows = max_rows
+        self.max_delay_ms = max_delay_ms
+        self._groups: Dict[str, Any] = {}
+        self._pending_rows = 0
+        self._first_pending_at = 0.0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.stats = {"flushes": 0, "rows_written": 0, "flush_errors": 0}
+
+    def add(self, sql: str, params: Sequence[Any]) -> None:
+        with self._cond:
+            self._groups.setdefault(sql, []).append(params)
+            self._row_added()
+
+    def coalesce(
+        self,
+        sql: str,
+        key: Any,
+        params: Sequence[Any],
+        merge: Optional[Callable[[Sequence[Any], Sequence[Any]], Sequence[Any]]] = None,
+    ) -> None:
+        with self._cond:
+            group = self._groups.setdefault(sql, {})
+            previous = group.get(key)
+            if previous is None:
+                group[key] = params
+                self._row_added()
+            else:
+                group[key] = merge(previous, params) if merge else params
+
+    def _row_added(self) -> None:
+        if self._pending_rows == 0:
+            self._first_pending_at = time.monotonic()
+        self._pending_rows += 1
+        if self._thread is None and not self._closed:
+            self._thread = threading.Thread(target=self._run, name="sqlite-batch-writer", daemon=True)
+            self._thread.start()
+        # Wake the worker on the first pending row so its timed wait starts,
+        # and again once the batch is full
+        if self._pending_rows == 1 or self._pending_rows >= self.max_rows:
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._pending_rows >= self.max_rows:
+                        break
+                    if self._pending_rows:
+                        remaining = self._first_pending_at + self.max_delay_ms / 1000.0 - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed and not self._pending_rows:
+                    return
+            self.flush()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._cond:
+                groups, self._groups = self._groups, {}
+                self._pending_rows = 0
+            if not groups:
+                return
+
+            rows_written = 0
+            try:
+                with self.store.transaction() as conn:
+                    for sql, rows in groups.items():
+                        batch = list(rows.values()) if isinstance(rows, dict) else rows
+                        conn.executemany(sql, batch)
+                        rows_written += len(batch)
+            except sqlite3.OperationalError as e:
+                # Busy/locked/disk errors: put the rows back for the next flush
+                logger.error(f"SQLite batch flush failed, retrying later: {e}")
+                self.stats["flush_errors"] += 1
+                self._requeue(groups)
+                return
+            except Exception as e:
+                logger.error(f"SQLite batch flush failed, dropping {sum(len(r) for r in groups.values())} rows: {e}")
+                self.stats["flush_errors"] += 1
+                return
+
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += rows_written
+
+    def _requeue(self, groups: Dict[str, Any]) -> None:
+        with self._cond:
+            newer, self._groups = self._groups, {}
+            for source in (groups, newer):
+                for sql, rows in source.items():
+                    if isinstance(rows, dict):
+                        self._groups.setdefault(sql, {}).update(rows)
+                    else:
+                        self._groups.setdefault(sql, []).extend(rows)
+            self._pending_rows = sum(len(r) for r in self._groups.values())
+            self._first_pending_at = time.monotonic()
+            self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return self._pending_rows
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+
+_batch_writers: List[BatchWriter] = []
+
+
+def batch_writer(store: SQLiteStore, max_rows: int = 500, max_delay_ms: int = 200) -> BatchWriter:
+    writer = BatchWriter(store, max_rows=max_rows, max_delay_ms=max_delay_ms)
+    _batch_writers.append(writer)
+    return writer
+
+
+def configure_batching(max_rows: Optional[int] = None, max_delay_ms: Optional[int] = None) -> None:
+    for writer in _batch_writers:
+        if max_rows:
+            writer.max_rows = int(max_rows)
+        if max_delay_ms:
+            writer.max_delay_ms = int(max_delay_ms)
+
+
+def flush_all() -> None:
+    for writer in _batch_writers:
+        writer.flush()
+
+
+# Async facade: all writes go through a single dedicated thread (SQLite allows
+# one writer at a time anyway), reads through a small pool. Request handlers
+# await these instead of touching the disk on the event loop thread.
+_executor_lock = threading.Lock()
+_writer: Optional[ThreadPoolExecutor] = None
+_readers: Optional[ThreadPoolExecutor] = None
+
+
+def _writer_executor() -> ThreadPoolExecutor:
+    global _writer
+    if _writer is None:
+        with _executor_lock:
+            if _writer is None:
+                _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+    return _writer
+
+
+def _reader_executor() -> ThreadPoolExecutor:
+    global _readers
+    if _readers is None:
+        with _executor_lock:
+            if _readers is None:
+                _readers = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sqlite-reader")
+    return _readers
+
+
+async def run_write(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_writer_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def run_read(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_reader_executor(), functools.partial(func, *args, **kwargs))
+
+
+class PeriodicWrite:
+    """Runs func on the writer thread every interval_seconds until cancel().
+
+    A small timer thread only submits the call, so func is serialized with
+    every other write; a run that is still queued delays the next tick.
+    """
+
+    def __init__(self, interval_seconds: float, func: Callable[[], Any], *, name: str = "sqlite-periodic-write") -> None:
+        self.interval_seconds = interval_seconds
+        self.func = func
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        with _executor_lock:
+            _periodic_writes.append(self)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval_seconds):
+            try:
+                _writer_executor().submit(self.func).result()
+            except Exception as e:
+                logger.error(f"Periodic write {self._thread.name} failed: {e}")
+
+    def cancel(self) -> None:
+        self._stopped.set()
+        with _executor_lock:
+            if self in _periodic_writes:
+                _periodic_writes.remove(self)
+
+
+_periodic_writes: List[PeriodicWrite] = []
+
+
+def shutdown(wait: bool = True) -> None:
+    global _writer, _readers
+    for periodic in list(_periodic_writes):
+        periodic.cancel()
+    with _executor_lock:
+        executors = [e for e in (_writer, _readers) if e is not None]
+        _writer = None
+        _readers = None
+    for executor in executors:
+        executor.shutdown(wait=wait)
+    # Pending write-behind rows are made durable once no more writes can come in
+    for writer in _batch_writers:
+        writer.close()
+
+
+atexit.register(flush_all)
